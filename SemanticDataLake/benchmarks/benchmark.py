@@ -0,0 +1,327 @@
+import os
+import io
+import gc
+import sys
+import json
+import time
+import platform
+import datetime
+import argparse
+import statistics
+import subprocess
+import contextlib
+import numpy as np
+import pandas as pd
+from rdflib import URIRef
+from models.KG import KG, ns_project
+import generators.KG_generator as KG_generator
+import generators.DS_generator as DS_generator
+import executors.mapper_auto as mapper_auto
+import executors.profiler as profiler
+import executors.hashing as hashing
+
+FIXTURE_FOLDER = "../cache/benchmarks/"
+RESULTS_FOLDER = "../logs/benchmarks/"
+
+# Fixtures: the KG has DIMENSIONS x LEVELS levels and POPULATION children per member, the datasets are generated for
+# each combination of rows, columns and noise percentage
+DIMENSIONS = 5
+LEVELS = 3
+POPULATION = 10
+NUM_ROWS = [100000]
+NUM_COLS = [20]
+PERC_NOISE = [0]
+PERC_DIMENSIONS = 0.2
+SEED = 42
+
+# Measurement
+REPEAT = 5
+WARMUP = 1
+# Number of candidate signatures the joinability index is estimated against
+NUM_CANDIDATES = 1000
+# A benchmark regresses when its median is slower than the baseline by more than TOLERANCE (relative) and
+# MIN_DIFFERENCE (seconds), so that noise on very fast benchmarks is not reported
+TOLERANCE = 0.1
+MIN_DIFFERENCE = 0.001
+
+RESULTS_VERSION = 1
+
+
+#########################################################################
+# Fixtures
+#########################################################################
+def get_kg_fixture(dimensions, levels, population, folder=FIXTURE_FOLDER):
+    """Returns the path of the KG fixture with the given shape, generating it with ``KG_generator`` if missing. The
+    generator is deterministic, so the same shape always gives the same file.
+    """
+    path = os.path.join(folder, "knowledge_graph_D%d_L%d_%d.ttl" % (dimensions, levels, population))
+    if not os.path.exists(path):
+        os.makedirs(folder, exist_ok=True)
+        with contextlib.redirect_stdout(io.StringIO()):
+            KG_generator.streamKG(path, dimensions, levels, population, 1)
+    return path
+
+
+def get_ds_fixture(kg, num_rows, num_cols, noise, seed=SEED, folder=FIXTURE_FOLDER):
+    """Returns the path of the dataset fixture with the given shape, generating it with ``DS_generator`` if missing.
+    The generator is seeded, so the same shape and seed always give the same file. Dimension values are written as
+    member fragments, as expected by the mapping.
+    """
+    path = os.path.join(folder, "ds_C%d_R%d_n%d_s%d.csv" % (num_cols, num_rows, noise, seed))
+    if not os.path.exists(path):
+        os.makedirs(folder, exist_ok=True)
+        rng = np.random.default_rng(seed)
+        plan = DS_generator.plan_ds(num_rows, num_cols, PERC_DIMENSIONS, noise / 100.0, kg, rng, fragments=True)
+        DS_generator.write_ds(path, plan, rng)
+    return path
+
+
+#########################################################################
+# Measurement
+#########################################################################
+def measure(func, repeat=REPEAT, warmup=WARMUP):
+    """Runs a function ``warmup`` times, then times ``repeat`` runs with the garbage collector disabled
+
+    :param func: the function to time, without arguments
+    :type func: function
+    :param repeat: the number of timed runs
+    :type repeat: int
+    :param warmup: the number of untimed runs
+    :type warmup: int
+    :returns: a dictionary including the timed runs, in seconds, and their min, median, mean and stdev
+    :rtype: dict
+    """
+    for _ in range(warmup):
+        func()
+    runs = []
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            runs.append(time.perf_counter() - start)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return {"runs": runs, "min": min(runs), "median": statistics.median(runs), "mean": statistics.mean(runs),
+            "stdev": statistics.stdev(runs) if len(runs) > 1 else 0.0}
+
+
+def get_environment():
+    # Where the results come from, so that runs on different machines or versions are not compared blindly
+    import rdflib
+    import scipy
+    import datasketch
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+    return {"python": platform.python_version(), "platform": platform.platform(), "processor": platform.processor(),
+            "cpu_count": os.cpu_count(), "commit": commit,
+            "packages": {"numpy": np.__version__, "pandas": pd.__version__, "scipy": scipy.__version__,
+                         "rdflib": rdflib.__version__, "datasketch": datasketch.__version__}}
+
+
+#########################################################################
+# Micro-benchmarks
+#########################################################################
+def bench_kg(kg_file, timer):
+    results = dict()
+    timer(results, "kg_load", lambda: KG(kg_file))
+    timer(results, "kg_load_lean", lambda: KG(kg_file, lean=True))
+    # The first load writes the snapshot, the timed ones read it
+    KG(kg_file, snapshot=True)
+    timer(results, "kg_load_snapshot", lambda: KG(kg_file, snapshot=True))
+    return results
+
+
+def bench_lsh(kg, timer):
+    results = dict()
+    timer(results, "lsh_signatures", lambda: mapper_auto.get_level_signatures(kg))
+    signatures = mapper_auto.get_level_signatures(kg)
+    timer(results, "lsh_build", lambda: mapper_auto.initialize_lsh(kg, signatures))
+    return results, mapper_auto.initialize_lsh(kg, signatures), signatures
+
+
+def bench_source(ds_file, kg, lshensemble, signatures, timer, num_candidates=NUM_CANDIDATES):
+    results = dict()
+    max_distinct = mapper_auto.get_max_distinct(signatures)
+    df = pd.read_csv(ds_file, dtype=str, keep_default_na=False, na_filter=False)
+    columns = list(df.columns)
+    # Dimension columns are named after the level their values come from
+    levels = {col: URIRef(ns_project + col) for col in columns if col in signatures}
+
+    def hash_columns():
+        sketches = dict()
+        for col in columns:
+            sketch = mapper_auto.ColumnSketch(mapper_auto.NUM_PERM, max_distinct)
+            for start in range(0, len(df.index), mapper_auto.CHUNK_SIZE):
+                sketch.update(df[col].iloc[start:start + mapper_auto.CHUNK_SIZE])
+            sketches[col] = sketch
+        return sketches
+
+    timer(results, "scan_source", lambda: mapper_auto.scan_source(ds_file, max_distinct))
+    timer(results, "column_hashing", hash_columns)
+    sketches = hash_columns()
+    queries = [(sketches[col].minhash, sketches[col].size()) for col in columns]
+    timer(results, "lsh_query", lambda: [list(lshensemble.query(m, size)) for m, size in queries])
+
+    member_indexes = {col: kg.get_member_index(level, fragmentKeys=True) for col, level in levels.items()}
+
+    def profile_columns():
+        for col, level in levels.items():
+            frequency, _ = profiler.profile_from_values(df[col], member_indexes[col])
+            profiler.profile_pyramid(kg, level, frequency)
+
+    timer(results, "profiling", profile_columns)
+
+    dimension_cols = sorted(levels)
+    timer(results, "combined_hashing",
+          lambda: hashing.combined_minhash(df, dimension_cols, mapper_auto.NUM_PERM))
+
+    # Candidates are the combined signatures of row samples of the source, repeated up to the requested number
+    combined, size = hashing.combined_minhash(df, dimension_cols, mapper_auto.NUM_PERM)
+    rng = np.random.default_rng(SEED)
+    samples = []
+    for _ in range(min(num_candidates, 32)):
+        rows = rng.choice(len(df.index), size=max(len(df.index) // 4, 1), replace=False)
+        samples.append(hashing.combined_minhash(df.iloc[rows], dimension_cols, mapper_auto.NUM_PERM))
+    candidates = [samples[i % len(samples)] for i in range(num_candidates)]
+    matrix = np.array([m.hashvalues for m, _ in candidates], dtype=np.uint64)
+    candidate_sizes = [s for _, s in candidates]
+    timer(results, "ji_pairwise",
+          lambda: [hashing.estimate_containment(m, s, combined, size) for m, s in candidates])
+    timer(results, "ji_batch", lambda: hashing.batch_ji(combined, size, matrix, candidate_sizes))
+    return results
+
+
+def run(args):
+    kg_file = get_kg_fixture(args.dimensions, args.levels, args.population)
+    kg = KG(kg_file)
+    fixtures = {"kg": {"dimensions": args.dimensions, "levels": args.levels, "population": args.population},
+                "datasets": []}
+    benchmarks = dict()
+    label = ["D%d_L%d_%d" % (args.dimensions, args.levels, args.population), fixtures["kg"]]
+
+    def timer(results, name, func):
+        # Times a benchmark, unless it is not among the selected ones, under its name and the current fixture
+        if args.only and name not in args.only:
+            return
+        key = name + "[" + label[0] + "]"
+        result = measure(func, args.repeat, args.warmup)
+        result["params"] = label[1]
+        results[key] = result
+        benchmarks[key] = result
+        print("%-40s median %10.4f s   min %10.4f s" % (key, result["median"], result["min"]))
+
+    bench_kg(kg_file, timer)
+    _, lshensemble, signatures = bench_lsh(kg, timer)
+    for num_cols in args.cols:
+        for num_rows in args.rows:
+            for noise in args.noise:
+                ds_file = get_ds_fixture(kg, num_rows, num_cols, noise, args.seed)
+                params = {"rows": num_rows, "cols": num_cols, "noise": noise, "seed": args.seed}
+                fixtures["datasets"].append(params)
+                label[:] = ["C%d_R%d_n%d" % (num_cols, num_rows, noise), params]
+                bench_source(ds_file, kg, lshensemble, signatures, timer, args.candidates)
+
+    output = {"version": RESULTS_VERSION, "timestamp": str(datetime.datetime.now()),
+              "environment": get_environment(), "fixtures": fixtures,
+              "settings": {"repeat": args.repeat, "warmup": args.warmup, "candidates": args.candidates},
+              "benchmarks": benchmarks}
+    out = args.out
+    if out is None:
+        out = os.path.join(RESULTS_FOLDER, "benchmark_" + datetime.datetime.now().strftime("%Y%m%d_%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(output, f, indent=2)
+    print("Results written to", out)
+    if args.compare:
+        return compare(load_results(args.compare), output, args.tolerance)
+    return 0
+
+
+#########################################################################
+# Comparison
+#########################################################################
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(baseline, current, tolerance=TOLERANCE, min_difference=MIN_DIFFERENCE):
+    """Compares the medians of two runs and prints the ratio of each benchmark found in both
+
+    :param baseline: the results of the reference run
+    :type baseline: dict
+    :param current: the results of the run to check
+    :type current: dict
+    :param tolerance: the relative slowdown above which a benchmark regresses
+    :type tolerance: float
+    :param min_difference: the slowdown, in seconds, below which a benchmark never regresses
+    :type min_difference: float
+    :returns: the number of regressions
+    :rtype: int
+    """
+    if baseline["environment"] != current["environment"]:
+        print("Warning: the runs come from different environments or commits")
+    regressions = 0
+    print("%-40s %12s %12s %8s" % ("benchmark", "baseline", "current", "ratio"))
+    for name, result in current["benchmarks"].items():
+        if name not in baseline["benchmarks"]:
+            print("%-40s %12s %12.4f %8s  new" % (name, "-", result["median"], "-"))
+            continue
+        before = baseline["benchmarks"][name]["median"]
+        after = result["median"]
+        ratio = after / before if before > 0 else float("inf")
+        status = ""
+        if ratio > 1 + tolerance and after - before > min_difference:
+            status = "REGRESSION"
+            regressions = regressions + 1
+        elif ratio < 1 - tolerance and before - after > min_difference:
+            status = "faster"
+        print("%-40s %12.4f %12.4f %8.2f  %s" % (name, before, after, ratio, status))
+    for name in baseline["benchmarks"]:
+        if name not in current["benchmarks"]:
+            print("%-40s %12.4f %12s %8s  missing" % (name, baseline["benchmarks"][name]["median"], "-", "-"))
+    print(str(regressions) + " regression(s)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of the Semantic Data Lake on generated fixtures")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run", help="run the benchmarks and write the results as JSON")
+    run_parser.add_argument("--dimensions", type=int, default=DIMENSIONS, help="number of dimensions of the KG")
+    run_parser.add_argument("--levels", type=int, default=LEVELS, help="number of levels of each dimension")
+    run_parser.add_argument("--population", type=int, default=POPULATION, help="number of children of each member")
+    run_parser.add_argument("--rows", type=int, nargs="+", default=NUM_ROWS, help="numbers of rows of the datasets")
+    run_parser.add_argument("--cols", type=int, nargs="+", default=NUM_COLS, help="numbers of columns of the datasets")
+    run_parser.add_argument("--noise", type=int, nargs="+", default=PERC_NOISE, help="noise percentages")
+    run_parser.add_argument("--seed", type=int, default=SEED, help="seed of the dataset generator")
+    run_parser.add_argument("--repeat", type=int, default=REPEAT, help="number of timed runs of each benchmark")
+    run_parser.add_argument("--warmup", type=int, default=WARMUP, help="number of untimed runs of each benchmark")
+    run_parser.add_argument("--candidates", type=int, default=NUM_CANDIDATES, help="number of JI candidates")
+    run_parser.add_argument("--only", nargs="+", help="names of the benchmarks to keep, e.g. lsh_query profiling")
+    run_parser.add_argument("--out", help="path of the JSON results (default is a timestamped file in "
+                                          + RESULTS_FOLDER + ")")
+    run_parser.add_argument("--compare", help="path of the JSON results of a baseline run")
+    run_parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="relative slowdown of a regression")
+    compare_parser = subparsers.add_parser("compare", help="compare the JSON results of two runs")
+    compare_parser.add_argument("baseline", help="path of the JSON results of the baseline run")
+    compare_parser.add_argument("current", help="path of the JSON results of the run to check")
+    compare_parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="relative slowdown of a regression")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        regressions = run(args)
+    else:
+        regressions = compare(load_results(args.baseline), load_results(args.current), args.tolerance)
+    # A non-zero exit status lets a script or a CI job stop on regressions
+    sys.exit(1 if regressions > 0 else 0)
+
+
+if __name__ == "__main__":
+    main()
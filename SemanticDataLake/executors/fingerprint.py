@@ -0,0 +1,101 @@
+import os
+import hashlib
+
+# Size of the blocks of a file that are hashed separately
+BLOCK_SIZE = 1 << 23
+
+UNCHANGED = "unchanged"
+APPENDED = "appended"
+MODIFIED = "modified"
+MISSING = "missing"
+
+
+def block_hashes(path, length, block_size=BLOCK_SIZE, offset=0):
+    """Returns the hashes of the blocks of ``length`` bytes of a file
+
+    :param path: the path of the file
+    :type path: str
+    :param length: the number of bytes to hash
+    :type length: int
+    :param block_size: the size of the blocks (default is ``BLOCK_SIZE``)
+    :type block_size: int
+    :param offset: the position of the first byte to hash (default is 0)
+    :type offset: int
+    :returns: the list of hexadecimal hashes, one per block (the last block can be shorter)
+    :rtype: list[str]
+    """
+    hashes = []
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        remaining = length
+        while remaining > 0:
+            block = f.read(min(block_size, remaining))
+            if len(block) == 0:
+                break
+            hashes.append(hashlib.blake2b(block, digest_size=8).hexdigest())
+            remaining = remaining - len(block)
+    return hashes
+
+
+def fingerprint(path, block_size=BLOCK_SIZE):
+    """Returns the fingerprint of a file, i.e. its size, its modification time and the hashes of its blocks
+
+    :param path: the path of the file
+    :type path: str
+    :param block_size: the size of the blocks (default is ``BLOCK_SIZE``)
+    :type block_size: int
+    :returns: a dictionary including size, mtime, block_size and blocks
+    :rtype: dict
+    """
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime_ns, "block_size": block_size,
+            "blocks": block_hashes(path, stat.st_size, block_size)}
+
+
+def extend(path, previous):
+    """Returns the fingerprint of a file that has only been appended to since a previous fingerprint, hashing again
+    only the last, partial block and the new ones
+
+    :param path: the path of the file
+    :type path: str
+    :param previous: the fingerprint, as returned by ``fingerprint``
+    :type previous: dict
+    :returns: a dictionary including size, mtime, block_size and blocks
+    :rtype: dict
+    """
+    stat = os.stat(path)
+    block_size = previous["block_size"]
+    start = (previous["size"] // block_size) * block_size
+    blocks = previous["blocks"][:start // block_size] + block_hashes(path, stat.st_size - start, block_size, start)
+    return {"size": stat.st_size, "mtime": stat.st_mtime_ns, "block_size": block_size, "blocks": blocks}
+
+
+def detect_change(path, previous):
+    """Compares a file with a fingerprint taken before. Size and modification time are checked first, and the blocks
+    are hashed only when they differ. A file is considered appended when its first bytes are unchanged and they
+    ended with a complete line.
+
+    :param path: the path of the file
+    :type path: str
+    :param previous: the fingerprint, as returned by ``fingerprint``
+    :type previous: dict
+    :returns: one of ``UNCHANGED``, ``APPENDED``, ``MODIFIED`` and ``MISSING``
+    :rtype: str
+    """
+    if not os.path.exists(path):
+        return MISSING
+    stat = os.stat(path)
+    if stat.st_size == previous["size"] and stat.st_mtime_ns == previous["mtime"]:
+        return UNCHANGED
+    if stat.st_size < previous["size"]:
+        return MODIFIED
+    if block_hashes(path, previous["size"], previous["block_size"]) != previous["blocks"]:
+        return MODIFIED
+    if stat.st_size == previous["size"]:
+        return UNCHANGED
+    if previous["size"] > 0:
+        with open(path, 'rb') as f:
+            f.seek(previous["size"] - 1)
+            if f.read(1) != b"\n":
+                return MODIFIED
+    return APPENDED
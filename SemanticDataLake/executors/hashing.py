@@ -0,0 +1,141 @@
+import math
+import numpy as np
+import pandas as pd
+from datasketch import MinHash
+
+# Number of hash values passed at once to MinHash.update_batch, which allocates a (batch x num_perm) matrix
+HASH_BATCH = 65536
+# Confidence level of the bounds of the joinability index
+CONFIDENCE = 0.95
+
+_FNV_OFFSET = np.uint64(0xcbf29ce484222325)
+_FNV_PRIME = np.uint64(0x100000001b3)
+
+
+def _identity(h):
+    # The values fed to the MinHash are already hashed
+    return h
+
+
+def row_hashes(df, columns):
+    """Returns one 64-bit hash per row, combining the hashes of the native arrays of the given columns. No string is
+    built for the rows, and the hashes do not change across runs.
+
+    :param df: the DataFrame
+    :type df: pandas.DataFrame
+    :param columns: the columns to combine, in order
+    :type columns: list
+    :returns: the array of row hashes
+    :rtype: numpy.ndarray
+    """
+    hashes = np.full(len(df.index), _FNV_OFFSET, dtype=np.uint64)
+    for col in columns:
+        values = df[col]
+        hashes *= _FNV_PRIME
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            # Categories are hashed once and taken by code, giving the same hashes as the values
+            hashes ^= pd.util.hash_array(values.array)
+        else:
+            hashes ^= pd.util.hash_array(values.to_numpy())
+    return hashes
+
+
+def minhash_from_hashes(hashes, num_perm, minhash=None):
+    """Updates (or creates) a MinHash with the distinct values of an array of 64-bit hashes
+
+    :param hashes: the array of hashes
+    :type hashes: numpy.ndarray
+    :param num_perm: the number of permutations of the MinHash
+    :type num_perm: int
+    :param minhash: the MinHash to update, as returned by this function (default is None, i.e. a new one is created)
+    :type minhash: MinHash
+    :returns: a tuple with the MinHash and the number of distinct hashes
+    :rtype: tuple
+    """
+    if minhash is None:
+        minhash = MinHash(num_perm, hashfunc=_identity)
+    distinct = np.unique(hashes)
+    # MinHash permutations work on 32-bit values
+    folded = (distinct ^ (distinct >> np.uint64(32))) & np.uint64(0xffffffff)
+    for start in range(0, len(folded), HASH_BATCH):
+        minhash.update_batch(folded[start:start + HASH_BATCH])
+    return minhash, len(distinct)
+
+
+def combined_minhash(df, columns, num_perm):
+    """Returns the combined MinHash of a multi-column schema, built from the row hashes of the given columns. Combined
+    signatures are comparable only with other signatures built by this function.
+
+    :param df: the DataFrame
+    :type df: pandas.DataFrame
+    :param columns: the columns of the schema, in order
+    :type columns: list
+    :param num_perm: the number of permutations of the MinHash
+    :type num_perm: int
+    :returns: a tuple with the MinHash and the number of distinct rows
+    :rtype: tuple
+    """
+    return minhash_from_hashes(row_hashes(df, columns), num_perm)
+
+
+def _containment_from_jaccard(jaccard, size_s1, size_s2):
+    # From |S1 ∩ S2| = J * |S1 ∪ S2| and |S1 ∪ S2| = |S1| + |S2| - |S1 ∩ S2|
+    size_s2 = np.maximum(size_s2, 1)
+    containment = jaccard * (size_s1 + size_s2) / ((1.0 + jaccard) * size_s2)
+    return np.clip(containment, 0.0, 1.0)
+
+
+def _jaccard_error(num_perm):
+    # Hoeffding bound on the MinHash estimate of the Jaccard similarity, holding with probability CONFIDENCE
+    return math.sqrt(math.log(2.0 / (1.0 - CONFIDENCE)) / (2.0 * num_perm))
+
+
+def estimate_containment(m1, size_s1, m2, size_s2):
+    """Estimates the containment of S2 in S1 (i.e. the joinability index) from their MinHash signatures and cardinalities
+
+    :param m1: the MinHash of S1
+    :type m1: MinHash
+    :param size_s1: the number of distinct items in S1
+    :type size_s1: int
+    :param m2: the MinHash of S2
+    :type m2: MinHash
+    :param size_s2: the number of distinct items in S2
+    :type size_s2: int
+    :returns: a tuple with the estimated containment and its lower and upper bounds at the CONFIDENCE level
+    :rtype: tuple
+    """
+    if size_s2 == 0:
+        return 0.0, 0.0, 0.0
+    jaccard = m1.jaccard(m2)
+    error = _jaccard_error(len(m1))
+    return (float(_containment_from_jaccard(jaccard, size_s1, size_s2)),
+            float(_containment_from_jaccard(max(jaccard - error, 0.0), size_s1, size_s2)),
+            float(_containment_from_jaccard(min(jaccard + error, 1.0), size_s1, size_s2)))
+
+
+def batch_ji(query, query_size, candidates, candidate_sizes):
+    """Estimates the joinability index of one source against N candidates in a single vectorized operation, i.e.
+    the containment of the source in each candidate
+
+    :param query: the MinHash of the source
+    :type query: MinHash
+    :param query_size: the number of distinct items in the source
+    :type query_size: int
+    :param candidates: the hash values of the candidates' MinHashes, as a N x num_perm array (or a list of MinHash)
+    :type candidates: numpy.ndarray
+    :param candidate_sizes: the number of distinct items in each candidate
+    :type candidate_sizes: array-like
+    :returns: a tuple with the arrays of estimated joinability indexes and their lower and upper bounds
+    :rtype: tuple
+    """
+    if not isinstance(candidates, np.ndarray):
+        candidates = np.array([c.hashvalues for c in candidates], dtype=np.uint64)
+    candidate_sizes = np.asarray(candidate_sizes, dtype=np.float64)
+    if len(candidates) == 0 or query_size == 0:
+        zeros = np.zeros(len(candidates))
+        return zeros, zeros, zeros
+    jaccard = np.mean(candidates == query.hashvalues[np.newaxis, :], axis=1)
+    error = _jaccard_error(len(query))
+    return (_containment_from_jaccard(jaccard, candidate_sizes, query_size),
+            _containment_from_jaccard(np.maximum(jaccard - error, 0.0), candidate_sizes, query_size),
+            _containment_from_jaccard(np.minimum(jaccard + error, 1.0), candidate_sizes, query_size))
@@ -7,6 +7,7 @@ import numpy as np
 from rdflib.plugins.sparql.parserutils import value
 
 from models.KG import KG
+import executors.hashing as hashing
 
 DATASET_FOLDER = "../datasets/join_experiment/"
 GRAPH_FOLDER = "../kg/"
@@ -97,12 +98,7 @@ def join_test(s1, rows_S1, directory):
     if COMBINED:
         print("\t2. Calculating combined MinHash for S1...")
         # 2. Combined MinHashing of the schema of S1
-        combined_s1 = MinHash(NUM_PERM)
-        df_combined_s1 = s1[dimension_cols[0]].map(str)
-        for col in dimension_cols[1:]:
-            df_combined_s1 = df_combined_s1 + "_" + s1[col].map(str)
-        values_set_s1 = set(df_combined_s1.tolist())
-        combined_s1.update_batch([s.encode('utf8') for s in values_set_s1])
+        combined_s1, distinct_s1 = hashing.combined_minhash(s1, dimension_cols, NUM_PERM)
 
     print("\t3. Generation of Dataframes for S2...")
     s2 = s1.copy(deep=True)
@@ -131,12 +127,7 @@ def join_test(s1, rows_S1, directory):
 
                 # 5. Combined MinHash for S2
                 if COMBINED:
-                    combined_s2 = MinHash(NUM_PERM)
-                    df_combined_s2 = s2_[dimension_cols[0]].map(str)
-                    for col in dimension_cols[1:]:
-                        df_combined_s2 = df_combined_s2 + "_" + s2_[col].map(str)
-                    values_set_s2 = set(df_combined_s2.tolist())
-                    combined_s2.update_batch([s.encode('utf8') for s in values_set_s2])
+                    combined_s2, distinct_s2 = hashing.combined_minhash(s2_, dimension_cols, NUM_PERM)
 
                 #6. Calculation of join
                 print("\t\tCalculating join and JI between S1 and S2....")
@@ -152,7 +143,7 @@ def join_test(s1, rows_S1, directory):
 
                 #7. Calculation of joinability index
                 start_ji = time.time()
-                ji = calculate_ji(combined_s1,rows_S1,combined_s2,rows_S2)
+                ji = calculate_ji(combined_s1,distinct_s1,combined_s2,distinct_s2)
                 end_ji = time.time() - start_ji
 
                 #start_inter = time.time()
@@ -178,29 +169,11 @@ def join_test(s1, rows_S1, directory):
 
 
 def calculate_ji(combined_s1, size_s1, combined_s2, size_s2):
-    stop = False
-    first = 0.0
-    last = 1.0
-    delta = 0.049
-    ji = 0
-    # The termination criteria for the dychotomic search is that we got a delta <0.05
-    while first <= (last - delta):
-        found = False
-        q = (first + last) / 2
-        lshensemble = MinHashLSHEnsemble(threshold=q, num_perm=NUM_PERM, num_part=NUM_PART)
-        lshensemble.index([("s1", combined_s1, size_s1)])
-        for k in lshensemble.query(combined_s2, size_s2):
-            print(k)
-            found = True
-            ji = q
-        if (found):
-            first = q
-        else:
-            last = q
-
-    #print("Result:\n\tsources joinable with containment > " + str(sure))
+    # Estimated containment of S2 in S1, straight from the two signatures
+    ji, _, _ = hashing.estimate_containment(combined_s1, size_s1, combined_s2, size_s2)
     return ji
 
+
 def main():
     print("Let's start generating a dataset")
     global kg
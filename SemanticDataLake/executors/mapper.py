@@ -2,9 +2,15 @@ import os
 import time
 import datetime
 import statistics
+import numpy as np
 import pandas as pd
+import argparse
 from datasketch import MinHashLSHEnsemble, MinHash
 from models.KG import KG
+import executors.pool as pool
+import executors.profiler as profiler
+import executors.hashing as hashing
+import utils.timing as timing
 
 COMPUTE_PROFILE = True
 DATASET_FOLDER = "../datasets/"
@@ -19,6 +25,10 @@ LOG_DIRECTORY = "../logs/"
 NUM_PERM = 128
 NUM_PART = 32
 THRESHOLD = 0.8
+# Number of worker processes for the per-column hashing, querying and profiling
+WORKERS = 1
+# Number of distinct values of a streamed column encoded and hashed at once
+HASH_BATCH = 100000
 
 
 def initialize_lsh(kg):
@@ -55,77 +65,263 @@ def get_info_from_df(df):
     return 10,10
 
 def get_df_from_filename(directory, filename):
-    return pd.read_csv(directory + filename)
+    # Parquet and Arrow IPC sources keep their dictionary-encoded columns as categorical columns
+    path = directory + filename
+    if filename.endswith(".parquet"):
+        return pd.read_parquet(path)
+    if filename.endswith((".arrow", ".feather", ".ipc")):
+        return pd.read_feather(path)
+    return pd.read_csv(path)
+
+def map_column(col):
+    # Hash, query and profile a single column: it runs in a worker process, reading the shared state from the pool
+    df = pool.context["df"]
+    lshensemble = pool.context["lshensemble"]
+    kg = pool.context["kg"]
+    result = {"col": col, "correct": False, "members_time": 0.0, "profile_time": None}
+    categorical = isinstance(df[col].dtype, pd.CategoricalDtype)
+    if categorical:
+        # Dictionary-encoded column: the categories that occur are hashed, and the counts of the codes give the profile
+        stream = ColumnStream()
+        stream.update(df[col])
+    else:
+        values = df[col].astype('str').tolist()
+
+    # Hashing the dataset column
+    m = MinHash(NUM_PERM)
+    start_time_hashing = time.time()
+    values_set = [s for batch in stream.distinct() for s in batch] if categorical else set(values)
+    m.update_batch([s.encode('utf8') for s in values_set])
+    result["hashing_time"] = time.time() - start_time_hashing
 
-def map_source(df, rows, columns, noise, filename, directory, lshensemble, kg):
+    # Query
+    start_time_query = time.time()
+    mappings = list(lshensemble.query(m, len(values_set)))
+    result["query_time"] = time.time() - start_time_query
+
+    for mapping in mappings:
+        if str(col).startswith('L'):
+            if mapping == col:
+                result["correct"] = True
+                if COMPUTE_PROFILE:
+                    # Extraction of members from the level: it can be done off-line, so this time is not counted in the total execution time
+                    start_members_time = time.time()
+                    members = kg.get_members_from_level(col)
+                    member_index = kg.get_member_index(col)
+                    result["members_time"] = result["members_time"] + (time.time() - start_members_time)
+
+                    # Profile time
+                    start_profile_time = time.time()
+                    if categorical:
+                        profile = calculate_profile_from_stream(stream, members, member_index)
+                    else:
+                        profile = calculate_profile(df[col], col, members, member_index)
+                    result["profile_time"] = time.time() - start_profile_time
+    return result
+
+
+def map_source(df, rows, columns, noise, filename, directory, lshensemble, kg, workers=WORKERS):
     start_source = time.time()
     # Read the input file
     print("Reading source...")
-    durations_hashing = {}
-    duration_hashing_dims = []
-    duration_hashing_attr = []
-    durations_query = {}
     dimension_cols = []
-    profile_time = []
     wasted_time = 0 # time that should not be considered for total execution time
 
-    num_dimensions = 0
-    num_correctly_identified = 0
-    count = 0
+    # Columns are hashed, queried and profiled independently, possibly in parallel
+    results = pool.run(map_column, list(df.columns), workers,
+                       {"df": df, "lshensemble": lshensemble, "kg": kg})
     # For each column of the data source
-    for col in df.columns:
-        if str(col).startswith('L'):
-            num_dimensions = num_dimensions + 1
-            dimension_cols.append(col)
-        values = df[col].astype('str').tolist()
+    for result in results:
+        if str(result["col"]).startswith('L'):
+            dimension_cols.append(result["col"])
+        wasted_time = wasted_time + result["members_time"]
 
-        # Hashing the dataset column
-        m = MinHash(NUM_PERM)
-        start_time_hashing = time.time()
-        values_set = set(values)
-        m.update_batch([s.encode('utf8') for s in values_set])
-        dur_hashing = time.time() - start_time_hashing
-        if str(col).startswith('L'):
-            duration_hashing_dims.append(dur_hashing)
-        else:
-            duration_hashing_attr.append(dur_hashing)
-        durations_hashing[col] = dur_hashing
+    # Calculating combined MinHashes for dimensional schema
+    start_time_combined = time.time()
+    combined, _ = hashing.combined_minhash(df, dimension_cols, NUM_PERM)
+    time_combined = time.time() - start_time_combined
 
-        # Query
-        start_time_query = time.time()
-        mappings = lshensemble.query(m, len(values_set))
-        durations_query[col] = time.time() - start_time_query
+    end_source = time.time() - start_source - wasted_time
+    write_log(directory, filename, rows, columns, noise, results, time_combined, end_source)
+
+
+class ColumnStream:
+    """Distinct values of a column fed chunk by chunk, with bounded memory: categorical columns keep the count of each
+    category, columns of non-negative integers a bitmap of the values seen, other columns the set of their values as
+    text."""
+
+    def __init__(self):
+        self.categories = None
+        self.counts = None
+        self.seen = None
+        self.values = None
+
+    def update(self, values):
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            # Chunks of a generated dataset share the categories of each column
+            codes = values.cat.codes.to_numpy()
+            counts = np.bincount(codes[codes >= 0], minlength=len(values.cat.categories))
+            if self.counts is None:
+                self.categories = values.cat.categories
+                self.counts = counts
+            else:
+                self.counts += counts
+        elif self.values is None and pd.api.types.is_integer_dtype(values.dtype) and \
+                (len(values.index) == 0 or values.min() >= 0):
+            v = values.to_numpy()
+            if self.seen is None:
+                self.seen = np.zeros(0, dtype=bool)
+            if len(v) > 0 and v.max() >= len(self.seen):
+                seen = np.zeros(max(int(v.max()) + 1, 2 * len(self.seen)), dtype=bool)
+                seen[:len(self.seen)] = self.seen
+                self.seen = seen
+            self.seen[v] = True
+        else:
+            if self.values is None:
+                self.values = set(v for batch in self.distinct() for v in batch)
+                self.seen = None
+            self.values.update(values.astype('str'))
+
+    def __len__(self):
+        if self.counts is not None:
+            return int(np.count_nonzero(self.counts))
+        if self.values is not None:
+            return len(self.values)
+        if self.seen is not None:
+            return int(np.count_nonzero(self.seen))
+        return 0
+
+    def distinct(self, batch_size=HASH_BATCH):
+        # The distinct values, as text, in lists of at most batch_size values
+        if self.counts is not None:
+            values = self.categories[self.counts > 0]
+        elif self.values is not None:
+            values = list(self.values)
+        elif self.seen is not None:
+            values = np.flatnonzero(self.seen)
+        else:
+            values = []
+        for start in range(0, len(values), batch_size):
+            yield [str(v) for v in values[start:start + batch_size]]
 
-        for mapping in mappings:
-            if str(col).startswith('L'):
-                if mapping == col:
-                    num_correctly_identified = num_correctly_identified + 1
-                    if COMPUTE_PROFILE:
-                        # Extraction of members from the level: it can be done off-line, so this time is not counted in the total execution time
-                        start_members_time = time.time()
-                        members = kg.get_members_from_level(col)
-                        wasted_time = wasted_time + (time.time() - start_members_time)
 
-                        # Profile time
-                        start_profile_time = time.time()
-                        profile = calculate_profile(df[col], col, members)
-                        end_profile_time = time.time() - start_profile_time
-                        profile_time.append(end_profile_time)
+def map_column_stream(col, stream, hashing_time, lshensemble, kg):
+    # Query and profile a column from its stream, as map_column does from the whole column
+    result = {"col": col, "correct": False, "members_time": 0.0, "profile_time": None}
 
-                        print("col:",col,"> profile time:",end_profile_time)
+    # Hashing the distinct values of the column
+    start_time_hashing = time.time()
+    m = MinHash(NUM_PERM)
+    for batch in stream.distinct():
+        m.update_batch([s.encode('utf8') for s in batch])
+    result["hashing_time"] = hashing_time + (time.time() - start_time_hashing)
 
+    # Query
+    start_time_query = time.time()
+    mappings = list(lshensemble.query(m, len(stream)))
+    result["query_time"] = time.time() - start_time_query
 
-    # Calculating combined MinHashes for dimensional schema
-    combined = MinHash(NUM_PERM)
-    start_time_combined = time.time()
-    df_combined = df[dimension_cols[0]].map(str)
-    for col in dimension_cols[1:]:
-        df_combined = df_combined + "_" + df[col].map(str)
-    values_set = set(df_combined.tolist())
-    combined.update_batch([s.encode('utf8') for s in values_set])
-    time_combined = time.time() - start_time_combined
+    for mapping in mappings:
+        if str(col).startswith('L'):
+            if mapping == col:
+                result["correct"] = True
+                if COMPUTE_PROFILE:
+                    # Extraction of members from the level: it can be done off-line, so this time is not counted in the total execution time
+                    start_members_time = time.time()
+                    members = kg.get_members_from_level(col)
+                    member_index = kg.get_member_index(col)
+                    result["members_time"] = result["members_time"] + (time.time() - start_members_time)
+
+                    # Profile time, from the counts of the categories
+                    start_profile_time = time.time()
+                    profile = calculate_profile_from_stream(stream, members, member_index)
+                    result["profile_time"] = time.time() - start_profile_time
+    return result
+
+
+def map_stream(chunks, rows, columns, noise, filename, directory, lshensemble, kg):
+    """Maps a source generated chunk by chunk, without building the whole DataFrame: each chunk is fed to the streams
+    of its columns and to the combined MinHash of the dimensional schema, then dropped. The time spent producing the
+    chunks is not counted, and the statistics written to test.log are the same as ``map_source``.
+
+    :param chunks: the chunks of the source, e.g. from ``DS_generator.generate_chunks``
+    :type chunks: iterable
+    :param rows: the number of rows
+    :type rows: int
+    :param columns: the number of columns
+    :type columns: int
+    :param noise: the noise percentage
+    :type noise: int
+    :param filename: the name of the source in the log
+    :type filename: str
+    :param directory: the directory of the log
+    :type directory: str
+    :param lshensemble: the LSH Ensemble of the levels
+    :type lshensemble: MinHashLSHEnsemble
+    :param kg: the Knowledge Graph
+    :type kg: KG
+    """
+    start_source = time.time()
+    streams = dict()
+    hashing_times = dict()
+    dimension_cols = None
+    combined = None
+    time_combined = 0.0
+    wasted_time = 0 # time that should not be considered for total execution time
+    chunks = iter(chunks)
+    while True:
+        start_generation = time.time()
+        chunk = next(chunks, None)
+        wasted_time = wasted_time + (time.time() - start_generation)
+        if chunk is None:
+            break
+        if dimension_cols is None:
+            dimension_cols = [col for col in chunk.columns if str(col).startswith('L')]
+            for col in chunk.columns:
+                streams[col] = ColumnStream()
+                hashing_times[col] = 0.0
+        for col in chunk.columns:
+            start_time_hashing = time.time()
+            streams[col].update(chunk[col])
+            hashing_times[col] = hashing_times[col] + (time.time() - start_time_hashing)
+        # Combined MinHash of the dimensional schema, merged chunk by chunk
+        start_time_combined = time.time()
+        combined, _ = hashing.minhash_from_hashes(hashing.row_hashes(chunk, dimension_cols), NUM_PERM, combined)
+        time_combined = time_combined + (time.time() - start_time_combined)
+
+    results = []
+    for col, stream in streams.items():
+        result = map_column_stream(col, stream, hashing_times[col], lshensemble, kg)
+        wasted_time = wasted_time + result["members_time"]
+        results.append(result)
 
     end_source = time.time() - start_source - wasted_time
+    write_log(directory, filename, rows, columns, noise, results, time_combined, end_source)
+
+
+def write_log(directory, filename, rows, columns, noise, results, time_combined, end_source):
+    # Append the statistics of the columns of a source to the test.log of the directory
+    durations_hashing = {}
+    duration_hashing_dims = []
+    duration_hashing_attr = []
+    durations_query = {}
+    profile_time = []
+
+    num_dimensions = 0
+    num_correctly_identified = 0
+    for result in results:
+        col = result["col"]
+        if str(col).startswith('L'):
+            num_dimensions = num_dimensions + 1
+            duration_hashing_dims.append(result["hashing_time"])
+        else:
+            duration_hashing_attr.append(result["hashing_time"])
+        durations_hashing[col] = result["hashing_time"]
+        durations_query[col] = result["query_time"]
+        if result["correct"]:
+            num_correctly_identified = num_correctly_identified + 1
+        if result["profile_time"] is not None:
+            profile_time.append(result["profile_time"])
 
     # Statistics
     sum_durations_hashing = sum(durations_hashing.values())
@@ -165,43 +361,43 @@ def map_source(df, rows, columns, noise, filename, directory, lshensemble, kg):
                 str('{0:.4g}'.format(end_source)).replace('.', ',') + ";" +
                 str('{0:.2g}'.format(effectiveness)).replace('.', ',') + "\n")
 
+
 # Input: list dei values, nome del level
-def calculate_profile(values, level, members):
-    frequency = {}
-    x_time = time.time()
-    idx = pd.Index(values)
-    x2_time = time.time()-x_time
-    print("\tIndexing time:",x2_time)
-    y_time = time.time()
-    count = idx.value_counts()
-    print("\tIndex counting time:",(time.time()-y_time))
-    z_time = time.time()
-    #for name, number in count.items():
-    #    if name in members:
-    #        frequency[name] = number
-    for m in members:
-        if m in count:
-            frequency[m]=count[m]
-    delta = len(count) - len(frequency)
-    if delta > 0:
-        frequency["other"] = delta
-    print("\tCycling time:",(time.time()-z_time))
-    return frequency
+def calculate_profile(values, level, members, member_index):
+    with timing.span("profile"):
+        frequency, other = profiler.profile_from_values(values, member_index)
+    return profiler.to_dict(frequency, other, members)
+
+
+def calculate_profile_from_stream(stream, members, member_index):
+    # Profile of a categorical column, from the counts of its categories
+    with timing.span("profile"):
+        occurring = stream.counts > 0
+        frequency, other = profiler.profile_from_counts(stream.categories[occurring], stream.counts[occurring],
+                                                        member_index)
+    return profiler.to_dict(frequency, other, members)
 
 
 
 
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=WORKERS, help="number of worker processes")
+    parser.add_argument("--stats", help="path of a JSON file where the timings of each operation are written")
+    args = parser.parse_args()
+    timing.enable(args.stats is not None)
     print("Importing the Knowledge Graph...")
-    kg = KG(GRAPH_FOLDER + GRAPH)
-    lshensemble = initialize_lsh(kg)
+    with timing.span("kg_load"):
+        kg = KG(GRAPH_FOLDER + GRAPH)
+    with timing.span("lsh_build"):
+        lshensemble = initialize_lsh(kg)
 
     for folder in FOLDERS:
         files = []
         # read the folder
         for x in os.listdir(DATASET_FOLDER + folder):
-            if x.endswith(".csv"):
+            if x.endswith((".csv", ".parquet", ".arrow", ".feather", ".ipc")):
                 files.append(x)
         print("Let's start mapping...")
 
@@ -217,9 +413,14 @@ def main():
 
         for file in files:
             print(file)
-            df = get_df_from_filename(DATASET_FOLDER + folder, file)
+            with timing.span("read"):
+                df = get_df_from_filename(DATASET_FOLDER + folder, file)
             columns, rows, noise = get_info_file(file)
-            map_source(df, rows, columns, noise, file, DATASET_FOLDER + folder, lshensemble, kg)
+            with timing.span("map"):
+                map_source(df, rows, columns, noise, file, DATASET_FOLDER + folder, lshensemble, kg, args.workers)
+
+    if args.stats is not None:
+        timing.export(args.stats)
 
 
 if __name__ == "__main__":
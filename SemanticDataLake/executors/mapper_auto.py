@@ -1,21 +1,39 @@
+import io
+import os
 import time
+import pickle
+import hashlib
+import tempfile
+import numpy as np
 import pandas as pd
 from datasketch import MinHashLSHEnsemble, MinHash
+import executors.pool as pool
+import executors.profiler as profiler
+import executors.hashing as hashing
+import executors.fingerprint as fingerprint
+import utils.timing as timing
+import utils.files as files
 
 # Parameters
 NUM_PERM = 256
 NUM_PART = 32
 THRESHOLD = 0.8
 
+LSH_CACHE_FOLDER = "../cache/"
+# Number of rows read at once when a source is scanned
+CHUNK_SIZE = 100000
+# Number of bytes read at once when a CSV source is split into ranges of rows
+SPLIT_BLOCK = 1 << 20
+# Source formats, by file extension: any other file is read as CSV
+FORMATS = {".parquet": "parquet", ".arrow": "arrow", ".feather": "arrow", ".ipc": "arrow"}
+# Increase when the way level signatures are computed changes, to invalidate existing caches
+LSH_CACHE_VERSION = 2
 
-def initialize_lsh(kg):
-    # Create an LSH Ensemble index with threshold and number of partition settings.
-    lshensemble = MinHashLSHEnsemble(threshold=THRESHOLD, num_perm=NUM_PERM, num_part=NUM_PART)
 
-    # Initialize LSHEnsemble
-    index = []
+def get_level_signatures(kg):
+    # Create a MinHash for each level of each dimension
+    signatures = dict()
     dimensions = kg.get_dimensions()
-    # Extract all levels and create MinHash for each
     for dim in dimensions:
         levels = kg.get_levels(dim)
         for lev in levels:
@@ -24,31 +42,493 @@ def initialize_lsh(kg):
             # Create the MinHash for the i-th level
             m = MinHash(num_perm=NUM_PERM)
             m.update_batch([s.encode('utf8') for s in members])
-            index.append(tuple((lev, m, len(members))))
+            signatures[lev] = (m, len(members))
+    return signatures
+
+
+def initialize_lsh(kg, signatures=None):
+    # Create an LSH Ensemble index with threshold and number of partition settings.
+    lshensemble = MinHashLSHEnsemble(threshold=THRESHOLD, num_perm=NUM_PERM, num_part=NUM_PART)
+
+    # Initialize LSHEnsemble
+    if signatures is None:
+        signatures = get_level_signatures(kg)
+    index = [(lev, m, size) for lev, (m, size) in signatures.items()]
     # Pack all together
     lshensemble.index(index)
     return lshensemble
 
 
-def map_source_domain(values, lshensemble):
-    # Hashing the dataset column
-    m = MinHash(NUM_PERM)
-    values_set = set(values)
-    m.update_batch([s.encode('utf8') for s in values_set])
-    mappings = lshensemble.query(m, len(values_set))
-    return mappings
-
-
-def calculate_profile(values, members):
-    frequency = dict()
-    idx = pd.Index(values)
-    count = idx.value_counts()
-    members_list = members
-    for m in members_list:
-        m_fragment = m[m.rfind('/') +1:]
-        if m_fragment in count:
-            frequency[m] = count[m_fragment]
-    delta = len(count) - len(frequency)
-    if delta > 0:
-        frequency["other"] = delta
-    return frequency
+def get_lsh_params():
+    # The parameters the level signatures and the LSH Ensemble depend on
+    return "%d;%d;%d;%r" % (LSH_CACHE_VERSION, NUM_PERM, NUM_PART, THRESHOLD)
+
+
+def get_lsh_cache_key(kg_file, source_hash=None):
+    # The key changes whenever the KG file or the LSH parameters change. The hash of the file can be passed when
+    # already known, e.g. from the compiled snapshot of the KG, to avoid reading the file again.
+    if source_hash is None:
+        digest = hashlib.sha256()
+        with open(kg_file, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        source_hash = digest.hexdigest()
+    digest = hashlib.sha256(source_hash.encode('utf8'))
+    digest.update(get_lsh_params().encode('utf8'))
+    return digest.hexdigest()
+
+
+def load_lsh(kg, cache_folder=LSH_CACHE_FOLDER):
+    """Returns the LSH Ensemble and the MinHash of each level for the given Knowledge Graph, reading them from disk
+    when available. They are kept in the compiled snapshot of the KG, when it has one, so that they are discarded
+    together with it; otherwise in the cache folder, keyed by the hash of the KG file. In both cases they are rebuilt
+    when the LSH parameters change.
+
+    :param kg: the Knowledge Graph
+    :type kg: KG
+    :param cache_folder: the folder where the cache files of KGs without snapshot are stored
+    :type cache_folder: str
+    :returns: a tuple with the LSH Ensemble and a dictionary including, for each level, its MinHash and cardinality
+    :rtype: tuple
+    """
+    params = get_lsh_params()
+    cache_file = kg.get_snapshot_file("lsh_" + hashlib.sha256(params.encode('utf8')).hexdigest() + ".pkl")
+    if cache_file is None:
+        os.makedirs(cache_folder, exist_ok=True)
+        cache_file = os.path.join(cache_folder, "lsh_" + get_lsh_cache_key(kg.graph_name, kg.source_hash) + ".pkl")
+    if os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'rb') as f:
+                cached = pickle.load(f)
+            if cached.get("params") == params:
+                return cached["lsh"], cached["signatures"]
+        except Exception as e:
+            print("Unable to read the LSH cache, rebuilding it...", e)
+
+    print("Generating MinHashes for dimension levels...")
+    with timing.span("lsh_build"):
+        signatures = get_level_signatures(kg)
+        lshensemble = initialize_lsh(kg, signatures)
+
+    # Write to a temporary file first, so that concurrent processes never read a partial cache
+    fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(cache_file), suffix=".tmp")
+    with os.fdopen(fd, 'wb') as f:
+        pickle.dump({"params": params, "lsh": lshensemble, "signatures": signatures}, f,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+    files.replace(tmp_file, cache_file)
+    return lshensemble, signatures
+
+
+def get_max_distinct(signatures):
+    # A column whose distinct values are more than this cannot be contained in any level above the threshold
+    if len(signatures) == 0:
+        return 0
+    return int(max(size for _, size in signatures.values()) / THRESHOLD) + 1
+
+
+class ColumnSketch:
+    """Accumulates the MinHash and the value counts of a column read in chunks. Each chunk is hashed into a partial
+    MinHash that is merged into the column signature. Counts are dropped once the distinct values exceed
+    ``max_distinct``, since such a column cannot be mapped to any level."""
+
+    def __init__(self, num_perm=NUM_PERM, max_distinct=None):
+        self.minhash = MinHash(num_perm)
+        self.counts = dict()
+        self.max_distinct = max_distinct
+
+    def update(self, values):
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            # Dictionary-encoded column: only the categories are hashed, and the counts of the codes are the counts
+            # of the values
+            codes = values.cat.codes.to_numpy()
+            counts = np.bincount(codes[codes >= 0], minlength=len(values.cat.categories))
+            occurring = np.flatnonzero(counts)
+            chunk_counts = pd.Series(counts[occurring], index=values.cat.categories[occurring])
+        else:
+            chunk_counts = values.value_counts(sort=False)
+        if self.counts is not None:
+            # Values already seen do not change the signature
+            new_values = [v for v in chunk_counts.index if v not in self.counts]
+            for v, c in chunk_counts.items():
+                self.counts[v] = self.counts.get(v, 0) + int(c)
+            if self.max_distinct is not None and len(self.counts) > self.max_distinct:
+                self.counts = None
+        else:
+            new_values = chunk_counts.index
+        partial = MinHash(len(self.minhash))
+        partial.update_batch([s.encode('utf8') for s in new_values])
+        self.minhash.merge(partial)
+
+    def merge(self, other):
+        # Union with the sketch of the same column over other rows, e.g. read by another worker process
+        self.minhash.merge(other.minhash)
+        if self.counts is not None and other.counts is not None:
+            for v, c in other.counts.items():
+                self.counts[v] = self.counts.get(v, 0) + c
+            if self.max_distinct is not None and len(self.counts) > self.max_distinct:
+                self.counts = None
+        else:
+            self.counts = None
+
+    def size(self):
+        if self.counts is not None:
+            return len(self.counts)
+        return int(self.minhash.count())
+
+
+class _Prefix(io.RawIOBase):
+    # The first bytes of a file, up to a given length: rows appended after the fingerprint of a source are not read
+    # by the scan, but by the next sync
+
+    def __init__(self, f, length):
+        self.f = f
+        self.remaining = length
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), self.remaining)
+        if n <= 0:
+            return 0
+        data = self.f.read(n)
+        b[:len(data)] = data
+        self.remaining = self.remaining - len(data)
+        return len(data)
+
+
+def _open_csv(path, offset=0, length=None):
+    # Binary handle on a CSV source, from ``offset`` up to the byte ``length``, if given
+    f = open(path, 'rb')
+    f.seek(offset)
+    if length is None:
+        return f
+    return io.BufferedReader(_Prefix(f, max(length - offset, 0)))
+
+
+def get_format(path):
+    # "csv", "parquet" or "arrow" (IPC file or stream), from the extension of the path
+    return FORMATS.get(os.path.splitext(path)[1].lower(), "csv")
+
+
+def _open_arrow(path):
+    # Schema and record batches of an Arrow IPC source, memory-mapped so that only the columns used are read
+    import pyarrow as pa
+    source = pa.memory_map(path)
+    try:
+        reader = pa.ipc.open_file(source)
+        return reader.schema, (reader.get_batch(i) for i in range(reader.num_record_batches))
+    except pa.ArrowInvalid:
+        source.seek(0)
+        reader = pa.ipc.open_stream(source)
+        return reader.schema, reader
+
+
+def _get_schema(path):
+    # pyarrow is needed only for Parquet and Arrow sources
+    if get_format(path) == "parquet":
+        import pyarrow.parquet as pq
+        return pq.read_schema(path)
+    return _open_arrow(path)[0]
+
+
+def _to_text(array):
+    # Values as text, as in a CSV source where missing values are empty strings. Dictionary-encoded columns stay
+    # encoded, with the dictionary cast to text and missing values pointing to an empty string in the dictionary.
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    if pa.types.is_dictionary(array.type) and array.dictionary.null_count > 0:
+        array = array.dictionary_decode()
+    if pa.types.is_dictionary(array.type):
+        dictionary = array.dictionary
+        if not pa.types.is_string(dictionary.type):
+            dictionary = pc.cast(dictionary, pa.string())
+        indices = array.indices
+        if array.null_count > 0:
+            empty = pc.index(dictionary, "").as_py()
+            if empty < 0:
+                empty = len(dictionary)
+                dictionary = pa.concat_arrays([dictionary, pa.array([""])])
+            indices = pc.fill_null(indices, pa.scalar(empty, indices.type))
+        return pa.DictionaryArray.from_arrays(indices, dictionary).to_pandas()
+    if not pa.types.is_string(array.type):
+        array = pc.cast(array, pa.string())
+    return pc.fill_null(array, "").to_pandas()
+
+
+def read_columns(path):
+    if get_format(path) == "csv":
+        return list(pd.read_csv(path, nrows=0).columns)
+    schema = _get_schema(path)
+    # The index written by pandas is not a column of the source
+    index_columns = (schema.pandas_metadata or {}).get("index_columns", [])
+    return [name for name in schema.names if name not in index_columns]
+
+
+def read_chunks(path, chunk_size=CHUNK_SIZE, usecols=None, length=None):
+    """Reads a source in chunks of at most ``chunk_size`` rows, as DataFrames whose values are text. CSV sources are
+    parsed with ``pd.read_csv``. Parquet and Arrow IPC sources are read with pyarrow, projecting only the requested
+    columns; their dictionary-encoded columns (and, for Parquet, every text column stored with a dictionary) are
+    returned as categorical columns, so that their values are not materialized once per row.
+
+    :param path: the path of the source
+    :type path: str
+    :param chunk_size: the number of rows read at once (default is ``CHUNK_SIZE``)
+    :type chunk_size: int
+    :param usecols: the columns to read (default is None, i.e. all the columns)
+    :type usecols: list
+    :param length: the number of bytes of a CSV source to read, e.g. its size in the fingerprint taken before the
+        scan (default is None, i.e. the whole file)
+    :type length: int
+    :returns: a generator of DataFrames
+    :rtype: generator
+    """
+    source_format = get_format(path)
+    if source_format == "csv":
+        with _open_csv(path, 0, length) as f:
+            yield from pd.read_csv(f, chunksize=chunk_size, dtype=str, keep_default_na=False, na_filter=False,
+                                   usecols=usecols)
+        return
+    columns = usecols if usecols is not None else read_columns(path)
+    if source_format == "parquet":
+        import pyarrow.parquet as pq
+        batches = pq.ParquetFile(path, read_dictionary=columns).iter_batches(batch_size=chunk_size, columns=columns)
+    else:
+        batches = _open_arrow(path)[1]
+    for batch in batches:
+        batch = batch.select(columns)
+        for start in range(0, batch.num_rows, chunk_size):
+            part = batch.slice(start, chunk_size)
+            yield pd.DataFrame({col: _to_text(part.column(i)) for i, col in enumerate(columns)})
+
+
+def scan_source(path, max_distinct=None, chunk_size=CHUNK_SIZE, usecols=None, length=None):
+    """Reads a source once, in chunks of ``chunk_size`` rows, and returns the number of rows, the column names and a
+    ColumnSketch for each column. Values are read as text, as they are written in the file. Only the first ``length``
+    bytes of a CSV source are read, when given.
+    """
+    num_rows = 0
+    columns = None
+    sketches = dict()
+    for chunk in timing.timed_iter("read", read_chunks(path, chunk_size, usecols, length)):
+        if columns is None:
+            columns = list(chunk.columns)
+            for col in columns:
+                sketches[col] = ColumnSketch(NUM_PERM, max_distinct)
+        with timing.span("hash"):
+            for col in columns:
+                sketches[col].update(chunk[col])
+        num_rows = num_rows + len(chunk.index)
+    return num_rows, columns or [], sketches
+
+
+def _row_starts(f, targets, end):
+    # The first position at or after each target (in increasing order) where a row of a CSV file begins, i.e. after a
+    # line break outside quoted values. A line break is outside quoted values when the quotes before it are even,
+    # since escaped quotes are doubled: quotes are counted block by block, without parsing the file.
+    starts = []
+    quotes = 0
+    position = 0
+    i = 0
+    f.seek(0)
+    while i < len(targets) and position < end:
+        block = f.read(min(SPLIT_BLOCK, end - position))
+        if not block:
+            break
+        counted = 0
+        search = 0
+        while i < len(targets):
+            newline = block.find(b"\n", max(targets[i] - 1 - position, search))
+            if newline < 0:
+                break
+            quotes = quotes + block.count(b'"', counted, newline)
+            counted = newline
+            search = newline + 1
+            if quotes % 2 == 0:
+                starts.append(position + newline + 1)
+                i = i + 1
+        quotes = quotes + block.count(b'"', counted)
+        position = position + len(block)
+    return starts
+
+
+def split_csv(path, parts, length=None):
+    # Byte ranges of the rows of a CSV source (up to the byte length, if given), split into at most ``parts`` ranges
+    # starting at the beginning of a row. Values may include line breaks, if quoted.
+    end = os.path.getsize(path) if length is None else length
+    with open(path, 'rb') as f:
+        # The first target is the end of the header
+        starts = _row_starts(f, [0] + [end * i // parts for i in range(1, parts)], end)
+    bounds = sorted(set(start for start in starts if start < end)) or [end]
+    bounds.append(end)
+    return [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1)]
+
+
+def scan_rows(byte_range):
+    # Scan a range of rows of a CSV source: it runs in a worker process, reading the shared state from the pool
+    offset, end = byte_range
+    sketches = {col: ColumnSketch(NUM_PERM, pool.context["max_distinct"]) for col in pool.context["columns"]}
+    num_rows, _ = scan_tail(pool.context["path"], offset, pool.context["columns"], sketches,
+                            chunk_size=pool.context["chunk_size"], length=end)
+    return num_rows, sketches
+
+
+def scan_columns(columns):
+    # Scan a group of columns of a Parquet or Arrow source: it runs in a worker process, reading the shared state
+    # from the pool. Only the columns of the group are read from the file.
+    num_rows, _, sketches = scan_source(pool.context["path"], pool.context["max_distinct"],
+                                        pool.context["chunk_size"], columns)
+    return num_rows, sketches
+
+
+def scan_parallel(path, columns, workers=1, max_distinct=None, chunk_size=CHUNK_SIZE, length=None):
+    """Reads a source once, spreading it over the worker processes, and returns the number of rows and a
+    ColumnSketch for each column. A CSV source is split into ranges of rows, whose sketches are merged, so that
+    each byte is read by one worker only; Parquet and Arrow sources are split into groups of columns, since each
+    worker can read only its columns.
+
+    :param path: the path of the source
+    :type path: str
+    :param columns: the columns of the source
+    :type columns: list
+    :param workers: the number of worker processes (default is 1)
+    :type workers: int
+    :param max_distinct: the number of distinct values above which the counts of a column are dropped (default is
+        None)
+    :type max_distinct: int
+    :param chunk_size: the number of rows read at once (default is ``CHUNK_SIZE``)
+    :type chunk_size: int
+    :param length: the number of bytes of a CSV source to read (default is None, i.e. the whole file)
+    :type length: int
+    :returns: a tuple with the number of rows and the dictionary of ColumnSketch
+    :rtype: tuple
+    """
+    state = {"path": path, "columns": columns, "max_distinct": max_distinct, "chunk_size": chunk_size}
+    sketches = dict()
+    if get_format(path) == "csv":
+        outputs = pool.run(scan_rows, split_csv(path, workers, length), workers, state)
+        for col in columns:
+            sketches[col] = ColumnSketch(NUM_PERM, max_distinct)
+            for _, part in outputs:
+                sketches[col].merge(part[col])
+        return sum(num_rows for num_rows, _ in outputs), sketches
+    groups = [columns[i::workers] for i in range(min(workers, len(columns)))]
+    outputs = pool.run(scan_columns, groups, workers, state)
+    for _, group_sketches in outputs:
+        sketches.update(group_sketches)
+    return (outputs[0][0] if len(outputs) > 0 else 0), sketches
+
+
+def mount_file(path):
+    # Scan, map and profile all the columns of a source, and compute the combined signature of its dimensional
+    # schema: it runs in a worker process when several sources are mounted at once
+    start_time = time.time()
+    # The fingerprint is taken first, and only the bytes it covers are read: rows appended during the scan are left
+    # to the next sync
+    with timing.span("fingerprint"):
+        file_fingerprint = fingerprint.fingerprint(path)
+    num_rows, columns, sketches = scan_source(path, pool.context["max_distinct"], pool.context["chunk_size"],
+                                              length=file_fingerprint["size"])
+    results = map_sketches(sketches, columns, pool.context["lshensemble"], pool.context["kg"])
+    dimensions = get_dimensional_schema(results)
+    combined, size = None, 0
+    if len(dimensions) > 0:
+        combined, size = scan_combined(path, [col for _, col in dimensions], pool.context["join_num_perm"],
+                                       pool.context["chunk_size"], file_fingerprint["size"])
+    return {"path": path, "num_rows": num_rows, "columns": columns, "results": results, "dimensions": dimensions,
+            "combined": combined, "size": size, "sketches": sketches, "fingerprint": file_fingerprint,
+            "time": time.time() - start_time}
+
+
+def map_sketches(sketches, columns, lshensemble, kg):
+    # Map each column to a level, and profile the mapped columns at the level and at all its ancestor levels
+    results = []
+    for col in columns:
+        sketch = sketches[col]
+        level = None
+        pyramid = None
+        other = 0
+        with timing.span("query"):
+            mappings = list(map_sketch(sketch, lshensemble))
+        if len(mappings) > 0:
+            level = mappings[0]
+            with timing.span("profile"):
+                member_index = kg.get_member_index(level, fragmentLevel=False, fragmentKeys=True)
+                frequency, other = profiler.profile_from_counts(list(sketch.counts.keys()),
+                                                                list(sketch.counts.values()), member_index)
+                # Profiles at the mapped level and at all its ancestor levels
+                pyramid = profiler.profile_pyramid(kg, level, frequency)
+        results.append((col, level, pyramid, other))
+    return results
+
+
+def get_dimensional_schema(results):
+    # Mapped columns of a source, as (level, column) pairs ordered by level
+    return sorted((str(level), col) for col, level, _, _ in results if level is not None)
+
+
+def scan_combined(path, columns, num_perm, chunk_size=CHUNK_SIZE, length=None):
+    # Combined MinHash of the given columns, hashing the rows chunk by chunk (of the first length bytes of a CSV
+    # source, when given). The number of distinct rows is estimated from the signature, so that memory does not depend
+    # on the file size.
+    combined = None
+    with timing.span("combined"):
+        for chunk in timing.timed_iter("read", read_chunks(path, chunk_size, columns, length)):
+            with timing.span("hash"):
+                combined, _ = hashing.minhash_from_hashes(hashing.row_hashes(chunk, columns), num_perm, combined)
+    if combined is None:
+        return None, 0
+    return combined, int(round(combined.count()))
+
+
+def scan_tail(path, offset, columns, sketches, combined_columns=None, combined=None, num_perm=None,
+              chunk_size=CHUNK_SIZE, length=None):
+    """Reads only the rows appended to a CSV source after its first ``offset`` bytes, which must end with a complete
+    line, and up to the byte ``length``, and merges them into the column sketches of the source and into the combined
+    MinHash of the given columns
+
+    :param path: the path of the source
+    :type path: str
+    :param offset: the number of bytes already read
+    :type offset: int
+    :param columns: the columns of the source, as in its header
+    :type columns: list
+    :param sketches: the ColumnSketch of each column, updated in place
+    :type sketches: dict
+    :param combined_columns: the columns of the dimensional schema, in order (default is None, i.e. no combined
+        MinHash is updated)
+    :type combined_columns: list
+    :param combined: the combined MinHash to update (default is None, i.e. a new one is created)
+    :type combined: MinHash
+    :param num_perm: the number of permutations of the combined MinHash
+    :type num_perm: int
+    :param chunk_size: the number of rows read at once (default is ``CHUNK_SIZE``)
+    :type chunk_size: int
+    :param length: the number of bytes of the source to read, e.g. its size in the new fingerprint (default is None,
+        i.e. up to the end of the file)
+    :type length: int
+    :returns: a tuple with the number of appended rows and the combined MinHash
+    :rtype: tuple
+    """
+    num_rows = 0
+    with _open_csv(path, offset, length) as f:
+        try:
+            for chunk in timing.timed_iter("read", pd.read_csv(f, header=None, names=columns, chunksize=chunk_size,
+                                                               dtype=str, keep_default_na=False, na_filter=False)):
+                with timing.span("hash"):
+                    for col in columns:
+                        sketches[col].update(chunk[col])
+                if combined_columns:
+                    with timing.span("combined"):
+                        combined, _ = hashing.minhash_from_hashes(hashing.row_hashes(chunk, combined_columns),
+                                                                  num_perm, combined)
+                num_rows = num_rows + len(chunk.index)
+        except pd.errors.EmptyDataError:
+            pass
+    return num_rows, combined
+
+
+def map_sketch(sketch, lshensemble):
+    if sketch.counts is None:
+        return []
+    return lshensemble.query(sketch.minhash, sketch.size())
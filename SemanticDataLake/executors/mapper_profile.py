@@ -2,10 +2,16 @@ import os
 import time
 import datetime
 import statistics
+import numpy as np
 import pandas as pd
+import argparse
 from datasketch import MinHashLSHEnsemble, MinHash
 from models.KG import KG
-from models.MG import MG
+from models.MG import MG, ns_project
+import executors.pool as pool
+import executors.profiler as profiler
+import executors.hashing as hashing
+import utils.timing as timing
 
 COMPUTE_PROFILE = True
 DATASET_FOLDER = "../datasets/"
@@ -25,6 +31,8 @@ LOG_DIRECTORY = "../logs/"
 NUM_PERM = 256
 NUM_PART = 32
 THRESHOLD = 0.8
+# Number of worker processes for the per-column hashing, querying and profiling
+WORKERS = 1
 
 
 def initialize_lsh(kg):
@@ -60,7 +68,46 @@ def get_info_file(filename):
 def get_df_from_filename(directory, filename):
     return pd.read_csv(directory + filename)
 
-def map_source(df, rows, columns, noise, filename, directory, lshensemble, kg, mg):
+def map_column(col):
+    # Hash, query and profile a single column: it runs in a worker process, reading the shared state from the pool
+    df = pool.context["df"]
+    lshensemble = pool.context["lshensemble"]
+    kg = pool.context["kg"]
+    result = {"col": col, "mapping": None, "profile": None, "members_time": 0.0, "profile_time": None}
+    values = df[col].astype('str').tolist()
+
+    # Hashing the dataset column
+    m = MinHash(NUM_PERM)
+    start_time_hashing = time.time()
+    values_set = set(values)
+    m.update_batch([s.encode('utf8') for s in values_set])
+    result["hashing_time"] = time.time() - start_time_hashing
+
+    # Query
+    start_time_query = time.time()
+    mappings = list(lshensemble.query(m, len(values_set)))
+    result["query_time"] = time.time() - start_time_query
+
+
+    for mapping in mappings:
+        if str(col).startswith('L'):
+            if mapping == col:
+                result["mapping"] = mapping
+                if COMPUTE_PROFILE:
+                    # Extraction of members from the level: it can be done off-line, so this time is not counted in the total execution time
+                    start_members_time = time.time()
+                    members = kg.get_members_from_level(col)
+                    member_index = kg.get_member_index(col)
+                    result["members_time"] = result["members_time"] + (time.time() - start_members_time)
+
+                    # Profile time
+                    start_profile_time = time.time()
+                    result["profile"] = calculate_profile(df[col], col, members, member_index)
+                    result["profile_time"] = time.time() - start_profile_time
+    return result
+
+
+def map_source(df, rows, columns, noise, filename, directory, lshensemble, kg, mg, workers=WORKERS):
     start_source = time.time()
     # Read the input file
     print("Reading source...")
@@ -78,60 +125,31 @@ def map_source(df, rows, columns, noise, filename, directory, lshensemble, kg, m
 
     # Add the source in the Metadata Graph
     mg.add_source(filename[:-4], rows, df.columns[1:], directory+filename)
-    # For each column of the data source
-    for col in df.columns:
+    # Columns are hashed, queried and profiled independently, possibly in parallel
+    results = pool.run(map_column, list(df.columns), workers,
+                       {"df": df, "lshensemble": lshensemble, "kg": kg})
+    # For each column of the data source, merge the results in the Metadata Graph
+    for result in results:
+        col = result["col"]
         if str(col).startswith('L'):
             num_dimensions = num_dimensions + 1
             dimension_cols.append(col)
-        values = df[col].astype('str').tolist()
-
-        # Hashing the dataset column
-        m = MinHash(NUM_PERM)
-        start_time_hashing = time.time()
-        values_set = set(values)
-        m.update_batch([s.encode('utf8') for s in values_set])
-        dur_hashing = time.time() - start_time_hashing
-        if str(col).startswith('L'):
-            duration_hashing_dims.append(dur_hashing)
+            duration_hashing_dims.append(result["hashing_time"])
         else:
-            duration_hashing_attr.append(dur_hashing)
-        durations_hashing[col] = dur_hashing
-
-        # Query
-        start_time_query = time.time()
-        mappings = lshensemble.query(m, len(values_set))
-        durations_query[col] = time.time() - start_time_query
-
-
-        for mapping in mappings:
-            if str(col).startswith('L'):
-                if mapping == col:
-                    num_correctly_identified = num_correctly_identified + 1
-                    if COMPUTE_PROFILE:
-                        # Extraction of members from the level: it can be done off-line, so this time is not counted in the total execution time
-                        start_members_time = time.time()
-                        members = kg.get_members_from_level(col)
-                        wasted_time = wasted_time + (time.time() - start_members_time)
-
-                        # Profile time
-                        start_profile_time = time.time()
-                        profile = calculate_profile(df[col], col, members)
-                        end_profile_time = time.time() - start_profile_time
-                        profile_time.append(end_profile_time)
-                        mg.map(filename[:-4],col,mapping)
-                        for (mem,value) in profile.items():
-                            mg.add_profile(filename[:-4], col, mem, value)
-                        print("col:",col,"> profile time:",end_profile_time)
-
+            duration_hashing_attr.append(result["hashing_time"])
+        durations_hashing[col] = result["hashing_time"]
+        durations_query[col] = result["query_time"]
+        if result["mapping"] is not None:
+            num_correctly_identified = num_correctly_identified + 1
+        wasted_time = wasted_time + result["members_time"]
+        if result["profile"] is not None:
+            profile_time.append(result["profile_time"])
+            mg.map(filename[:-4],col,result["mapping"])
+            mg.add_profile_pyramid(filename[:-4], col, *result["profile"])
 
     # Calculating combined MinHashes for dimensional schema
-    combined = MinHash(NUM_PERM)
     start_time_combined = time.time()
-    df_combined = df[dimension_cols[0]].map(str)
-    for col in dimension_cols[1:]:
-        df_combined = df_combined + "_" + df[col].map(str)
-    values_set = set(df_combined.tolist())
-    combined.update_batch([s.encode('utf8') for s in values_set])
+    combined, _ = hashing.combined_minhash(df, dimension_cols, NUM_PERM)
     time_combined = time.time() - start_time_combined
 
     end_source = time.time() - start_source - wasted_time
@@ -177,36 +195,28 @@ def map_source(df, rows, columns, noise, filename, directory, lshensemble, kg, m
         mg.serialize()
 
 # Input: list dei values, nome del level
-def calculate_profile(values, level, members):
-    frequency = {}
-    x_time = time.time()
-    idx = pd.Index(values)
-    x2_time = time.time()-x_time
-    print("\tIndexing time:",x2_time)
-    y_time = time.time()
-    count = idx.value_counts()
-    print("\tIndex counting time:",(time.time()-y_time))
-    z_time = time.time()
-    #for name, number in count.items():
-    #    if name in members:
-    #        frequency[name] = number
-    for m in members:
-        if m in count:
-            frequency[m]=count[m]
-    delta = len(count) - len(frequency)
-    if delta > 0:
-        frequency["other"] = delta
-    print("\tCycling time:",(time.time()-z_time))
-    return frequency
+def calculate_profile(values, level, members, member_index):
+    with timing.span("profile"):
+        frequency, other = profiler.profile_from_values(values, member_index)
+    # Profile at the mapped level only, as stored in the profile store
+    ids = np.flatnonzero(frequency)
+    return {str(ns_project + level): (ids, frequency[ids])}, other
 
 
 
 
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=WORKERS, help="number of worker processes")
+    parser.add_argument("--stats", help="path of a JSON file where the timings of each operation are written")
+    args = parser.parse_args()
+    timing.enable(args.stats is not None)
     print("Importing the Knowledge Graph...")
-    kg = KG(GRAPH_FOLDER + GRAPH)
-    lshensemble = initialize_lsh(kg)
+    with timing.span("kg_load"):
+        kg = KG(GRAPH_FOLDER + GRAPH)
+    with timing.span("lsh_build"):
+        lshensemble = initialize_lsh(kg)
 
     mg = MG(METAGRAPH_FOLDER + METAGRAPH)
 
@@ -230,9 +240,14 @@ def main():
 
         for file in files:
             print(file)
-            df = get_df_from_filename(DATASET_FOLDER + folder, file)
+            with timing.span("read"):
+                df = get_df_from_filename(DATASET_FOLDER + folder, file)
             columns, rows, noise = get_info_file(file)
-            map_source(df, rows, columns, noise, file, DATASET_FOLDER + folder, lshensemble, kg, mg)
+            with timing.span("map"):
+                map_source(df, rows, columns, noise, file, DATASET_FOLDER + folder, lshensemble, kg, mg, args.workers)
+
+    if args.stats is not None:
+        timing.export(args.stats)
 
 
 if __name__ == "__main__":
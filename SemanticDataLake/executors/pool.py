@@ -0,0 +1,82 @@
+import functools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import utils.timing as timing
+
+# Read-only state shared by the tasks of a pool (e.g. the DataFrame, the LSH Ensemble, the KG). It is set once per
+# worker process by the pool initializer, so that tasks only carry their own arguments.
+context = dict()
+
+
+def _init_worker(state, timing_enabled=None):
+    context.clear()
+    context.update(state)
+    if timing_enabled is not None:
+        timing.init_worker(timing_enabled)
+
+
+def _timed_task(func, task):
+    # Runs a task in a worker process, handing its timings over to the parent process with the result
+    result = func(task)
+    return result, timing.drain()
+
+
+def run(func, tasks, workers=1, state=None):
+    """Applies a function to each task, in a pool of worker processes when more than one worker is requested
+
+    :param func: a module-level function taking a task as its only argument
+    :type func: callable
+    :param tasks: the list of tasks
+    :type tasks: list
+    :param workers: the number of worker processes (default is 1, i.e. the tasks are run in the current process)
+    :type workers: int
+    :param state: the read-only state made available to the tasks through ``pool.context``
+    :type state: dict
+    :returns: the results, in the same order as the tasks
+    :rtype: list
+    """
+    state = state or dict()
+    if workers <= 1 or len(tasks) <= 1:
+        _init_worker(state)
+        try:
+            return [func(t) for t in tasks]
+        finally:
+            context.clear()
+    with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), initializer=_init_worker,
+                             initargs=(state, timing.is_enabled())) as executor:
+        results = []
+        for result, histograms in executor.map(functools.partial(_timed_task, func), tasks):
+            timing.merge(histograms)
+            results.append(result)
+        return results
+
+
+def imap(func, tasks, workers=1, state=None):
+    """Applies a function to each task like ``run``, yielding each result as soon as it is available
+
+    :param func: a module-level function taking a task as its only argument
+    :type func: callable
+    :param tasks: the list of tasks
+    :type tasks: list
+    :param workers: the number of worker processes (default is 1, i.e. the tasks are run in the current process)
+    :type workers: int
+    :param state: the read-only state made available to the tasks through ``pool.context``
+    :type state: dict
+    :returns: a generator of tuples with the position of the task and its result, in order of completion
+    :rtype: generator
+    """
+    state = state or dict()
+    if workers <= 1 or len(tasks) <= 1:
+        _init_worker(state)
+        try:
+            for i, t in enumerate(tasks):
+                yield i, func(t)
+        finally:
+            context.clear()
+        return
+    with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), initializer=_init_worker,
+                             initargs=(state, timing.is_enabled())) as executor:
+        futures = {executor.submit(_timed_task, func, t): i for i, t in enumerate(tasks)}
+        for future in as_completed(futures):
+            result, histograms = future.result()
+            timing.merge(histograms)
+            yield futures[future], result
@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+def profile_from_counts(keys, counts, member_index):
+    """Computes the frequency of each member of a level from the distinct values of a domain and their counts
+
+    :param keys: the distinct values of the domain
+    :type keys: array-like
+    :param counts: the number of occurrences of each distinct value
+    :type counts: array-like
+    :param member_index: the keys of the members of the level, as returned by ``KG.get_member_index``
+    :type member_index: pandas.Index
+    :returns: a tuple with the array of frequencies, aligned with the members of the level, and the number of
+        distinct values that do not match any member
+    :rtype: tuple
+    """
+    member_ids = member_index.get_indexer(pd.Index(keys, dtype=object))
+    matched = member_ids >= 0
+    frequency = np.bincount(member_ids[matched], weights=np.asarray(counts, dtype=np.float64)[matched],
+                            minlength=len(member_index)).astype(np.int64)
+    return frequency, int(len(member_ids) - np.count_nonzero(matched))
+
+
+def profile_from_values(values, member_index):
+    """Computes the frequency of each member of a level from the values of a domain, factorizing the values once
+
+    :param values: the values of the domain
+    :type values: array-like
+    :param member_index: the keys of the members of the level, as returned by ``KG.get_member_index``
+    :type member_index: pandas.Index
+    :returns: a tuple with the array of frequencies, aligned with the members of the level, and the number of
+        distinct values that do not match any member
+    :rtype: tuple
+    """
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+    return profile_from_counts(uniques, counts, member_index)
+
+
+def to_dict(frequency, other, members):
+    # Sparse representation of a profile: only members that occur, plus the "other" bucket
+    output = dict()
+    for i in np.flatnonzero(frequency):
+        output[members[i]] = int(frequency[i])
+    if other > 0:
+        output["other"] = other
+    return output
+
+
+def profile_pyramid(kg, level, frequency):
+    """Computes the profile of a domain at its level and at every ancestor level, reusing the member -> ancestor
+    tables of the Knowledge Graph
+
+    :param kg: the Knowledge Graph
+    :type kg: KG
+    :param level: the level the domain is mapped to
+    :type level: URIRef
+    :param frequency: the frequencies of the members of the level, as returned by ``profile_from_counts``
+    :type frequency: numpy.ndarray
+    :returns: a dictionary including, for each level from the mapped one upwards, the positions of the members that
+        occur in the domain and their frequencies
+    :rtype: dict
+    """
+    member_ids = np.flatnonzero(frequency)
+    frequencies = frequency[member_ids]
+    pyramid = dict()
+    for ancestor in kg.get_level_closure(level):
+        if len(pyramid) == 0:
+            upper = frequency
+        else:
+            upper = kg.rollup_profile(level, member_ids, frequencies, ancestor)
+        ids = np.flatnonzero(upper)
+        pyramid[str(ancestor)] = (ids.astype(np.int64), upper[ids].astype(np.int64))
+    return pyramid
+
+
+def similarity(query, matrix, measure="cosine"):
+    """Computes the similarity between a profile and each profile in a matrix, in a single vectorized operation over
+    the non-zero entries only
+
+    :param query: the profile to compare, as a 1 x M sparse array of frequencies over the members of a level
+    :type query: scipy.sparse.csr_matrix
+    :param matrix: the profiles to compare with, as a N x M sparse array of frequencies over the same members
+    :type matrix: scipy.sparse.csr_matrix
+    :param measure: the similarity measure, either "cosine" or "js" (i.e. one minus the Jensen-Shannon divergence
+        between the relative frequencies, in base 2) (default is "cosine")
+    :type measure: str
+    :returns: the array of N similarities, between 0 and 1; profiles with no members have similarity 0
+    :rtype: numpy.ndarray
+    """
+    query = sparse.csr_matrix(query, dtype=np.float64)
+    matrix = sparse.csr_matrix(matrix, dtype=np.float64)
+    output = np.zeros(matrix.shape[0])
+    if measure == "cosine":
+        dots = (matrix @ query.T).toarray().ravel()
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel() * query.multiply(query).sum())
+        np.divide(dots, norms, out=output, where=norms > 0)
+        return np.clip(output, 0.0, 1.0)
+    if measure == "js":
+        q = query.toarray().ravel()
+        if q.sum() == 0:
+            return output
+        q = q / q.sum()
+        totals = np.asarray(matrix.sum(axis=1)).ravel()
+        entries = matrix.tocoo()
+        p_values = entries.data / totals[entries.row]
+        q_values = q[entries.col]
+        # Members occurring in only one of the two profiles contribute a constant term: summing over all members, the
+        # divergence is 1 plus a correction computed on the overlapping members
+        overlap = q_values > 0
+        p_values, q_values, rows = p_values[overlap], q_values[overlap], entries.row[overlap]
+        pair_sum = p_values + q_values
+        terms = p_values * np.log2(p_values / pair_sum) + q_values * np.log2(q_values / pair_sum)
+        divergence = 1.0 + 0.5 * np.bincount(rows, weights=terms, minlength=matrix.shape[0])
+        output[totals > 0] = 1.0 - divergence[totals > 0]
+        return np.clip(output, 0.0, 1.0)
+    raise ValueError("Unknown similarity measure: %s" % measure)
@@ -1,10 +1,14 @@
+import os
 import math
 import time
+import argparse
+import tempfile
 from rdflib import Namespace
 from models.KG import KG
-import random
 import pandas as pd
 import numpy as np
+import executors.pool as pool
+import utils.files as files
 
 DATASET_FOLDER = "../datasets/profile_test/"
 GRAPH_FOLDER = "../kg/"
@@ -13,6 +17,13 @@ NUM_ROWS = [10000] #,10000,100000,1000000,10000000]
 NUM_COLS = [20] #, 20, 30, 40, 50] # 2,4,6,8,10
 PERC_DIMENSIONS = 0.2
 PERC_NOISE = [0]
+# Value written in place of a member in the noisy rows
+NOISE_VALUE = 'x'
+# Number of rows generated and written at once
+CHUNK_SIZE = 1000000
+SEED = 42
+# Output format: "csv" or "parquet"
+FORMAT = "csv"
 
 ns_project = Namespace("http://kdmg.dii.univpm.it/test/")
 ns_kpionto = Namespace("http://w3id.org/kpionto/")
@@ -20,70 +31,191 @@ ns_kpionto = Namespace("http://w3id.org/kpionto/")
 kGraph = None
 
 
-def pick_level(levels):
-    return random.choice(levels)
+def plan_ds(num_righe, num_colonne, perc_dimensioni, perc_rumore, kg, rng, zipf=None, fragments=False):
+    """Draws the schema of a dataset: the dimensions and their levels, the number of distinct values of each attribute
+    and the order of the columns. The plan includes the members of the picked levels only, so that the rows can be
+    generated without the Knowledge Graph.
 
-
-def generate_ds(num_righe, num_colonne, perc_dimensioni, perc_rumore, kg):
+    :param num_righe: the number of rows
+    :type num_righe: int
+    :param num_colonne: the number of columns
+    :type num_colonne: int
+    :param perc_dimensioni: the fraction of columns whose values are members of a level
+    :type perc_dimensioni: float
+    :param perc_rumore: the fraction of rows where the value of a dimension column is noise
+    :type perc_rumore: float
+    :param kg: the Knowledge Graph
+    :type kg: KG
+    :param rng: the random generator
+    :type rng: numpy.random.Generator
+    :param zipf: the exponent of a Zipf distribution of the members, or None for a uniform distribution (default)
+    :type zipf: float
+    :param fragments: a boolean expressing whether members are written as fragments (True) or URIs (False) (default
+        is False)
+    :type fragments: bool
+    :returns: a dictionary including rows, noise, dimensions, attributes and columns
+    :rtype: dict
+    """
     num_dimensioni = math.floor(num_colonne * perc_dimensioni)
     num_attributi = num_colonne - num_dimensioni
     all_dimensions = kg.get_dimensions()
 
-    # Initialize DataFrame
-    df = pd.DataFrame()
-    # Generate dimension fields
-    picked_dimensions = random.sample(all_dimensions, num_dimensioni)
-
-    print("Generating dimensions...")
-    for d in picked_dimensions:
+    dimensions = dict()
+    for d in rng.choice(len(all_dimensions), size=num_dimensioni, replace=False):
         # Pick a level
-        level = pick_level(kg.get_levels(d))
-        # Generate members and add noise
-        members = kg.get_members_from_level(level)
-        noise = ['x']
-        num_rumore = math.floor(num_righe * perc_rumore)
-        num_valori = num_righe - num_rumore
-        list_values = random.choices(members, k=num_valori)
-        list_noise = ['x'] * num_rumore #generates the noise elements
-        all_values = list_values + list_noise
-        # Shuffle values and add the column
-        np.random.shuffle(all_values)
-        df[level] = all_values
-
-    print("Generating attributes...")
-    # Generate attribute fields
-    counter = 0
-    for attr in range(0, num_attributi):
-        num_distinct_values = random.choice(range(1, num_righe + 1, math.floor(num_righe / 10)))
-        values = np.random.randint(0, num_distinct_values, size=num_righe)
-        # Add the column
-        df["attr" + str(counter)] = values
-        counter += 1
-
-    print("Shuffling and saving...")
+        levels = kg.get_levels(all_dimensions[d])
+        level = levels[rng.integers(len(levels))]
+        members = np.array([str(m) for m in kg.get_members_from_level(level, fragmentOutput=fragments)], dtype=object)
+        cdf = None
+        if zipf is not None:
+            # The i-th most frequent member is drawn with probability proportional to 1 / i^zipf; ranks are assigned
+            # to members at random, so that skew does not follow the order of the members in the KG
+            weights = 1.0 / np.arange(1, len(members) + 1, dtype=np.float64) ** zipf
+            cdf = np.cumsum(weights[rng.permutation(len(members))])
+            cdf = cdf / cdf[-1]
+        dimensions[level] = {"members": members, "cdf": cdf}
+
+    attributes = dict()
+    step = max(math.floor(num_righe / 10), 1)
+    for counter in range(0, num_attributi):
+        attributes["attr" + str(counter)] = int(rng.choice(np.arange(1, num_righe + 1, step)))
+
+    columns = list(dimensions) + list(attributes)
     # Shuffle columns
-    df = df[np.random.default_rng(seed=42).permutation(df.columns.values)]
+    columns = [columns[i] for i in rng.permutation(len(columns))]
+    return {"rows": num_righe, "noise": math.floor(num_righe * perc_rumore), "dimensions": dimensions,
+            "attributes": attributes, "columns": columns}
+
+
+def generate_chunks(plan, rng, chunk_size=CHUNK_SIZE):
+    """Generates the rows of a planned dataset, chunk by chunk. Members are drawn as integer codes and the noise is
+    injected with a mask: the number of noisy rows of each chunk follows the hypergeometric distribution, so that the
+    dataset has exactly the planned number of noisy rows, spread uniformly, without keeping them all in memory.
+
+    :param plan: the plan of the dataset, as returned by ``plan_ds``
+    :type plan: dict
+    :param rng: the random generator
+    :type rng: numpy.random.Generator
+    :param chunk_size: the number of rows of each chunk (default is ``CHUNK_SIZE``)
+    :type chunk_size: int
+    :returns: a generator of DataFrames, whose dimension columns are categorical
+    :rtype: generator
+    """
+    remaining_noise = {level: plan["noise"] for level in plan["dimensions"]}
+    # The noise value is the last category
+    dtypes = {level: pd.CategoricalDtype(np.append(dimension["members"], NOISE_VALUE))
+              for level, dimension in plan["dimensions"].items()}
+    for start in range(0, plan["rows"], chunk_size):
+        size = min(chunk_size, plan["rows"] - start)
+        data = dict()
+        for level, dimension in plan["dimensions"].items():
+            members = dimension["members"]
+            if dimension["cdf"] is None:
+                codes = rng.integers(0, len(members), size=size)
+            else:
+                codes = np.searchsorted(dimension["cdf"], rng.random(size), side="right")
+                codes = np.minimum(codes, len(members) - 1)
+            num_noise = int(rng.hypergeometric(remaining_noise[level], plan["rows"] - start - remaining_noise[level],
+                                               size)) if remaining_noise[level] > 0 else 0
+            if num_noise > 0:
+                codes[rng.choice(size, size=num_noise, replace=False)] = len(members)
+                remaining_noise[level] = remaining_noise[level] - num_noise
+            data[level] = pd.Categorical.from_codes(codes, dtype=dtypes[level])
+        for attr, num_distinct_values in plan["attributes"].items():
+            data[attr] = rng.integers(0, num_distinct_values, size=size)
+        df = pd.DataFrame(data, index=pd.RangeIndex(start, start + size))
+        yield df[plan["columns"]]
+
+
+def generate_ds(num_righe, num_colonne, perc_dimensioni, perc_rumore, kg, seed=None, zipf=None, fragments=False):
+    # The whole dataset in memory, as a single chunk
+    rng = np.random.default_rng(seed)
+    plan = plan_ds(num_righe, num_colonne, perc_dimensioni, perc_rumore, kg, rng, zipf, fragments)
+    return next(generate_chunks(plan, rng, max(num_righe, 1)))
+
+
+def write_ds(filename, plan, rng, chunk_size=CHUNK_SIZE, format=FORMAT):
+    """Generates a planned dataset and writes it chunk by chunk, to a temporary file first. CSV files include the row
+    number as first, unnamed column; Parquet files keep the dimension columns dictionary-encoded.
+
+    :param filename: the path of the output file
+    :type filename: str
+    :param plan: the plan of the dataset, as returned by ``plan_ds``
+    :type plan: dict
+    :param rng: the random generator
+    :type rng: numpy.random.Generator
+    :param chunk_size: the number of rows written at once (default is ``CHUNK_SIZE``)
+    :type chunk_size: int
+    :param format: "csv" or "parquet" (default is ``FORMAT``)
+    :type format: str
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_file = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    os.close(fd)
+    try:
+        if format == "parquet":
+            # pyarrow is needed only for Parquet output
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            writer = None
+            for chunk in generate_chunks(plan, rng, chunk_size):
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(tmp_file, table.schema)
+                writer.write_table(table)
+            if writer is not None:
+                writer.close()
+        else:
+            with open(tmp_file, 'w', newline='') as f:
+                for i, chunk in enumerate(generate_chunks(plan, rng, chunk_size)):
+                    chunk.to_csv(f, sep=',', header=(i == 0))
+        files.replace(tmp_file, filename)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
+def write_configuration(task):
+    # Generate and write one dataset: it runs in a worker process when several configurations are generated at once
+    filename, plan, seed, chunk_size, format = task
+    start = time.time()
+    write_ds(filename, plan, np.random.default_rng(seed), chunk_size, format)
+    return filename, time.time() - start
 
-    return df
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=NUM_ROWS, help="numbers of rows")
+    parser.add_argument("--cols", type=int, nargs="+", default=NUM_COLS, help="numbers of columns")
+    parser.add_argument("--noise", type=int, nargs="+", default=PERC_NOISE, help="noise percentages")
+    parser.add_argument("--format", choices=["csv", "parquet"], default=FORMAT, help="output format")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="number of rows written at once")
+    parser.add_argument("--zipf", type=float, help="exponent of a Zipf distribution of the members")
+    parser.add_argument("--seed", type=int, default=SEED, help="seed of the random generator")
+    parser.add_argument("--workers", type=int, default=1, help="number of configurations generated in parallel")
+    args = parser.parse_args()
     print("Let's start generating a dataset")
     global kGraph
     print("Importing the Knowledge Graph...")
-    kGraph = KG(GRAPH_FOLDER+GRAPH)
-    counter = 0
-    for num_cols in NUM_COLS:
+    kGraph = KG(GRAPH_FOLDER+GRAPH, snapshot=True)
+    # Plans are drawn here, in order, and the rows in the worker processes: each configuration has its own seed, so
+    # the datasets do not depend on the number of workers
+    tasks = []
+    for num_cols in args.cols:
         #subfolder = str(counter)+"/"
         subfolder =""
-        for num_rows in NUM_ROWS:
-            for noise in PERC_NOISE:
+        for num_rows in args.rows:
+            for noise in args.noise:
                 perc_noise = noise / 100.0
-                start = time.time()
-                df = generate_ds(num_rows, num_cols, PERC_DIMENSIONS, perc_noise, kGraph)
-                filename = DATASET_FOLDER+subfolder+"ds_C"+str(num_cols)+"_R"+str(num_rows)+"_n"+str(noise)+".csv"
-                df.to_csv(filename, sep=',')
-                print("\nAll done.\nRunning time: ", time.time() - start, " seconds")
-        counter += 1
+                seed = np.random.SeedSequence([args.seed, num_cols, num_rows, noise])
+                rng = np.random.default_rng(seed)
+                plan = plan_ds(num_rows, num_cols, PERC_DIMENSIONS, perc_noise, kGraph, rng, args.zipf)
+                filename = DATASET_FOLDER+subfolder+"ds_C"+str(num_cols)+"_R"+str(num_rows)+"_n"+str(noise)+"."+args.format
+                tasks.append((filename, plan, seed.spawn(1)[0], args.chunk_size, args.format))
+    start = time.time()
+    for _, (filename, running_time) in pool.imap(write_configuration, tasks, args.workers):
+        print(filename + ": " + str(running_time) + " seconds")
+    print("\nAll done.\nRunning time: ", time.time() - start, " seconds")
 
 if __name__ == "__main__":
     main()
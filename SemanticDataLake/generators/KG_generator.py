@@ -1,10 +1,20 @@
+import os
+import shutil
+import argparse
+import tempfile
 from rdflib import Bag, Graph, URIRef, Literal, BNode, Seq
 from rdflib.namespace import OWL, RDF
 from rdflib import Namespace
+import executors.pool as pool
+import utils.files as files
 
 ns_project = Namespace("http://kdmg.dii.univpm.it/test/")
 ns_kpionto = Namespace("http://w3id.org/kpionto/")
 
+GRAPH_FOLDER = "../kg/"
+# Number of members written at once when the KG is streamed to disk
+STREAM_BATCH = 100000
+
 graph = None
 
 
@@ -84,15 +94,116 @@ def generateKG(dimensions, levels, initial_population, growing_factor):
     return
 
 
+def _stream_terms(turtle):
+    # Writers of URIs and predicates, as prefixed names in Turtle and as full URIs in N-Triples
+    if turtle:
+        return (lambda name: "ex:" + name), {"type": "a", "Dimension": "kpi:Dimension", "Level": "kpi:Level",
+                                             "Member": "kpi:Member", "inDimension": "kpi:inDimension",
+                                             "rollup": "kpi:rollup", "inLevel": "kpi:inLevel",
+                                             "mRollup": "kpi:mRollup"}
+    terms = {name: "<" + ns_kpionto + name + ">" for name in ("Dimension", "Level", "Member", "inDimension", "rollup",
+                                                               "inLevel", "mRollup")}
+    terms["type"] = "<" + str(RDF.type) + ">"
+    return (lambda name: "<" + ns_project + name + ">"), terms
+
+
+def _stream_dimension(dim):
+    # Write the triples of a dimension, level by level, to its own part file: it runs in a worker process when
+    # several dimensions are generated at once. Members are numbered level by level, so that the parent of the i-th
+    # member of a level is the (i // fanout)-th member of the level above, and no population is kept in memory.
+    levels = pool.context["levels"]
+    fanout = pool.context["fanout"]
+    uri, t = _stream_terms(pool.context["turtle"])
+    dim_name = "D" + str(dim)
+    part_file = os.path.join(pool.context["folder"], dim_name + ".part")
+    with open(part_file, 'w', encoding='utf-8') as f:
+        f.write("%s %s %s .\n" % (uri(dim_name), t["type"], t["Dimension"]))
+        num_members = 1
+        for lev in range(0, levels):
+            lev_name = "L" + str(lev) + "_D" + str(dim)
+            f.write("%s %s %s .\n" % (uri(lev_name), t["type"], t["Level"]))
+            f.write("%s %s %s .\n" % (uri(lev_name), t["inDimension"], uri(dim_name)))
+            upper_name = "L" + str(lev - 1) + "_D" + str(dim)
+            if lev > 0:
+                f.write("%s %s %s .\n" % (uri(lev_name), t["rollup"], uri(upper_name)))
+            num_members = num_members * fanout
+            member_type = " %s %s .\n" % (t["type"], t["Member"])
+            in_level = " %s %s .\n" % (t["inLevel"], uri(lev_name))
+            for start in range(0, num_members, STREAM_BATCH):
+                lines = []
+                for elem in range(start, min(start + STREAM_BATCH, num_members)):
+                    member = uri(str(elem) + "_" + lev_name)
+                    lines.append(member + member_type)
+                    lines.append(member + in_level)
+                    if lev > 0:
+                        lines.append("%s %s %s .\n" % (member, t["mRollup"], uri(str(elem // fanout) + "_" + upper_name)))
+                f.write("".join(lines))
+            print("\t%s: %d members" % (lev_name, num_members))
+    return part_file
+
+
+def streamKG(destination, dimensions, levels, initial_population, growing_factor, workers=1):
+    """Generates the same Knowledge Graph as ``generateKG``, writing its triples straight to a N-Triples or Turtle
+    file (by extension) with constant memory. Dimensions are generated in parallel by the worker processes and
+    concatenated in order, so the file does not depend on the number of workers.
+
+    :param destination: the path of the output file
+    :type destination: str
+    :param dimensions: the number of dimensions
+    :type dimensions: int
+    :param levels: the number of levels of each dimension
+    :type levels: int
+    :param initial_population: the number of members of the top level, and of children of each member
+    :type initial_population: int
+    :param growing_factor: the factor multiplying the initial population
+    :type growing_factor: int
+    :param workers: the number of worker processes (default is 1)
+    :type workers: int
+    """
+    turtle = not destination.endswith(".nt")
+    directory = os.path.dirname(os.path.abspath(destination))
+    folder = tempfile.mkdtemp(dir=directory, suffix=".parts")
+    try:
+        part_files = pool.run(_stream_dimension, list(range(0, dimensions)), workers,
+                              {"folder": folder, "levels": levels, "fanout": initial_population * growing_factor,
+                               "turtle": turtle})
+        # Write to a temporary file first, so that a partial KG is never left at the destination
+        fd, tmp_file = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            if turtle:
+                f.write("@prefix ex: <%s> .\n@prefix kpi: <%s> .\n\n" % (ns_project, ns_kpionto))
+            for part_file in part_files:
+                with open(part_file, 'r', encoding='utf-8') as part:
+                    shutil.copyfileobj(part, f, 1 << 20)
+        files.replace(tmp_file, destination)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
 def main():
     global graph
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dimensions", type=int, default=5, help="number of dimensions")
+    parser.add_argument("--levels", type=int, default=4, help="number of levels of each dimension")
+    parser.add_argument("--population", type=int, default=10, help="initial population of each level")
+    parser.add_argument("--growth", type=int, default=1, help="growing factor of the population")
+    parser.add_argument("--stream", action="store_true",
+                        help="write the triples straight to disk instead of building the graph in memory")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes, in stream mode")
+    parser.add_argument("--out", help="path of the output file, in N-Triples if it ends with .nt, in Turtle otherwise")
+    args = parser.parse_args()
+    destination = args.out or GRAPH_FOLDER + "knowledge_graph_D%d_L%d_%d.ttl" % (args.dimensions, args.levels,
+                                                                               args.population)
+    if args.stream:
+        streamKG(destination, args.dimensions, args.levels, args.population, args.growth, args.workers)
+        return
     graph = Graph()
     graph.bind("kpi", ns_kpionto)
     graph.bind("ex", ns_project)
     # Generate the KG
-    generateKG(5, 4, 10, 1)
+    generateKG(args.dimensions, args.levels, args.population, args.growth)
     # Serialize the KG
-    graph.serialize(destination="../kg/knowledge_graph_D5_L4_10.ttl", format="turtle")
+    graph.serialize(destination=destination, format="turtle")
 
 
 if __name__ == "__main__":
@@ -1,7 +1,13 @@
+import numpy as np
+import executors.profiler as profiler
 from rdflib import Namespace, URIRef
+from rdflib.graph import ReadOnlyGraphAggregate
 from models.KG import KG
 from models.MG import MG
-from typing import List, Dict
+import models.MG as metadata_graph
+from models.QueryRegistry import QueryRegistry
+import utils.timing as timing
+from typing import List, Dict, Tuple
 
 ns_project = Namespace("http://kdmg.dii.univpm.it/test/")
 ns_kpionto = Namespace("http://w3id.org/kpionto/")
@@ -9,28 +15,73 @@ ns_datalake = Namespace("http://kdmg.dii.univpm.it/datalake/")
 ns_dcterms = Namespace("http://purl.org/dc/terms/")
 ns_void = Namespace("http://rdfs.org/ns/void#")
 
+NAMESPACES = {"ex": ns_project, "kpi": ns_kpionto, "dl": ns_datalake, "dcterms": ns_dcterms, "void": ns_void}
+
+# Queries on the global graph: each query text is prepared at its first run and reused afterwards
+queries = QueryRegistry(NAMESPACES)
+
 
 class DL_Graph:
 
     def __init__(self, mg, kg):
-        self.kg = KG(kg)
-        self.mg = MG(mg)
-        self.graph = self.kg.graph + self.mg.graph
+        # The KG indexes are loaded from its compiled snapshot, and its triples are parsed only if a query needs them
+        with timing.span("kg_load"):
+            self.kg = KG(kg, snapshot=True)
+        with timing.span("mg_load"):
+            self.mg = MG(mg)
+        self._graph = None
         self.graph_name = "global graph"
-        self.graph.bind("kpi", ns_kpionto)
-        self.graph.bind("dl", ns_datalake)
-        self.graph.bind("void", ns_void)
-        self.graph.bind("dcterms", ns_dcterms)
 
-    def query_one(self, query):
-        result = self.graph.query(query)
+    @property
+    def graph(self) -> ReadOnlyGraphAggregate:
+        # A read-only view over both graphs: no triple is copied, and changes to the MG are visible at once. The
+        # snapshot of the KG holds its hierarchy indexes only, so the first use of the view parses the KG file.
+        if self._graph is None:
+            self._graph = ReadOnlyGraphAggregate([g for g in (self.kg.graph, self.mg.graph) if g is not None])
+        return self._graph
+
+    def query(self, query, **bindings):
+        """Runs a query on the global graph, preparing it only once. The first query parses the file of the KG, as
+        a boot without snapshot does (the time is reported as "kg_parse" by ``stats``): the accessors of ``kg`` and
+        ``mg`` answer from the indexes instead.
+
+        :param query: the name of a registered query, or the SPARQL text of a query
+        :type query: str
+        :param bindings: the values of the variables of the query, as RDF terms
+        :returns: the list of result rows
+        :rtype: list
+        """
+        return queries.run(self.graph, query, **bindings)
+
+    def get_query_stats(self) -> Dict[str, Dict[str, float]]:
+        """Returns the number of runs and the total time of the queries run on the Metadata Graph and on the global
+        graph
+
+        :returns: a dictionary including the name of a query with its count and time
+        :rtype: dict
+        """
+        output = dict()
+        for name, stats in metadata_graph.queries.get_stats().items():
+            output["MG." + name] = stats
+        for name, stats in queries.get_stats().items():
+            output["DL." + " ".join(name.split())] = stats
+        return output
+
+    def reset_query_stats(self) -> None:
+        """Forgets the statistics of the queries run on the Metadata Graph and on the global graph
+        """
+        metadata_graph.queries.reset_stats()
+        queries.reset_stats()
+
+    def query_one(self, query, **bindings):
+        result = self.query(query, **bindings)
         output = []
         for r in result:
             output.append(r[0])
         return output
 
-    def query_two(self, query):
-        result = self.graph.query(query)
+    def query_two(self, query, **bindings):
+        result = self.query(query, **bindings)
         output = dict()
         for r in result:
             output[r[0]] = r[1]
@@ -47,42 +98,88 @@ class DL_Graph:
         :rtype: list
         """
         if all_levels:
-            result = self.graph.query(
-                """SELECT ?x WHERE {<%s> kpi:rollup* ?x}""" % level)
-        else:
-            result = self.graph.query(
-                """SELECT ?x WHERE {<%s> kpi:rollup ?x}""" % level)
-        output = []
-        for r in result:
-            output.append(r[0])
-        return output
+            return self.kg.get_level_closure(level)
+        return self.kg.get_upper_level(level)
 
-    def get_profile_up(self, domain: URIRef) -> Dict[URIRef, int]:
-        """Returns the upper level profile for a domain by aggregating the frequencies
+    def get_profile_up(self, domain: URIRef, steps: int = 1) -> Dict[URIRef, int]:
+        """Returns the upper level profile for a domain, read from the profile pyramid computed at mount time.
+        Frequencies are aggregated on the fly for domains mounted without a pyramid.
 
         :param domain: the URIRef of a domain
         :type domain: URIRef
+        :param steps: the number of roll-up steps from the level the domain is mapped to (default is 1)
+        :type steps: int
         :returns: a dictionary including a URIRef representing a member and the corresponding frequency
         :rtype: URIRef
         """
-        result = self.graph.query(
-            """SELECT ?mroll (SUM(?f) as ?sum)  WHERE {<%s> dl:hasProfileElement ?b. ?b dl:toMember ?m. """ % domain +
-            """?m kpi:mRollup ?mroll. ?b dl:frequency ?f} GROUP BY ?mroll""")
         output = dict()
-        for r in result:
-            output[r[0]] = r[1].value
+        level = self.mg.get_mapped_level(domain)
+        ancestor = self.kg.get_ancestor_level(level, steps)
+        if ancestor is None:
+            return output
+        upper_members = self.kg.get_members_from_level(ancestor)
+        ids, frequencies = self._get_level_profile(domain, level, ancestor)
+        for i, f in zip(ids, frequencies):
+            output[upper_members[i]] = int(f)
         return output
 
-    def eval_completeness(self, domain: URIRef) -> float:
+    def eval_completeness(self, domain: URIRef, steps: int = 0) -> float:
         """Returns the completeness level of the domain, i.e. considering the cardinality of the level to which the
         domain is mapped to, the completeness is computed as the ratio of level's members that are included in the
-        domain as values
+        domain as values. Values that do not match any member are not counted.
 
         :param domain: the URIRef of a domain
         :type domain: URIRef
-        :returns: a float representing the completeness level
+        :param steps: the number of roll-up steps from the level the domain is mapped to (default is 0, i.e. the
+            completeness at the mapped level)
+        :type steps: int
+        :returns: a float representing the completeness level, or -1 if the level does not exist
         :rtype: float
         """
         level = self.mg.get_mapped_level(domain)
-        members = self.kg.get_members_from_level(level)
-        return len(self.mg.get_profiles(domain)) / len(members)
+        ancestor = self.kg.get_ancestor_level(level, steps)
+        if ancestor is None:
+            return -1
+        members = self.kg.get_members_from_level(ancestor)
+        if len(members) == 0:
+            return -1
+        ids, _ = self._get_level_profile(domain, level, ancestor)
+        return len(ids) / len(members)
+
+    def get_similar_domains(self, domain: URIRef, measure: str = "cosine") -> List[Tuple[URIRef, float]]:
+        """Returns the domains of the Data Lake mapped to the same level of the given domain, ranked by the
+        similarity of their profiles
+
+        :param domain: the URIRef of a domain
+        :type domain: URIRef
+        :param measure: the similarity measure, either "cosine" or "js" (default is "cosine")
+        :type measure: str
+        :returns: a list of tuples including the URIRef of a domain and its similarity with the given domain
+        :rtype: list
+        """
+        level = self.mg.get_mapped_level(domain)
+        if level is None:
+            return []
+        num_members = len(self.kg.get_members_from_level(level))
+        others = [d for d in self.mg.get_domains_mapped_to(level) if d != domain]
+        if len(others) == 0:
+            return []
+        query = self.mg.get_profile_matrix([domain], level, num_members)
+        similarities = profiler.similarity(query, self.mg.get_profile_matrix(others, level, num_members), measure)
+        ranking = np.argsort(-similarities, kind="stable")
+        return [(others[i], float(similarities[i])) for i in ranking]
+
+    def _get_level_profile(self, domain: URIRef, level: URIRef, ancestor: URIRef):
+        # Positions of the members of the ancestor level that occur in the domain, with their frequencies
+        entry = self.mg.get_profile_pyramid(domain)
+        if entry is not None and str(ancestor) in entry[0]:
+            return entry[0][str(ancestor)]
+        profile = self.mg.get_profiles(domain, self.kg.get_members_from_level(level))
+        profile.pop(URIRef("other"), None)
+        profile.pop("other", None)
+        member_ids = self.kg.get_member_index(level).get_indexer([str(m) for m in profile])
+        frequencies = np.array(list(profile.values()), dtype=np.int64)
+        known = member_ids >= 0
+        upper_profile = self.kg.rollup_profile(level, member_ids[known], frequencies[known], ancestor)
+        ids = np.flatnonzero(upper_profile)
+        return ids, upper_profile[ids]
@@ -0,0 +1,158 @@
+import os
+import pickle
+import tempfile
+import numpy as np
+from datasketch import MinHashLSHEnsemble, MinHash, LeanMinHash
+from typing import List, Tuple, Dict, Any
+
+from executors.hashing import batch_ji
+import utils.files as files
+
+# Parameters
+NUM_PERM = 128
+NUM_PART = 32
+THRESHOLD = 0.5
+# The LSH Ensemble of a group is rebuilt when the sources added, replaced or removed since it was built are more than
+# this fraction of its indexed sources (and more than REBUILD_MIN): until then, they are checked one by one
+REBUILD_FRACTION = 0.1
+REBUILD_MIN = 16
+# Increase when the layout of the stored index changes
+INDEX_VERSION = 3
+
+
+class JoinIndex:
+    """Lake-wide index of the combined dimensional-schema signatures of the mounted sources. Sources are grouped by
+    the list of levels their domains are mapped to, since only sources sharing it can be joined. The LSH Ensemble of
+    a group, for THRESHOLD, is built at the first query and stored with the signatures. Sources added or removed
+    afterwards are kept aside and checked one by one, until they are enough to rebuild the ensemble of their group
+    only. Queries at a lower threshold check every source of the group."""
+    index_name = None
+
+    def __init__(self, index_name: str):
+        self.index_name = index_name
+        # source -> (schema, compact MinHash, number of distinct rows)
+        self.signatures = dict()
+        # schema -> {"lsh": ensemble, "indexed": sources, "added": sources, "removed": sources}
+        self._ensembles = dict()
+        if os.path.exists(index_name):
+            with open(index_name, 'rb') as f:
+                stored = pickle.load(f)
+            if stored.get("version") == INDEX_VERSION:
+                self._ensembles = stored["ensembles"]
+            # The ensembles of the previous versions are rebuilt from the signatures, stored alone by the first one
+            self.signatures = stored["signatures"] if "version" in stored else stored
+        # Whether an ensemble was built since the index was stored
+        self.modified = False
+        # schema -> sources
+        self._schemas = dict()
+        for source, (schema, _, _) in self.signatures.items():
+            self._schemas.setdefault(schema, set()).add(source)
+
+    def add(self, source: str, schema: Tuple[str], minhash: MinHash, size: int) -> None:
+        """Adds (or replaces) the combined signature of a source
+
+        :param source: the URI of the source
+        :type source: str
+        :param schema: the levels the combined columns are mapped to, in the order used to hash the rows
+        :type schema: tuple
+        :param minhash: the combined MinHash of the source
+        :type minhash: MinHash
+        :param size: the number of distinct rows of the combined columns
+        :type size: int
+        """
+        self.remove(source)
+        schema = tuple(str(s) for s in schema)
+        self.signatures[str(source)] = (schema, LeanMinHash(minhash), int(size))
+        self._schemas.setdefault(schema, set()).add(str(source))
+        if schema in self._ensembles:
+            self._ensembles[schema]["added"].add(str(source))
+
+    def remove(self, source: str) -> None:
+        """Removes the signature of a source, if any
+
+        :param source: the URI of the source
+        :type source: str
+        """
+        entry = self.signatures.pop(str(source), None)
+        if entry is None:
+            return
+        schema = entry[0]
+        self._schemas[schema].discard(str(source))
+        if len(self._schemas[schema]) == 0:
+            del self._schemas[schema]
+            self._ensembles.pop(schema, None)
+            return
+        ensemble = self._ensembles.get(schema)
+        if ensemble is not None:
+            ensemble["added"].discard(str(source))
+            if str(source) in ensemble["indexed"]:
+                ensemble["removed"].add(str(source))
+
+    def clear(self) -> None:
+        """Removes all the signatures
+        """
+        self.signatures = dict()
+        self._schemas = dict()
+        self._ensembles = dict()
+
+    def get_signature(self, source: str) -> Any:
+        return self.signatures.get(str(source))
+
+    def query(self, source: str, threshold: float = THRESHOLD) -> List[Tuple[str, float, float, float]]:
+        """Returns the sources that can be joined with the given source, ranked by estimated containment
+
+        :param source: the URI of the source
+        :type source: str
+        :param threshold: the minimum containment of the source in the returned sources
+        :type threshold: float
+        :returns: a list of tuples including a source, its estimated joinability index and the bounds of the estimate
+        :rtype: list
+        """
+        entry = self.signatures.get(str(source))
+        if entry is None:
+            return []
+        schema, query, size = entry
+        if threshold >= THRESHOLD:
+            ensemble = self._get_ensemble(schema)
+            candidates = [c for c in ensemble["lsh"].query(query, size)
+                          if c not in ensemble["removed"] and c not in ensemble["added"]]
+            # Sources not in the ensemble yet are checked one by one
+            candidates = candidates + sorted(ensemble["added"])
+        else:
+            # Sources below the threshold of the ensemble may be missed by it: the whole group is checked
+            candidates = sorted(self._schemas[schema])
+        candidates = [c for c in candidates if c != str(source)]
+        if len(candidates) == 0:
+            return []
+        ji, lower, upper = batch_ji(query, size, np.array([self.signatures[c][1].hashvalues for c in candidates]),
+                                    [self.signatures[c][2] for c in candidates])
+        ranking = sorted([r for r in zip(candidates, ji, lower, upper) if r[1] >= threshold],
+                         key=lambda r: r[1], reverse=True)
+        return [(c, float(j), float(lo), float(up)) for c, j, lo, up in ranking]
+
+    def save(self) -> None:
+        """Stores the signatures and the LSH Ensembles, writing to a temporary file first so that a crash never leaves
+        a partial index
+        """
+        directory = os.path.dirname(os.path.abspath(self.index_name))
+        fd, tmp_file = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump({"version": INDEX_VERSION, "signatures": self.signatures, "ensembles": self._ensembles}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        files.replace(tmp_file, self.index_name)
+        self.modified = False
+
+    def _get_ensemble(self, schema: Tuple[str]) -> Dict[str, Any]:
+        # The ensemble of a group, rebuilt from the sources of the group only when too many changed since it was built
+        entry = self._ensembles.get(schema)
+        if entry is not None:
+            changes = len(entry["added"]) + len(entry["removed"])
+            if changes <= max(REBUILD_MIN, REBUILD_FRACTION * len(entry["indexed"])):
+                return entry
+        sources = self._schemas.get(schema, set())
+        lshensemble = MinHashLSHEnsemble(threshold=THRESHOLD, num_perm=NUM_PERM, num_part=NUM_PART)
+        lshensemble.index([(s, self.signatures[s][1], self.signatures[s][2]) for s in sources])
+        entry = {"lsh": lshensemble, "indexed": set(sources), "added": set(), "removed": set()}
+        self._ensembles[schema] = entry
+        self.modified = True
+        return entry
@@ -1,20 +1,346 @@
-from rdflib import Graph, URIRef
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+import pandas as pd
+import utils.timing as timing
+import utils.files as files
+from rdflib import Graph, URIRef, RDF
 from rdflib import Namespace
+from rdflib.util import guess_format
 from typing import List, Dict, Any
 
 
 ns_project = Namespace("http://kdmg.dii.univpm.it/test/")
 ns_kpionto = Namespace("http://w3id.org/kpionto/")
 
+# Increase when the layout of the compiled snapshot changes, to invalidate existing snapshots
+SNAPSHOT_VERSION = 1
+
+
+class _IndexingGraph(Graph):
+    """A graph that hands every parsed triple to the KG indexes without storing it"""
+
+    def __init__(self, kg):
+        super().__init__()
+        self._kg = kg
+
+    def add(self, triple):
+        self._kg._index_triple(*triple)
+        return self
+
 
 class KG:
-    graph = None
+    graph_name = None
+    snapshot_name = None
+    source_hash = None
+
+    def __init__(self, graph_name, lean=False, snapshot=False):
+        """Loads the Knowledge Graph and builds its hierarchy indexes in one pass over the triples
+
+        :param graph_name: the path of the Turtle or N-Triples file of the Knowledge Graph
+        :type graph_name: str
+        :param lean: a boolean expressing whether the indexes are built straight from the parser, without keeping the
+            rdflib Graph in memory (default is False). In lean mode ``graph`` is None.
+        :type lean: bool
+        :param snapshot: a boolean expressing whether the indexes are loaded from the compiled snapshot written next
+            to the file, if it matches the file, and the snapshot is written otherwise (default is False). When the
+            indexes come from the snapshot, the file is parsed only if ``graph`` is used: the snapshot holds the
+            hierarchy indexes only, so that SPARQL queries on the KG still need the parsed triples.
+        :type snapshot: bool
+        """
+        self.graph_name = graph_name
+        self.snapshot_name = graph_name + ".snapshot"
+        self._lean = lean
+        self._graph = None
+        self._snapshot = None
+        self._dimensions = dict()
+        self._levels = dict()
+        self._level_dimensions = dict()
+        self._level_members = dict()
+        self._member_levels = dict()
+        self._level_rollup = dict()
+        self._member_rollup = dict()
+        self._level_fragments = dict()
+        self._member_indexes = dict()
+        self._has_snapshot = False
+        if snapshot and self._load_snapshot():
+            self._has_snapshot = True
+            return
+        if lean:
+            _IndexingGraph(self).parse(graph_name, format=self._get_format())
+        else:
+            for s, p, o in self.graph:
+                self._index_triple(s, p, o)
+        self._finalize_indexes()
+        if snapshot:
+            self.save_snapshot()
+            self._has_snapshot = True
 
-    def __init__(self, graph_name):
-        self.graph = Graph()
-        self.graph.parse(graph_name, format="turtle")
-        self.graph.bind("kpi", ns_kpionto)
-        self.graph.bind("ex", ns_project)
+    @property
+    def graph(self) -> Graph:
+        # The rdflib Graph is parsed at the first use when the indexes come from the snapshot: it is timed as
+        # "kg_parse", since it costs as much as a load without snapshot
+        if self._graph is None and not self._lean:
+            self._graph = Graph()
+            with timing.span("kg_parse"):
+                self._graph.parse(self.graph_name, format=self._get_format())
+            self._graph.bind("kpi", ns_kpionto)
+            self._graph.bind("ex", ns_project)
+        return self._graph
+
+    def _get_format(self) -> str:
+        return guess_format(self.graph_name) or "turtle"
+
+    def _index_triple(self, s, p, o) -> None:
+        if p == RDF.type:
+            if o == ns_kpionto.Dimension:
+                self._dimensions[s] = None
+            elif o == ns_kpionto.Level:
+                self._levels[s] = None
+        elif p == ns_kpionto.inLevel:
+            self._level_members.setdefault(o, []).append(s)
+            self._member_levels.setdefault(s, []).append(o)
+        elif p == ns_kpionto.mRollup:
+            self._member_rollup.setdefault(s, []).append(o)
+        elif p == ns_kpionto.rollup:
+            self._level_rollup.setdefault(s, []).append(o)
+        elif p == ns_kpionto.inDimension:
+            self._level_dimensions.setdefault(s, []).append(o)
+
+    def _finalize_indexes(self) -> None:
+        # Dimensions and levels are sorted by URI, so that the listing order does not depend on the parser
+        self._dimensions = dict.fromkeys(sorted(self._dimensions))
+        self._levels = dict.fromkeys(sorted(self._levels))
+        self._dimension_levels = dict()
+        for lev in self._levels:
+            for dim in self._level_dimensions.get(lev, []):
+                self._dimension_levels.setdefault(dim, []).append(lev)
+        # Members are kept sorted, so that their position in the level is stable across loads
+        for members in self._level_members.values():
+            members.sort()
+        self._build_rollup_closure()
+
+    def _build_rollup_closure(self) -> None:
+        # Level closure: every level reachable through kpi:rollup (the level itself included), with its distance
+        self._level_closure = dict()
+        for lev in self._levels:
+            closure = {lev: 0}
+            frontier = [lev]
+            while len(frontier) > 0:
+                next_frontier = []
+                for lower in frontier:
+                    for upper in self._level_rollup.get(lower, []):
+                        if upper not in closure:
+                            closure[upper] = closure[lower] + 1
+                            next_frontier.append(upper)
+                frontier = next_frontier
+            self._level_closure[lev] = closure
+        # Member -> ancestor tables: for each level and each of its ancestor levels, the position of the ancestor
+        # of every member in the upper level (-1 when the member does not roll up to that level)
+        positions = dict()
+        for lev, members in self._level_members.items():
+            positions[lev] = dict(zip(members, range(len(members))))
+        self._ancestors = dict()
+        for lev in self._levels:
+            self._get_ancestors(lev, positions)
+
+    def _get_ancestors(self, level, positions) -> Dict:
+        if level in self._ancestors:
+            return self._ancestors[level]
+        members = self._level_members.get(level, [])
+        ancestors = {level: np.arange(len(members), dtype=np.int64)}
+        self._ancestors[level] = ancestors
+        for upper in self._level_rollup.get(level, []):
+            upper_positions = positions.get(upper, dict())
+            parent = np.full(len(members), -1, dtype=np.int64)
+            for i, m in enumerate(members):
+                for p in self._member_rollup.get(m, []):
+                    if p in upper_positions:
+                        parent[i] = upper_positions[p]
+                        break
+            # Compose the parent array with the tables of the upper level
+            for ancestor, upper_table in self._get_ancestors(upper, positions).items():
+                if ancestor not in ancestors:
+                    table = np.full(len(members), -1, dtype=np.int64)
+                    valid = parent >= 0
+                    table[valid] = upper_table[parent[valid]]
+                    ancestors[ancestor] = table
+        return ancestors
+
+    def save_snapshot(self) -> None:
+        """Writes the compiled snapshot of the indexes next to the file of the Knowledge Graph: the dictionary of the
+        terms, the members of each level, the member roll-ups and the member -> ancestor tables as arrays, and the
+        small indexes (dimensions, levels and their roll-up closure) as JSON, together with the size, modification
+        time and hash of the file they were built from
+        """
+        self._load_member_maps()
+        term_ids = dict()
+        if self._snapshot is not None:
+            member_levels = list(self._snapshot["member_levels"])
+        else:
+            member_levels = list(self._levels) + [lev for lev in self._level_members if lev not in self._levels]
+        member_ids = []
+        member_offsets = [0]
+        for lev in member_levels:
+            for m in self._get_level_members(lev):
+                member_ids.append(term_ids.setdefault(m, len(term_ids)))
+            member_offsets.append(len(member_ids))
+        rollup_src = []
+        rollup_dst = []
+        for m, parents in self._member_rollup.items():
+            for p in parents:
+                rollup_src.append(term_ids.setdefault(m, len(term_ids)))
+                rollup_dst.append(term_ids.setdefault(p, len(term_ids)))
+        encoded = [str(t).encode('utf-8') for t in term_ids]
+        term_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(t) for t in encoded], out=term_offsets[1:])
+        tables = []
+        ancestor_index = []
+        start = 0
+        for lev, ancestors in self._ancestors.items():
+            for ancestor, table in ancestors.items():
+                tables.append(np.asarray(table, dtype=np.int64))
+                ancestor_index.append((str(lev), str(ancestor), start, start + len(table)))
+                start = start + len(table)
+        stat = os.stat(self.graph_name)
+        self.source_hash = self.source_hash or self._hash_source()
+        meta = {"version": SNAPSHOT_VERSION, "size": stat.st_size, "mtime": stat.st_mtime_ns,
+                "sha256": self.source_hash,
+                "dimensions": [str(d) for d in self._dimensions], "levels": [str(lev) for lev in self._levels],
+                "level_dimensions": {str(k): [str(d) for d in v] for k, v in self._level_dimensions.items()},
+                "level_rollup": {str(k): [str(u) for u in v] for k, v in self._level_rollup.items()},
+                "level_closure": {str(k): {str(a): d for a, d in v.items()} for k, v in self._level_closure.items()},
+                "member_levels": [str(lev) for lev in member_levels], "member_offsets": member_offsets,
+                "ancestors": ancestor_index}
+        arrays = {"terms": np.frombuffer(b"".join(encoded), dtype=np.uint8), "term_offsets": term_offsets,
+                  "member_ids": np.array(member_ids, dtype=np.int64),
+                  "rollup_src": np.array(rollup_src, dtype=np.int64),
+                  "rollup_dst": np.array(rollup_dst, dtype=np.int64),
+                  "ancestor_tables": np.concatenate(tables) if len(tables) > 0 else np.zeros(0, dtype=np.int64)}
+        # The snapshot is written in a temporary folder, with the metadata last, and then moved in place
+        directory = os.path.dirname(os.path.abspath(self.snapshot_name))
+        tmp_folder = tempfile.mkdtemp(dir=directory, suffix=".tmp")
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_folder, name + ".npy"), array)
+        with open(os.path.join(tmp_folder, "meta.json"), 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        files.set_default_mode(tmp_folder)
+        old_folder = None
+        if os.path.exists(self.snapshot_name):
+            old_folder = tempfile.mkdtemp(dir=directory, suffix=".old")
+            os.rmdir(old_folder)
+            os.rename(self.snapshot_name, old_folder)
+        os.rename(tmp_folder, self.snapshot_name)
+        if old_folder is not None:
+            shutil.rmtree(old_folder, ignore_errors=True)
+
+    def get_snapshot_file(self, name: str) -> Any:
+        """Returns the path of a file kept in the compiled snapshot, for data derived from the Knowledge Graph (e.g.
+        the level signatures): such files are discarded whenever the snapshot is written again
+
+        :param name: the name of the file
+        :type name: str
+        :returns: the path of the file, or None if the KG has no snapshot
+        :rtype: str
+        """
+        if not self._has_snapshot:
+            return None
+        return os.path.join(self.snapshot_name, name)
+
+    def _load_snapshot(self) -> bool:
+        # Load the indexes from the snapshot, if it was built from the current file: size and modification time are
+        # compared first, and the file is hashed only when they differ
+        meta_file = os.path.join(self.snapshot_name, "meta.json")
+        if not os.path.exists(meta_file) or not os.path.exists(self.graph_name):
+            return False
+        with open(meta_file, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get("version") != SNAPSHOT_VERSION:
+            return False
+        stat = os.stat(self.graph_name)
+        if stat.st_size != meta["size"] or stat.st_mtime_ns != meta["mtime"]:
+            if self._hash_source() != meta["sha256"]:
+                return False
+            # Same content: record the new modification time, so that the file is not hashed at the next load
+            meta["size"], meta["mtime"] = stat.st_size, stat.st_mtime_ns
+            fd, tmp_file = tempfile.mkstemp(dir=self.snapshot_name, suffix=".tmp")
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+            files.replace(tmp_file, meta_file)
+        self.source_hash = meta["sha256"]
+        arrays = dict()
+        for name in ("terms", "term_offsets", "member_ids", "rollup_src", "rollup_dst", "ancestor_tables"):
+            arrays[name] = np.load(os.path.join(self.snapshot_name, name + ".npy"), mmap_mode='r')
+        self._dimensions = dict.fromkeys(URIRef(d) for d in meta["dimensions"])
+        self._levels = dict.fromkeys(URIRef(lev) for lev in meta["levels"])
+        self._level_dimensions = {URIRef(k): [URIRef(d) for d in v] for k, v in meta["level_dimensions"].items()}
+        self._dimension_levels = dict()
+        for lev in self._levels:
+            for dim in self._level_dimensions.get(lev, []):
+                self._dimension_levels.setdefault(dim, []).append(lev)
+        self._level_rollup = {URIRef(k): [URIRef(u) for u in v] for k, v in meta["level_rollup"].items()}
+        self._level_closure = {URIRef(k): {URIRef(a): d for a, d in v.items()}
+                               for k, v in meta["level_closure"].items()}
+        self._ancestors = dict()
+        for lev, ancestor, start, end in meta["ancestors"]:
+            self._ancestors.setdefault(URIRef(lev), dict())[URIRef(ancestor)] = arrays["ancestor_tables"][start:end]
+        arrays["member_levels"] = {URIRef(lev): i for i, lev in enumerate(meta["member_levels"])}
+        arrays["member_offsets"] = meta["member_offsets"]
+        self._snapshot = arrays
+        return True
+
+    def _term(self, term_id: int) -> URIRef:
+        offsets = self._snapshot["term_offsets"]
+        return URIRef(self._snapshot["terms"][offsets[term_id]:offsets[term_id + 1]].tobytes().decode('utf-8'))
+
+    def _get_level_members(self, level: URIRef) -> List[URIRef]:
+        # With a snapshot, the members of a level are decoded at the first request
+        members = self._level_members.get(level)
+        if members is None and self._snapshot is not None and level in self._snapshot["member_levels"]:
+            i = self._snapshot["member_levels"][level]
+            offsets = self._snapshot["member_offsets"]
+            members = [self._term(t) for t in self._snapshot["member_ids"][offsets[i]:offsets[i + 1]]]
+            self._level_members[level] = members
+        return members if members is not None else []
+
+    def _get_level_size(self, level: URIRef) -> int:
+        if level not in self._level_members and self._snapshot is not None:
+            i = self._snapshot["member_levels"].get(level)
+            if i is None:
+                return 0
+            return self._snapshot["member_offsets"][i + 1] - self._snapshot["member_offsets"][i]
+        return len(self._level_members.get(level, []))
+
+    def _load_member_maps(self) -> None:
+        # With a snapshot, the member -> level and member -> upper member maps are built at the first request
+        if self._snapshot is None or self._snapshot.get("member_maps"):
+            return
+        for lev in self._snapshot["member_levels"]:
+            for m in self._get_level_members(lev):
+                self._member_levels.setdefault(m, []).append(lev)
+        for src, dst in zip(self._snapshot["rollup_src"].tolist(), self._snapshot["rollup_dst"].tolist()):
+            self._member_rollup.setdefault(self._term(src), []).append(self._term(dst))
+        self._snapshot["member_maps"] = True
+
+    def _hash_source(self) -> str:
+        digest = hashlib.sha256()
+        with open(self.graph_name, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _to_uri(self, name: Any, fragment: bool, index: Dict) -> URIRef:
+        # Fragments are resolved against the project namespace, also when they are not flagged as such
+        if fragment or (name not in index and "/" not in name):
+            return URIRef(ns_project + name)
+        return URIRef(name)
+
+    @staticmethod
+    def _fragment(uri: URIRef) -> str:
+        return uri[uri.rfind('/') + 1:]
 
     def get_dimensions(self) -> List[str]:
         """Returns the dimensions from the Knowledge Graph
@@ -22,13 +348,7 @@ class KG:
         :returns: a list of dimensions names
         :rtype: list
         """
-        result = self.graph.query(
-            """SELECT ?x  WHERE {?x rdf:type kpi:Dimension}""")
-        output = []
-        for r in result:
-            index = r[0].rfind('/')
-            output.append(r[0][index + 1:])
-        return output
+        return [self._fragment(d) for d in self._dimensions]
 
     def get_levels(self, dimension: str = None) -> List[Any]:
         """Returns the levels for a given dimension from the Knowledge Graph
@@ -37,16 +357,10 @@ class KG:
         :rtype: list
         """
         if dimension:
-            result = self.graph.query(
-                """SELECT ?x  WHERE {?x rdf:type kpi:Level. ?x kpi:inDimension ex:%s}""" % dimension)
+            levels = self._dimension_levels.get(URIRef(ns_project + dimension), [])
         else:
-            result = self.graph.query(
-                """SELECT ?x  WHERE {?x rdf:type kpi:Level}""")
-        output = []
-        for r in result:
-            index = r[0].rfind('/')
-            output.append(r[0][index + 1:])
-        return output
+            levels = self._levels
+        return [self._fragment(lev) for lev in levels]
 
     def get_members_from_level(self, level: Any, fragmentLevel: bool = False, fragmentOutput: bool = False) -> List[Any]:
         """Returns the list of members of a given level
@@ -60,18 +374,31 @@ class KG:
         :returns: a boolean representing the correct execution of the operation
         :rtype: list
         """
-        if fragmentLevel:
-            level = ns_project + level
-        result = self.graph.query(
-            """SELECT ?x  WHERE {?x kpi:inLevel <%s>}""" % level)
-        output = []
-        for r in result:
-            if fragmentOutput:
-                index = r[0].rfind('/')
-                output.append(r[0][index + 1:])
-            else:
-                output.append(r[0])
-        return output
+        level = self._to_uri(level, fragmentLevel, self._levels)
+        if fragmentOutput:
+            if level not in self._level_fragments:
+                self._level_fragments[level] = [self._fragment(m) for m in self._get_level_members(level)]
+            return list(self._level_fragments[level])
+        return list(self._get_level_members(level))
+
+    def get_member_index(self, level: Any, fragmentLevel: bool = False, fragmentKeys: bool = False) -> pd.Index:
+        """Returns the keys of the members of a given level as an index, whose positions are aligned with the list
+        returned by ``get_members_from_level``
+
+        :param level: a level in the Knowledge Graph
+        :type level: URIRef
+        :param fragmentLevel: a boolean expressing whether the level parameter is a URIRef (False) or a string (True) (default is False).
+        :type fragmentLevel: bool
+        :param fragmentKeys: a boolean expressing whether the keys are the fragments (True) or the URIs (False) of the members (default is False).
+        :type fragmentKeys: bool
+        :returns: the index of the member keys
+        :rtype: pandas.Index
+        """
+        level = self._to_uri(level, fragmentLevel, self._levels)
+        if (level, fragmentKeys) not in self._member_indexes:
+            members = self.get_members_from_level(level, fragmentOutput=fragmentKeys)
+            self._member_indexes[(level, fragmentKeys)] = pd.Index([str(m) for m in members], dtype=object)
+        return self._member_indexes[(level, fragmentKeys)]
 
     def get_level_for_member(self, member: URIRef) -> List[URIRef]:
         """Returns the dimensions from the Knowledge Graph
@@ -81,12 +408,8 @@ class KG:
         :returns: a boolean representing the correct execution of the operation
         :rtype: list
         """
-        result = self.graph.query(
-            """SELECT ?x  WHERE {<%s> kpi:inLevel ?x}""" % member)
-        output = []
-        for r in result:
-            output.append(r[0])
-        return output
+        self._load_member_maps()
+        return list(self._member_levels.get(URIRef(member), []))
 
     def get_upper_level(self, level: URIRef) -> List[URIRef]:
         """Returns the upper level(s) for a given level
@@ -96,9 +419,87 @@ class KG:
         :returns: a list of the URIs for upper levels
         :rtype: list
         """
-        result = self.graph.query(
-            """SELECT ?x  WHERE {<%s> kpi:rollup ?x}""" % level)
-        output = []
-        for r in result:
-            output.append(r[0])
-        return output
+        level = self._to_uri(level, False, self._levels)
+        return list(self._level_rollup.get(level, []))
+
+    def get_level_closure(self, level: Any, fragmentLevel: bool = False) -> List[URIRef]:
+        """Returns the given level and all the levels it rolls up to, directly or not, sorted by distance
+
+        :param level: a level in the Knowledge Graph
+        :type level: URIRef
+        :param fragmentLevel: a boolean expressing whether the level parameter is a URIRef (False) or a string (True) (default is False).
+        :type fragmentLevel: bool
+        :returns: a list of the URIs for the levels
+        :rtype: list
+        """
+        level = self._to_uri(level, fragmentLevel, self._levels)
+        closure = self._level_closure.get(level, {level: 0})
+        return sorted(closure, key=lambda l: closure[l])
+
+    def get_ancestor_level(self, level: Any, steps: int = 1, fragmentLevel: bool = False) -> URIRef:
+        """Returns the level reached by rolling up the given level by a number of steps, or None if there is none
+
+        :param level: a level in the Knowledge Graph
+        :type level: URIRef
+        :param steps: the number of roll-up steps (default is 1)
+        :type steps: int
+        :param fragmentLevel: a boolean expressing whether the level parameter is a URIRef (False) or a string (True) (default is False).
+        :type fragmentLevel: bool
+        :returns: the URI of the upper level
+        :rtype: URIRef
+        """
+        level = self._to_uri(level, fragmentLevel, self._levels)
+        for ancestor, distance in self._level_closure.get(level, dict()).items():
+            if distance == steps:
+                return ancestor
+        return None
+
+    def get_ancestor_table(self, level: Any, ancestor: Any) -> np.ndarray:
+        """Returns, for each member of a level (in the order of ``get_members_from_level``), the position of its
+        ancestor in the members of the upper level, or -1 when the member does not roll up to it
+
+        :param level: a level in the Knowledge Graph
+        :type level: URIRef
+        :param ancestor: one of the levels in the closure of the level
+        :type ancestor: URIRef
+        :returns: the array of positions
+        :rtype: numpy.ndarray
+        """
+        level = self._to_uri(level, False, self._levels)
+        ancestor = self._to_uri(ancestor, False, self._levels)
+        return self._ancestors.get(level, dict()).get(ancestor)
+
+    def rollup_profile(self, level: Any, member_ids: np.ndarray, frequencies: np.ndarray, ancestor: Any) -> np.ndarray:
+        """Rolls up a profile to an upper level, gathering the ancestor of each member and summing the frequencies
+
+        :param level: the level of the profile
+        :type level: URIRef
+        :param member_ids: the positions of the profile members in the level
+        :type member_ids: numpy.ndarray
+        :param frequencies: the frequency of each profile member
+        :type frequencies: numpy.ndarray
+        :param ancestor: the upper level
+        :type ancestor: URIRef
+        :returns: the frequencies of the members of the upper level
+        :rtype: numpy.ndarray
+        """
+        table = self.get_ancestor_table(level, ancestor)
+        size = self._get_level_size(self._to_uri(ancestor, False, self._levels))
+        if table is None:
+            return np.zeros(size, dtype=np.int64)
+        member_ids = np.asarray(member_ids, dtype=np.int64)
+        frequencies = np.asarray(frequencies)
+        upper_ids = table[member_ids]
+        valid = upper_ids >= 0
+        return np.bincount(upper_ids[valid], weights=frequencies[valid], minlength=size).astype(np.int64)
+
+    def get_upper_members(self, member: URIRef) -> List[URIRef]:
+        """Returns the member(s) which the given member rolls up to
+
+        :param member: a member of a level in the Knowledge Graph
+        :type member: URIRef
+        :returns: a list of the URIs for upper members
+        :rtype: list
+        """
+        self._load_member_maps()
+        return list(self._member_rollup.get(URIRef(member), []))
@@ -1,6 +1,19 @@
+import os
+import re
+import hashlib
+import fnmatch
+import tempfile
+import numpy as np
+from scipy import sparse
 from rdflib import Graph, URIRef, Literal, BNode, RDF, XSD
 from rdflib import Namespace
+from rdflib.plugins.parsers.ntriples import W3CNTriplesParser, ParseError, r_tail, r_wspaces
 from datetime import date
+from models.ProfileStore import ProfileStore
+from models.SketchStore import SketchStore
+from models.QueryRegistry import QueryRegistry
+import utils.timing as timing
+import utils.files as files
 from typing import List, Dict, Any
 
 ns_project = Namespace("http://kdmg.dii.univpm.it/test/")
@@ -9,14 +22,38 @@ ns_datalake = Namespace("http://kdmg.dii.univpm.it/datalake/")
 ns_dcterms = Namespace("http://purl.org/dc/terms/")
 ns_void = Namespace("http://rdfs.org/ns/void#")
 
+NAMESPACES = {"rdf": RDF, "kpi": ns_kpionto, "dl": ns_datalake, "dcterms": ns_dcterms, "void": ns_void}
+
+# Queries on the metadata graph, prepared once: the values are bound to the variables named after the parameters
+queries = QueryRegistry(NAMESPACES)
+queries.register("all_paths", """SELECT ?path WHERE {?x rdf:type dl:Source. ?x dl:location ?path}""")
+queries.register("sources", """SELECT ?x  WHERE {?x rdf:type dl:Source}""")
+queries.register("info_source", """SELECT ?date ?location  ?items ?domains  WHERE {?source dcterms:date ?date; """
+                                """dl:location ?location; dl:items ?items; dl:domains ?domains.}""")
+queries.register("mapped_domains", """SELECT ?x ?n  WHERE {?source dl:contains ?x. ?x rdf:type dl:Domain. """
+                                   """?x dl:mapTo ?n}""")
+queries.register("mapped_level", """SELECT ?x  WHERE {?domain dl:mapTo ?x}""")
+queries.register("domains_mapped_to", """SELECT ?x  WHERE {?x dl:mapTo ?level}""")
+queries.register("profile_elements", """SELECT ?m ?f  WHERE {?domain dl:hasProfileElement ?b. """
+                                     """?b dl:toMember ?m. ?b dl:frequency ?f}""")
+
+# The journal is compacted into the Turtle snapshot once it holds this number of operations
+JOURNAL_COMPACT_OPS = 100000
+
 
 class MG:
     graph = None
     graph_name = None
+    journal_name = None
+    profiles = None
+    sketches = None
 
     def __init__(self, graph_name: str):
         self.graph = Graph()
         self.graph_name = graph_name
+        self.journal_name = graph_name + ".journal"
+        self.profiles = ProfileStore(graph_name + ".profiles")
+        self.sketches = SketchStore(graph_name + ".sketches")
         self.graph.parse(graph_name, format="turtle")
         self.graph.bind("kpi", ns_kpionto)
         self.graph.bind("dl", ns_datalake)
@@ -24,6 +61,10 @@ class MG:
         self.graph.bind("dcterms", ns_dcterms)
         self.selected_source = None
         self.selected_domain = None
+        self._base_hash = self._hash_file(graph_name)
+        self._pending = []
+        self._journal_ops = 0
+        self._replay_journal()
 
     def get_all_paths(self) -> List[str]:
         """Extracts the filepaths from all the sources mounted in the Data Lake
@@ -31,8 +72,7 @@ class MG:
         :returns: a list of strings representing the filepaths
         :rtype: list[str]
         """
-        result = self.graph.query(
-            """SELECT ?path WHERE {?x rdf:type dl:Source. ?x dl:location ?path}""")
+        result = queries.run(self.graph, "all_paths")
         output = []
         for r in result:
             output.append(r[0])
@@ -44,8 +84,7 @@ class MG:
         :returns: a list of the URIs (as URIRef) representing the identificators of the sources
         :rtype: list[URIRef]
         """
-        result = self.graph.query(
-            """SELECT ?x  WHERE {?x rdf:type dl:Source}""")
+        result = queries.run(self.graph, "sources")
         output = []
         for r in result:
             output.append(r[0])
@@ -70,9 +109,7 @@ class MG:
         :returns: a dictionary including uri, date, location, number of items and number of domains of the given source
         :rtype: dict
         """
-        result = self.graph.query(
-            """SELECT ?date ?location  ?items ?domains  WHERE {<%s> dcterms:date ?date; """ % source +
-            """dl:location ?location; dl:items ?items; dl:domains ?domains.}""")
+        result = queries.run(self.graph, "info_source", source=URIRef(source))
 
         output = dict()
         for r in result:
@@ -91,8 +128,7 @@ class MG:
         :returns: a dictionary including the URIRef of a domain and the corresponding URIRef of the level in the Knowledge Graph
         :rtype: dict
         """
-        result = self.graph.query(
-            """SELECT ?x ?n  WHERE {<%s> dl:contains ?x. ?x rdf:type dl:Domain. ?x dl:mapTo ?n}""" % source)
+        result = queries.run(self.graph, "mapped_domains", source=URIRef(source))
         output = dict()
         for r in result:
             output[r[0]] = r[1]
@@ -117,26 +153,51 @@ class MG:
         :returns: the URI of the corresponding mapped level
         :rtype: URIRef
         """
-        result = self.graph.query(
-            """SELECT ?x ?n  WHERE {<%s> dl:mapTo ?x}""" % domain)
+        result = queries.run(self.graph, "mapped_level", domain=URIRef(domain))
         output = None
         for r in result:
             output = r[0]
         return output
 
-    def get_profiles(self, domain: URIRef) -> Dict[URIRef, int]:
-        """Returns all the profile items for the given domain
+    def get_domains_mapped_to(self, level: URIRef) -> List[URIRef]:
+        """Returns the domains, across all sources, mapped to the given level in the Knowledge Graph
 
-        :param source: the URI of a domain
-        :type source: URIRef
+        :param level: the URI of a level
+        :type level: URIRef
+        :returns: the list of URIRefs of the domains
+        :rtype: list[URIRef]
+        """
+        result = queries.run(self.graph, "domains_mapped_to", level=URIRef(level))
+        output = []
+        for r in result:
+            output.append(r[0])
+        return output
+
+    def get_profiles(self, domain: URIRef, members: List[URIRef] = None) -> Dict[URIRef, int]:
+        """Returns all the profile items for the given domain, read from the profile store
+
+        :param domain: the URI of a domain
+        :type domain: URIRef
+        :param members: the members of the level the domain is mapped to, in the order of ``KG.get_members_from_level``
+        :type members: list[URIRef]
         :returns: a dictionary including the URI of a member in the Knowledge Graph and the corresponding number of occurrences
         :rtype: dict
         """
         output = dict()
-        if domain is not None:
-            result = self.graph.query(
-                """SELECT ?m ?f  WHERE {<%s> dl:hasProfileElement ?b. """ % domain +
-                """?b dl:toMember ?m. ?b dl:frequency ?f}""")
+        if domain is None:
+            return output
+        entry = self.profiles.get(domain)
+        if entry is not None:
+            pyramid, other = entry
+            if len(pyramid) > 0 and members is not None:
+                ids, frequencies = next(iter(pyramid.values()))
+                for i, f in zip(ids.tolist(), frequencies.tolist()):
+                    output[members[i]] = f
+            if other > 0:
+                output["other"] = other
+        else:
+            # Metadata graphs written before the profile store keep one blank node per profile item
+            result = queries.run(self.graph, "profile_elements", domain=URIRef(domain))
             for r in result:
                 output[r[0]] = r[1].value
         return output
@@ -146,39 +207,133 @@ class MG:
 
         :param domain: the URI of the domain
         :type domain: URIRef
-        :param members: the list of URI of members in the level which the domain is mapped to
+        :param members: the list of URI of members in the level which the domain is mapped to, in the order of
+            ``KG.get_members_from_level``
         :type members: list[URIRef]
         :returns: a list of float representing the relative frequency of the i-th member of the level in the domain
         :rtype: list
         """
-        output = []
+        output = np.zeros(len(members))
+        entry = self.profiles.get(domain)
+        if entry is not None:
+            if len(entry[0]) > 0:
+                ids, frequencies = next(iter(entry[0].values()))
+                output[ids] = frequencies
+            return output.tolist()
         profiles = self.get_profiles(domain)
-        profile_list = [str(key) for key in profiles]
-        member_list = [str(item) for item in members]
-        for m in sorted(member_list):
-            if m in profile_list:
-                output.append(profiles[URIRef(m)])
-            else:
-                output.append(0.0)
-        return output
-
-    def add_profile(self, source: str, domain: str, member: str, frequency: int) -> None:
-        """Adds a profile item to the metadata graph for a domain in a source
+        for i, m in enumerate(members):
+            output[i] = profiles.get(URIRef(m), 0.0)
+        return output.tolist()
+
+    def get_profile_matrix(self, domains: List[URIRef], level: URIRef, num_members: int) -> sparse.csr_matrix:
+        """Returns the profiles of some domains at a level as the rows of a sparse array, whose columns follow the
+        order of the members in ``KG.get_members_from_level``. Domains without profiles at the level give empty rows.
+
+        :param domains: the URIs of the domains
+        :type domains: list[URIRef]
+        :param level: the URI of the level, either the mapped level of the domains or one of its ancestors
+        :type level: URIRef
+        :param num_members: the number of members of the level
+        :type num_members: int
+        :returns: a sparse array with a row of frequencies for each domain
+        :rtype: scipy.sparse.csr_matrix
+        """
+        rows = [np.zeros(0, dtype=np.int64)]
+        cols = [np.zeros(0, dtype=np.int64)]
+        data = [np.zeros(0, dtype=np.int64)]
+        for i, d in enumerate(domains):
+            entry = self.profiles.get(d)
+            if entry is not None and str(level) in entry[0]:
+                ids, frequencies = entry[0][str(level)]
+                rows.append(np.full(len(ids), i, dtype=np.int64))
+                cols.append(np.asarray(ids))
+                data.append(np.asarray(frequencies))
+        return sparse.csr_matrix((np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+                                 shape=(len(domains), num_members))
+
+    def add_profile_pyramid(self, source: str, domain: str, pyramid: Dict[str, Any], other: int) -> None:
+        """Adds the profiles of a domain in a source, at the mapped level and at all the ancestor levels. Profiles are
+        kept in the profile store, and the metadata graph only refers to them with some summary statistics.
 
         :param source: the URI of the source
         :type source: URIRef
         :param domain: the URI of the domain
         :type domain: URIRef
-        :param member: the URI of the member of the profile item
-        :type member: URIRef
-        :param frequency: a int representing the number of occurrences of the member in the domain
-        :type frequency: int
+        :param pyramid: a dictionary including, for each level, the positions of the members in the level and their
+            frequencies, as returned by ``profiler.profile_pyramid``
+        :type pyramid: dict
+        :param other: the number of distinct values that do not match any member
+        :type other: int
         """
-        source_domain = source + "_" + domain
-        profile_node = BNode()
-        self.graph.add((URIRef(ns_project + source_domain), URIRef(ns_datalake + "hasProfileElement"), profile_node))
-        self.graph.add((profile_node, ns_datalake.toMember, URIRef(member)))
-        self.graph.add((profile_node, ns_datalake.frequency, Literal(frequency, datatype=XSD.integer)))
+        source_domain = self._domain_uri(source, domain)
+        self.profiles.put(source_domain, pyramid, other)
+        # The summary statistics of a previous profile are replaced
+        for p in (ns_datalake.profileStore, ns_datalake.members, ns_datalake.occurrences, ns_datalake.otherValues):
+            self._remove_predicate(source_domain, p)
+        ids, frequencies = next(iter(pyramid.values()))
+        self._add((source_domain, ns_datalake.profileStore,
+                   Literal(os.path.basename(self.profiles.folder), datatype=XSD.string)))
+        self._add((source_domain, ns_datalake.members, Literal(len(ids), datatype=XSD.int)))
+        self._add((source_domain, ns_datalake.occurrences, Literal(int(np.sum(frequencies)), datatype=XSD.integer)))
+        self._add((source_domain, ns_datalake.otherValues, Literal(int(other), datatype=XSD.int)))
+
+    def get_profile_pyramid(self, domain: URIRef) -> Any:
+        """Returns the profile pyramid of a domain
+
+        :param domain: the URI of a domain
+        :type domain: URIRef
+        :returns: a tuple with the pyramid and the number of values that do not match any member, or None if the
+            domain has no pyramid
+        :rtype: tuple
+        """
+        if domain is None:
+            return None
+        return self.profiles.get(domain)
+
+    def set_items(self, source: str, num_items: int) -> None:
+        """Updates the number of items of a source
+
+        :param source: the URI of the source
+        :type source: URIRef
+        :param num_items: the number of items in the source
+        :type num_items: int
+        """
+        self._remove_predicate(URIRef(source), URIRef(ns_datalake + "items"))
+        self._add((URIRef(source), URIRef(ns_datalake + "items"), Literal(num_items, datatype=XSD.int)))
+
+    def set_fingerprint(self, source: str, fingerprint: Dict[str, Any]) -> None:
+        """Records the fingerprint of the file of a source, replacing the previous one
+
+        :param source: the URI of the source
+        :type source: URIRef
+        :param fingerprint: the fingerprint, as returned by ``fingerprint.fingerprint``
+        :type fingerprint: dict
+        """
+        source = URIRef(source)
+        values = {ns_datalake.fileSize: Literal(fingerprint["size"], datatype=XSD.long),
+                  ns_datalake.modified: Literal(fingerprint["mtime"], datatype=XSD.long),
+                  ns_datalake.blockSize: Literal(fingerprint["block_size"], datatype=XSD.int),
+                  ns_datalake.blockHashes: Literal(" ".join(fingerprint["blocks"]), datatype=XSD.string)}
+        for p, o in values.items():
+            self._remove_predicate(source, p)
+            self._add((source, p, o))
+
+    def get_fingerprint(self, source: str) -> Any:
+        """Returns the fingerprint of the file of a source recorded at the last mount or sync
+
+        :param source: the URI of the source
+        :type source: URIRef
+        :returns: a dictionary including size, mtime, block_size and blocks, or None if no fingerprint is recorded
+        :rtype: dict
+        """
+        source = URIRef(source)
+        size = self.graph.value(source, ns_datalake.fileSize)
+        if size is None:
+            return None
+        blocks = str(self.graph.value(source, ns_datalake.blockHashes))
+        return {"size": int(size), "mtime": int(self.graph.value(source, ns_datalake.modified)),
+                "block_size": int(self.graph.value(source, ns_datalake.blockSize)),
+                "blocks": blocks.split(" ") if blocks != "" else []}
 
     def add_source(self, source: str, num_items: int, domains: int, filepath: str) ->None:
         """Adds a source to the metadata graph
@@ -192,22 +347,19 @@ class MG:
         :param filepath: the filepath of the source
         :type filepath: str
         """
-        self.graph.add((URIRef(ns_project + source), RDF.type, URIRef(ns_datalake + "Source")))
-        self.graph.add((URIRef(ns_project + source), RDF.type, URIRef(ns_void + "Dataset")))
-        self.graph.add(
+        self._add((URIRef(ns_project + source), RDF.type, URIRef(ns_datalake + "Source")))
+        self._add((URIRef(ns_project + source), RDF.type, URIRef(ns_void + "Dataset")))
+        self._add(
             (URIRef(ns_project + source), URIRef(ns_datalake + "location"), Literal(filepath, datatype=XSD.string)))
-        self.graph.add(
+        self._add(
             (URIRef(ns_project + source), URIRef(ns_dcterms + "date"), Literal(date.today(), datatype=XSD.date)))
-        self.graph.add(
+        self._add(
             (URIRef(ns_project + source), URIRef(ns_datalake + "items"), Literal(num_items, datatype=XSD.int)))
-        self.graph.add(
+        self._add(
             (URIRef(ns_project + source), URIRef(ns_datalake + "domains"), Literal(len(domains), datatype=XSD.int)))
         for d in domains:
-            self.graph.add(
-                (URIRef(ns_project + source + "_" + d), RDF.type, URIRef(ns_datalake + "Domain")))
-            d = d.replace(" ", "_")
-            self.graph.add(
-                (URIRef(ns_project + source), URIRef(ns_datalake + "contains"), URIRef(ns_project + source + "_" + d)))
+            self._add((self._domain_uri(source, d), RDF.type, URIRef(ns_datalake + "Domain")))
+            self._add((URIRef(ns_project + source), URIRef(ns_datalake + "contains"), self._domain_uri(source, d)))
 
     def select_source(self, source: str) -> None:
         """Selects a source for performing actions on it
@@ -250,8 +402,8 @@ class MG:
                 else:
                     print("The identificator does not match any domain.")
 
-            elif type(domain) is str and domain in self.get_mapped_domains(self.selected_source):
-                selected_domain = domain
+            elif type(domain) is str and URIRef(domain) in self.get_mapped_domains(self.selected_source):
+                self.selected_domain = URIRef(domain)
                 print("Selected domain: " + str(self.selected_domain))
             else:
                 print("The identificator does not match any domain.")
@@ -268,7 +420,7 @@ class MG:
         :param level: the fragment of the URI of a level
         :type level: str
         """
-        self.graph.add((URIRef(ns_project + source + "_" + domain), ns_datalake.mapTo, URIRef(ns_project + level)))
+        self._add((self._domain_uri(source, domain), ns_datalake.mapTo, URIRef(ns_project + level)))
 
     def clear(self) -> bool:
         """Remove the selected source from the metadata graph.
@@ -277,26 +429,7 @@ class MG:
         :rtype: bool
         """
         if self.selected_source is not None:
-            uri = self.selected_source
-            try:
-                # Get the columns nodes for the URI
-                domains = self.graph.query(
-                    """SELECT ?x WHERE {<%s> dl:contains ?x}""" % uri)
-                for r in domains:
-                    # Remove the profile nodes
-                    node = r[0]
-                    profile_nodes = self.graph.query("SELECT ?p WHERE {<%s> dl:hasProfileElement ?p}" % node)
-                    for p in profile_nodes:
-                        self.graph.remove((p[0], None, None))
-                    self.graph.remove((r[0], None, None))
-                self.graph.remove((uri, None, None))
-                self.selected_domain = None
-                self.selected_source = None
-            except Exception as e:
-                print(e.args)
-                return False
-            finally:
-                return True
+            return self.remove_sources([self.selected_source])
         else:
             print("No source is selected")
             return True
@@ -304,22 +437,224 @@ class MG:
     def clear_all(self) -> bool:
         """Remove all sources from the metadata graph.
 
+        :returns: a boolean representing the correct execution of the operation
+        :rtype: bool
+        """
+        sources = self.get_sources()
+        result = self.remove_sources(sources)
+        for s in sources:
+            print("\t- Source %s unmounted..." % s)
+        self.serialize()
+        return result
+
+    def remove_sources(self, sources: List[URIRef]) -> bool:
+        """Removes some sources from the metadata graph. Each source owns the triples of its own subject and of its
+        domains, which are reached through the subject index of the graph, so no query is needed. Changes are
+        persisted together at the next serialization.
+
+        :param sources: the URIs of the sources
+        :type sources: list[URIRef]
         :returns: a boolean representing the correct execution of the operation
         :rtype: bool
         """
         try:
-            sources = self.get_sources()
-            for s in sources:
-                self.selected_source = s
-                self.clear()
-                print("\t- Source %s unmounted..." % s)
-            self.serialize()
-        except Exception:
+            for source in sources:
+                source = URIRef(source)
+                # Remove the domain nodes of the source, together with their profiles
+                for d in list(self.graph.objects(source, ns_datalake.contains)):
+                    self._remove_subject(d)
+                    self.profiles.remove(d)
+                self._remove_subject(source)
+                self.sketches.remove(source)
+                if self.selected_source is not None and URIRef(self.selected_source) == source:
+                    self.selected_domain = None
+                    self.selected_source = None
+        except Exception as e:
+            print(e.args)
             return False
-        finally:
-            return True
+        return True
+
+    def match_sources(self, patterns: List[str]) -> List[URIRef]:
+        """Returns the sources matching any of the given patterns, which can be the numeric id of a source as shown in
+        the list of ``sources'', its URI, its name or a glob on the URI or the name (e.g. ``sales_*'')
+
+        :param patterns: the patterns
+        :type patterns: list[str]
+        :returns: the list of matching sources, in the order of ``get_sources''
+        :rtype: list[URIRef]
+        """
+        sources = self.get_sources()
+        output = []
+        for i, s in enumerate(sources):
+            name = str(s)[len(ns_project):] if str(s).startswith(str(ns_project)) else str(s)
+            for pattern in patterns:
+                if pattern == str(i) or fnmatch.fnmatchcase(str(s), pattern) or fnmatch.fnmatchcase(name, pattern):
+                    output.append(s)
+                    break
+        return output
 
     def serialize(self):
         """Serializes the metadata graph in the storage. This operation needs to be done when some changes has been done on the metadata graph.
+        Only the changes done since the last call are appended to the journal, which is compacted into the Turtle
+        snapshot once it grows over ``JOURNAL_COMPACT_OPS`` operations.
+        """
+        with timing.span("serialize"):
+            # New profiles and sketches are written before the journal, and the removed ones are deleted after it: a
+            # crash in between leaves unreferenced entries, but never a referenced one missing
+            self.profiles.write()
+            self.sketches.write()
+            if len(self._pending) > 0:
+                if not os.path.exists(self.journal_name):
+                    self._write_journal_header()
+                # Terms are written as in N-Triples, so that each operation takes exactly one line
+                lines = []
+                for op, item in self._pending:
+                    if op == "+":
+                        lines.append("+ %s %s %s .\n" % (self._nt(item[0]), self._nt(item[1]), self._nt(item[2])))
+                    elif isinstance(item, tuple):
+                        lines.append("- %s %s\n" % (self._nt(item[0]), self._nt(item[1])))
+                    else:
+                        lines.append("- %s\n" % self._nt(item))
+                lines.append("# commit\n")
+                with open(self.journal_name, 'a', encoding='utf-8') as f:
+                    f.writelines(lines)
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._journal_ops += len(self._pending)
+                self._pending = []
+            self.profiles.commit()
+            self.sketches.commit()
+            if self._journal_ops >= JOURNAL_COMPACT_OPS:
+                self.compact()
+
+    def compact(self):
+        """Rewrites the Turtle snapshot of the metadata graph and empties the journal
         """
-        self.graph.serialize(destination=self.graph_name, format="turtle")
+        self._pending = []
+        directory = os.path.dirname(os.path.abspath(self.graph_name))
+        fd, tmp_file = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, 'wb') as f:
+            self.graph.serialize(destination=f, format="turtle")
+            f.flush()
+            os.fsync(f.fileno())
+        files.replace(tmp_file, self.graph_name)
+        # A crash from here on leaves a journal referring to the previous snapshot, which is ignored at replay
+        self._base_hash = self._hash_file(self.graph_name)
+        self._write_journal_header()
+        self._journal_ops = 0
+
+    @staticmethod
+    def _domain_uri(source: str, domain: str) -> URIRef:
+        # Whitespace is not allowed in URIs
+        return URIRef(ns_project + source + "_" + re.sub(r"[ \t\r\n]", "_", str(domain)))
+
+    @staticmethod
+    def _nt(term) -> str:
+        # N-Triples form of a term: literals are escaped, so that they never span several lines
+        if isinstance(term, Literal):
+            text = '"%s"' % (str(term).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+                             .replace("\r", "\\r"))
+            if term.language:
+                return text + "@" + term.language
+            if term.datatype:
+                return text + "^^<%s>" % term.datatype
+            return text
+        return term.n3()
+
+    def _add(self, triple) -> None:
+        self.graph.add(triple)
+        self._pending.append(("+", triple))
+
+    def _remove_subject(self, subject: URIRef) -> None:
+        # Remove all the triples of the subject, and of the blank nodes it refers to
+        nodes = [subject]
+        while len(nodes) > 0:
+            node = nodes.pop()
+            for o in self.graph.objects(node, None):
+                if isinstance(o, BNode):
+                    nodes.append(o)
+            self.graph.remove((node, None, None))
+        self._pending.append(("-", subject))
+
+    def _remove_predicate(self, subject: URIRef, predicate: URIRef) -> None:
+        self.graph.remove((subject, predicate, None))
+        self._pending.append(("-", (subject, predicate)))
+
+    def _write_journal_header(self) -> None:
+        directory = os.path.dirname(os.path.abspath(self.journal_name))
+        fd, tmp_file = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write("# base %s\n" % self._base_hash)
+            f.flush()
+            os.fsync(f.fileno())
+        files.replace(tmp_file, self.journal_name)
+
+    def _replay_journal(self) -> None:
+        # Apply the committed blocks of the journal. A trailing block without commit was interrupted: it is cut off, so
+        # that the next operations are not appended to a torn line.
+        if not os.path.exists(self.journal_name):
+            return
+        with open(self.journal_name, 'rb') as f:
+            header = f.readline().decode('utf-8')
+            if header.strip() != "# base " + self._base_hash:
+                print("The metadata journal does not refer to the current snapshot and has been ignored.")
+                self._write_journal_header()
+                return
+            committed = f.tell()
+            block = []
+            for number, line in enumerate(iter(f.readline, b''), 2):
+                if line == b"# commit\n":
+                    self._apply_block(block)
+                    self._journal_ops += len(block)
+                    committed = f.tell()
+                    block = []
+                else:
+                    block.append((number, line))
+            size = f.tell()
+        if size > committed:
+            with open(self.journal_name, 'r+b') as f:
+                f.truncate(committed)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _apply_block(self, block: List[Any]) -> None:
+        # The whole block is parsed before being applied: a malformed line rejects the journal
+        operations = []
+        for number, line in block:
+            try:
+                text = line.decode('utf-8')
+                if not text.endswith("\n") or text[:2] not in ("+ ", "- "):
+                    raise ParseError("Unknown operation")
+                parser = W3CNTriplesParser()
+                parser.line = text[2:-1]
+                terms = [parser.subject()]
+                if text[0] == "+":
+                    parser.eat(r_wspaces)
+                    terms.append(parser.predicate())
+                    parser.eat(r_wspaces)
+                    terms.append(parser.object())
+                    parser.eat(r_tail)
+                elif parser.line:
+                    parser.eat(r_wspaces)
+                    terms.append(parser.predicate())
+                if parser.line:
+                    raise ParseError("Trailing garbage: %s" % parser.line)
+            except (ParseError, UnicodeDecodeError) as e:
+                raise ValueError("Line %d of %s is malformed: %s" % (number, self.journal_name, e))
+            operations.append((text[0], terms))
+        for op, terms in operations:
+            if op == "+":
+                self.graph.add(tuple(terms))
+            elif len(terms) == 2:
+                self._remove_predicate(terms[0], terms[1])
+            else:
+                self._remove_subject(terms[0])
+        self._pending = []
+
+    @staticmethod
+    def _hash_file(filename: str) -> str:
+        digest = hashlib.sha256()
+        with open(filename, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()
@@ -0,0 +1,140 @@
+import os
+import json
+import hashlib
+import tempfile
+import numpy as np
+from typing import Dict, Any, Tuple
+import utils.files as files
+
+CATALOG = "catalog.json"
+
+
+class ProfileStore:
+    """Columnar store of the profiles of the mapped domains. The profile pyramid of a domain (its profile at the
+    mapped level and at every ancestor level) is kept in a single 2 x N array of member positions and frequencies,
+    stored as ``.npy`` and read through a memory map. A catalogue records, for each domain, the data file, the levels
+    of the pyramid with their offsets in the array, and the number of values that do not match any member.
+
+    Changes are staged and written in two steps. ``write`` adds the new data files and the catalogue entries referring
+    to them, before the metadata graph refers to them; ``commit`` drops the removed domains from the catalogue and
+    deletes the data files no longer referenced, once the metadata graph does not refer to them anymore. Data files
+    are never overwritten, and the catalogue is replaced atomically, so that a crash leaves every domain of the
+    metadata graph readable."""
+    folder = None
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.catalog = dict()
+        if os.path.exists(os.path.join(folder, CATALOG)):
+            with open(os.path.join(folder, CATALOG), 'r', encoding='utf-8') as f:
+                self.catalog = json.load(f)
+        # domain -> (pyramid, other) to write, or None to remove the domain
+        self._pending = dict()
+        # Domains removed and data files replaced by ``write``, dropped by ``commit``
+        self._removed = set()
+        self._replaced = set()
+
+    def put(self, domain: str, pyramid: Dict[str, Tuple[np.ndarray, np.ndarray]], other: int) -> None:
+        """Stages the profile pyramid of a domain, replacing the stored one at the next commit
+
+        :param domain: the URI of the domain
+        :type domain: str
+        :param pyramid: a dictionary including, for each level, the positions of the members in the level and their
+            frequencies, as returned by ``profiler.profile_pyramid``
+        :type pyramid: dict
+        :param other: the number of distinct values that do not match any member
+        :type other: int
+        """
+        self._pending[str(domain)] = (pyramid, int(other))
+
+    def remove(self, domain: str) -> None:
+        """Stages the removal of the profiles of a domain
+
+        :param domain: the URI of the domain
+        :type domain: str
+        """
+        self._pending[str(domain)] = None
+
+    def get(self, domain: str) -> Any:
+        """Returns the profile pyramid of a domain, with arrays mapped from the storage
+
+        :param domain: the URI of the domain
+        :type domain: str
+        :returns: a tuple with the pyramid and the number of values that do not match any member, or None if the
+            domain has no profiles
+        :rtype: tuple
+        """
+        domain = str(domain)
+        if domain in self._pending:
+            return self._pending[domain]
+        entry = self.catalog.get(domain)
+        if entry is None or domain in self._removed:
+            return None
+        data = np.load(os.path.join(self.folder, entry["file"]), mmap_mode='r')
+        offsets = entry["offsets"]
+        pyramid = dict()
+        for i, level in enumerate(entry["levels"]):
+            pyramid[level] = (data[0, offsets[i]:offsets[i + 1]], data[1, offsets[i]:offsets[i + 1]])
+        return pyramid, entry["other"]
+
+    def write(self) -> None:
+        """Writes the staged profiles: new data files first, then the catalogue including them. The removed domains
+        stay in the catalogue, and the replaced data files on disk, until ``commit``
+        """
+        if len(self._pending) == 0:
+            return
+        os.makedirs(self.folder, exist_ok=True)
+        catalog = dict(self.catalog)
+        for domain, entry in self._pending.items():
+            if entry is None:
+                if domain in catalog:
+                    self._removed.add(domain)
+                continue
+            self._removed.discard(domain)
+            if domain in catalog:
+                self._replaced.add(catalog[domain]["file"])
+            pyramid, other = entry
+            ids = [np.asarray(i, dtype=np.int64) for i, _ in pyramid.values()]
+            freqs = [np.asarray(f, dtype=np.int64) for _, f in pyramid.values()]
+            offsets = np.concatenate(([0], np.cumsum([len(i) for i in ids]))).tolist()
+            data = np.vstack((np.concatenate(ids), np.concatenate(freqs))) if len(ids) > 0 \
+                else np.zeros((2, 0), dtype=np.int64)
+            prefix = hashlib.sha1(domain.encode('utf-8')).hexdigest() + "_"
+            fd, filename = tempfile.mkstemp(dir=self.folder, prefix=prefix, suffix=".npy")
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, data)
+                f.flush()
+                os.fsync(f.fileno())
+            files.set_default_mode(filename)
+            catalog[domain] = {"file": os.path.basename(filename), "levels": list(pyramid.keys()),
+                               "offsets": offsets, "other": int(other)}
+        if catalog != self.catalog:
+            self._write_catalog(catalog)
+        self._pending = dict()
+
+    def commit(self) -> None:
+        """Writes the staged profiles, if ``write`` was not called, then drops the removed domains from the catalogue
+        and deletes the data files that are no longer referenced
+        """
+        self.write()
+        if len(self._removed) == 0 and len(self._replaced) == 0:
+            return
+        obsolete = self._replaced | set(self.catalog[domain]["file"] for domain in self._removed)
+        if len(self._removed) > 0:
+            self._write_catalog({domain: entry for domain, entry in self.catalog.items()
+                                 if domain not in self._removed})
+        referenced = set(entry["file"] for entry in self.catalog.values())
+        for filename in obsolete - referenced:
+            if os.path.exists(os.path.join(self.folder, filename)):
+                os.remove(os.path.join(self.folder, filename))
+        self._removed = set()
+        self._replaced = set()
+
+    def _write_catalog(self, catalog: Dict[str, Any]) -> None:
+        fd, tmp_file = tempfile.mkstemp(dir=self.folder, suffix=".tmp")
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(catalog, f)
+            f.flush()
+            os.fsync(f.fileno())
+        files.replace(tmp_file, os.path.join(self.folder, CATALOG))
+        self.catalog = catalog
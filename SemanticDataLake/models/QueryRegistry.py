@@ -0,0 +1,89 @@
+import time
+from collections import OrderedDict
+from rdflib import Graph
+from rdflib.plugins.sparql import prepareQuery
+from typing import Dict, Any, List
+
+# Number of ad-hoc query texts kept prepared: beyond it, the least recently run is dropped
+ADHOC_CACHE_SIZE = 128
+# Name under which the runs of ad-hoc queries are counted
+ADHOC = "(ad hoc)"
+
+
+class QueryRegistry:
+    """Registry of SPARQL queries, parsed and translated once with ``prepareQuery`` and run with ``initBindings``, so
+    that values are bound as RDF terms instead of being formatted in the query text. The number of runs and the total
+    time of each query are counted."""
+
+    def __init__(self, namespaces: Dict[str, Any]):
+        """
+        :param namespaces: the prefixes used in the queries, with their namespaces
+        :type namespaces: dict
+        """
+        self.namespaces = dict(namespaces)
+        self._queries = dict()
+        self._texts = dict()
+        # Ad-hoc text -> prepared query, least recently run first
+        self._adhoc = OrderedDict()
+        self.stats = dict()
+
+    def register(self, name: str, text: str) -> None:
+        """Registers a query, which is prepared at its first run
+
+        :param name: the name of the query
+        :type name: str
+        :param text: the SPARQL text of the query, where the values to bind are variables
+        :type text: str
+        """
+        self._texts[name] = text
+        self._queries.pop(name, None)
+        self._adhoc.pop(name, None)
+
+    def run(self, graph: Graph, name: str, **bindings) -> List[Any]:
+        """Runs a query on a graph. A text that is not the name of a registered query is run as an ad-hoc query: the
+        last ``ADHOC_CACHE_SIZE`` ad-hoc texts are kept prepared, and their runs are counted together under ``ADHOC``.
+
+        :param graph: the graph
+        :type graph: Graph
+        :param name: the name of a registered query, or the SPARQL text of a query
+        :type name: str
+        :param bindings: the values of the variables of the query, as RDF terms
+        :returns: the list of result rows
+        :rtype: list
+        """
+        start_time = time.perf_counter()
+        if name in self._texts:
+            query = self._queries.get(name)
+            if query is None:
+                query = prepareQuery(self._texts[name], initNs=self.namespaces)
+                self._queries[name] = query
+            key = name
+        else:
+            query = self._adhoc.get(name)
+            if query is None:
+                # Prepared before it is cached, so that a text that does not parse is not kept
+                query = prepareQuery(name, initNs=self.namespaces)
+                self._adhoc[name] = query
+                if len(self._adhoc) > ADHOC_CACHE_SIZE:
+                    self._adhoc.popitem(last=False)
+            else:
+                self._adhoc.move_to_end(name)
+            key = ADHOC
+        rows = list(graph.query(query, initBindings=bindings))
+        stats = self.stats.setdefault(key, [0, 0.0])
+        stats[0] = stats[0] + 1
+        stats[1] = stats[1] + (time.perf_counter() - start_time)
+        return rows
+
+    def get_stats(self) -> Dict[str, Dict[str, float]]:
+        """Returns the number of runs and the total time, in seconds, of each query that has been run
+
+        :returns: a dictionary including the name of a query with its count and time
+        :rtype: dict
+        """
+        return {name: {"count": count, "time": total} for name, (count, total) in self.stats.items()}
+
+    def reset_stats(self) -> None:
+        """Forgets the number of runs and the total time of the queries
+        """
+        self.stats.clear()
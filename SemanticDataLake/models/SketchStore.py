@@ -0,0 +1,94 @@
+import os
+import pickle
+import hashlib
+import tempfile
+from typing import Dict, Any, List
+import utils.files as files
+
+
+class SketchStore:
+    """Store of the state needed to synchronize a source without reading it again: its columns, the sketch of each
+    column (MinHash and, for columns that can be mapped, the value counts) and its dimensional schema. Each source is
+    kept in its own pickle file. Changes are staged: ``write`` replaces the file of each updated source atomically,
+    before the metadata graph refers to it, and ``commit`` deletes the files of the removed sources, once the
+    metadata graph does not refer to them anymore."""
+    folder = None
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        # source -> state to write, or None to remove the source
+        self._pending = dict()
+        # Sources removed by ``write``, whose files are deleted by ``commit``
+        self._removed = set()
+
+    def put(self, source: str, columns: List[str], sketches: Dict[str, Any], dimensions: List[Any]) -> None:
+        """Stages the state of a source, replacing the stored one at the next commit
+
+        :param source: the URI of the source
+        :type source: str
+        :param columns: the columns of the source, as in its header
+        :type columns: list
+        :param sketches: the ColumnSketch of each column
+        :type sketches: dict
+        :param dimensions: the dimensional schema, as (level, column) pairs ordered by level
+        :type dimensions: list
+        """
+        self._pending[str(source)] = {"columns": list(columns), "sketches": sketches,
+                                      "dimensions": [tuple(d) for d in dimensions]}
+
+    def remove(self, source: str) -> None:
+        """Stages the removal of the state of a source
+
+        :param source: the URI of the source
+        :type source: str
+        """
+        self._pending[str(source)] = None
+
+    def get(self, source: str) -> Any:
+        """Returns the state of a source
+
+        :param source: the URI of the source
+        :type source: str
+        :returns: a dictionary including columns, sketches and dimensions, or None if the source has no state
+        :rtype: dict
+        """
+        source = str(source)
+        if source in self._pending:
+            return self._pending[source]
+        if source in self._removed:
+            return None
+        filename = self._get_file(source)
+        if not os.path.exists(filename):
+            return None
+        with open(filename, 'rb') as f:
+            return pickle.load(f)
+
+    def write(self) -> None:
+        """Writes the staged states. The files of the removed sources are kept until ``commit``
+        """
+        if len(self._pending) == 0:
+            return
+        os.makedirs(self.folder, exist_ok=True)
+        for source, state in self._pending.items():
+            if state is None:
+                self._removed.add(source)
+                continue
+            self._removed.discard(source)
+            fd, tmp_file = tempfile.mkstemp(dir=self.folder, suffix=".tmp")
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            files.replace(tmp_file, self._get_file(source))
+        self._pending = dict()
+
+    def commit(self) -> None:
+        """Writes the staged states, if ``write`` was not called, then deletes the files of the removed sources
+        """
+        self.write()
+        for source in self._removed:
+            filename = self._get_file(source)
+            if os.path.exists(filename):
+                os.remove(filename)
+        self._removed = set()
+
+    def _get_file(self, source: str) -> str:
+        return os.path.join(self.folder, hashlib.sha1(source.encode('utf-8')).hexdigest() + ".pkl")
@@ -1,8 +1,19 @@
 from cmd import Cmd
 import re
+from rdflib import URIRef
 from models.DL_Graph import DL_Graph
-import pandas as pd
+from models.MG import ns_project
 import executors.mapper_auto as mapper_auto
+import executors.pool as pool
+import executors.fingerprint as fingerprint
+import executors.hashing as hashing
+import utils.timing as timing
+from datasketch import MinHash
+import models.JoinIndex as join_index
+from models.JoinIndex import JoinIndex
+import argparse
+import glob
+import time
 from os.path import exists
 
 DATASET_FOLDER = "../datasets/"
@@ -10,7 +21,12 @@ GRAPH_FOLDER = "../kg/"
 GRAPH = "knowledge_graph_D5_L3_10.ttl"
 METAGRAPH_FOLDER = "../mg/"
 METAGRAPH = "metadata.ttl"
+JOIN_INDEX = "joinability.pkl"
 LOG_DIRECTORY = "../logs/"
+CACHE_FOLDER = "../cache/"
+CHUNK_SIZE = 100000
+# Number of worker processes used when mounting a source
+WORKERS = 1
 
 
 class MyPrompt(Cmd):
@@ -25,9 +41,19 @@ class MyPrompt(Cmd):
             check = input("Metadata layer is being cleared. Do you confirm? [Y/N] ")
             if check == "Y":
                 if mg.clear_all():
+                    joinindex.clear()
+                    joinindex.save()
                     print("The metadata layer has been reset.")
                 else:
                     print("Some issues occurred.")
+        elif inp != "":
+            sources = mg.match_sources(inp.split())
+            if len(sources) == 0:
+                print("No source matches.")
+                return
+            check = input("%d source(s) are being removed. Do you confirm? [Y/N] " % len(sources))
+            if check == "Y":
+                self._unmount_sources(sources)
 
     def do_describe(self, inp):
         selected_source = mg.get_selected_source()
@@ -47,6 +73,11 @@ class MyPrompt(Cmd):
                     print("\tcompleteness level = "+str(completeness_level*100)+"%")
                 else:
                     print("Error in the computation of the completeness level")
+                # Completeness of the domain rolled up to the upper levels
+                for steps, upper in enumerate(dlGraph.get_rollup_level(domains[d], True)[1:], 1):
+                    completeness_level = dlGraph.eval_completeness(d, steps)
+                    if completeness_level >= 0:
+                        print("\t\tat " + str(upper) + " = " + str(completeness_level*100) + "%")
 
         else:
             print("No source in use.")
@@ -54,62 +85,64 @@ class MyPrompt(Cmd):
     def do_focus(self, inp):
         mg.select_domain(inp)
 
-    def do_mount(self, file_path, remount=False):
-        real_path = DATASET_FOLDER + file_path
-        if real_path not in mg.get_all_paths():
-            if exists(real_path):
+    def do_joinable(self, inp):
+        selected_source = mg.get_selected_source()
+        if selected_source is not None:
+            if joinindex.get_signature(selected_source) is None:
+                print("The source has no mapped domains to join on.")
+                return
+            threshold = float(inp) if inp != "" else join_index.THRESHOLD
+            ranking = joinindex.query(selected_source, threshold)
+            # Store the ensemble built for the query, so that it is not built again at the next boot
+            if joinindex.modified:
+                joinindex.save()
+            if len(ranking) == 0:
+                print("No joinable source.")
+            for i, (source, ji, lower, upper) in enumerate(ranking):
+                print(str(i) + ") " + str(source))
+                print("\tjoinability index = %.2f [%.2f, %.2f]" % (ji, lower, upper))
+        else:
+            print("No source in use.")
 
-                # Initialize LSHEnsemble
-                lshensemble = mapper_auto.initialize_lsh(kg)
-
-                # Import the file
-                df = pd.read_csv(real_path)
-                num_rows = len(df.index)
-                num_columns = len(df.columns)
-                all_sources = mg.get_sources()
-                filename = file_path[: file_path.rfind('.')]
-                uri_to_save = filename
-                counter = 1
-                while uri_to_save in all_sources:
-                    uri_to_save = uri_to_save + "_" + counter
-                # Add the source in the Metadata Graph
-                mg.add_source(uri_to_save, num_rows, df.columns[1:], real_path)
-                # Process each column
-                for col in df.columns:
-                    # Extract value list
-                    values = df[col].astype('str').tolist()
-                    # Discover the mapping
-                    mappings = mapper_auto.map_source_domain(values, lshensemble)
-                    list_mappings = list(mappings)
-                    if len(list_mappings) > 0:
-                        level = list_mappings[0]
-                        mg.map(uri_to_save, col, level)
-                        members = kg.get_members_from_level(level, fragmentLevel=False, fragmentOutput=False)
-                        # Calculate and process the profiles for the column
-                        profile = mapper_auto.calculate_profile(values, members)
-                        for p, freq in profile.items():
-                            # Store a profile item
-                            mg.add_profile(uri_to_save, level, p, freq)
-                # Store the updated Metadata Graph
-                mg.serialize()
-                if not remount:
-                    print("The source has been mounted.")
-                else:
-                    print("The source has been synchronized.")
+    def do_mount(self, file_path, remount=False):
+        with timing.span("mount"):
+            if glob.has_magic(file_path):
+                self._mount_many(file_path)
             else:
-                print("The specified file does not exist.")
-        else:
-            print("The source is already mounted.")
+                self._mount_one(file_path, remount)
 
     def do_sync(self, inp):
-        try:
-            print("Synchronizing the source...")
-            info = mg.get_info_source(mg.selected_source)
-            mg.clear()
-            self.do_mount(info["location"], remount=True)
-        except Exception as e:
-            print(e)
-            print("Some issues occurred.")
+        selected_source = mg.get_selected_source()
+        if selected_source is None:
+            print("No source in use.")
+            return
+        with timing.span("sync"):
+            try:
+                print("Synchronizing the source...")
+                info = mg.get_info_source(selected_source)
+                real_path = str(info["location"])
+                previous = mg.get_fingerprint(selected_source)
+                state = mg.sketches.get(selected_source)
+                if previous is None or state is None:
+                    change = fingerprint.MODIFIED
+                else:
+                    change = fingerprint.detect_change(real_path, previous)
+                if change == fingerprint.MISSING:
+                    print("The specified file does not exist.")
+                elif change == fingerprint.UNCHANGED:
+                    print("The source is up to date.")
+                elif change == fingerprint.APPENDED and mapper_auto.get_format(real_path) == "csv" and \
+                        self._sync_appended(selected_source, info, previous, state):
+                    print("The source has been synchronized.")
+                else:
+                    # The location already includes the dataset folder
+                    file_path = real_path[len(DATASET_FOLDER):] if real_path.startswith(DATASET_FOLDER) else real_path
+                    joinindex.remove(selected_source)
+                    mg.clear()
+                    self.do_mount(file_path, remount=True)
+            except Exception as e:
+                print(e)
+                print("Some issues occurred.")
 
     def do_profile(self, inp):
         selected_source = mg.get_selected_source()
@@ -118,7 +151,7 @@ class MyPrompt(Cmd):
             if inp == "all":
                 domains = mg.get_mapped_domains(selected_source)
                 for d in domains:
-                    profile = mg.get_profiles(d)
+                    profile = mg.get_profiles(d, kg.get_members_from_level(domains[d]))
                     self._show_profile(d, profile)
             # Profile the selected domain
             else:
@@ -127,14 +160,15 @@ class MyPrompt(Cmd):
                     # Profile the domain at its level
                     if inp == "":
                         level = mg.get_mapped_level(selected_domain)
-                        members = kg.get_members_from_level(level, fragmentLevel=True, fragmentOutput=False)
-                        profile = mg.get_profiles(selected_domain)
+                        members = kg.get_members_from_level(level)
+                        profile = mg.get_profiles(selected_domain, members)
                         self._show_profile(selected_domain, profile)
                         mg.get_vect_profiles(selected_domain, members)
 
-                    # Profile a domain with roll up
-                    elif re.search("^up$", inp) is not None:
-                        profile = dlGraph.get_profile_up(selected_domain)
+                    # Profile a domain with roll up, by one or more levels
+                    elif re.search("^up( [0-9]+)?$", inp) is not None:
+                        steps = int(inp[3:]) if len(inp) > 2 else 1
+                        profile = dlGraph.get_profile_up(selected_domain, steps)
                         self._show_profile(selected_domain, profile)
                 else:
                     print("No focus on a domain.")
@@ -145,6 +179,24 @@ class MyPrompt(Cmd):
         print("Bye")
         return True
 
+    def do_similar(self, inp):
+        selected_domain = mg.get_selected_domain()
+        if selected_domain is not None:
+            args = inp.split()
+            measure = args[0] if len(args) > 0 and not args[0].isdigit() else "cosine"
+            top = int(args[-1]) if len(args) > 0 and args[-1].isdigit() else None
+            if measure not in ("cosine", "js"):
+                print("Unknown similarity measure: use cosine or js.")
+                return
+            ranking = dlGraph.get_similar_domains(selected_domain, measure)
+            if len(ranking) == 0:
+                print("No other domain is mapped to the same level.")
+            for i, (d, score) in enumerate(ranking[:top]):
+                print(str(i) + ") " + str(d))
+                print("\tsimilarity = %.4f" % score)
+        else:
+            print("No focus on a domain.")
+
     def do_sources(self, inp):
         sources = mg.get_sources()
         if len(sources) == 0:
@@ -156,11 +208,41 @@ class MyPrompt(Cmd):
             print("Location: " + str(infos["location"]))
         print("")
 
+    def do_stats(self, inp):
+        args = inp.split()
+        if len(args) == 0:
+            self._show_stats()
+        elif args[0] == "on":
+            timing.enable(True)
+            print("Timings are being collected.")
+        elif args[0] == "off":
+            timing.enable(False)
+            print("Timings are no longer collected.")
+        elif args[0] == "reset":
+            timing.reset()
+            dlGraph.reset_query_stats()
+            print("Timings have been reset.")
+        elif args[0] == "json" and len(args) == 2:
+            timing.export(args[1], {"queries": dlGraph.get_query_stats()})
+            print("Timings have been written to " + args[1] + ".")
+        else:
+            self.help_stats()
+
     def do_unmount(self, inp):
+        if inp != "":
+            sources = mg.match_sources(inp.split())
+            if len(sources) == 0:
+                print("No source matches.")
+            else:
+                self._unmount_sources(sources)
+            return
+        selected_source = mg.get_selected_source()
         result = mg.clear()
         if result:
             print("The source has been unmounted.")
             mg.serialize()
+            joinindex.remove(selected_source)
+            joinindex.save()
         else:
             print("Some error occurred while unmounting the source.")
 
@@ -171,7 +253,8 @@ class MyPrompt(Cmd):
     # Help methods
     #########################################################################
     def help_clean(self):
-        print("Remove all sources from the Metadata layer.\nUsage: clean all")
+        print("Remove all sources, or the sources matching the given ids, names or glob patterns, from the Metadata "
+              "layer.\nUsage: clean {all | PATTERN [PATTERN ...]}")
     def help_describe(self):
         print("Provides the description of the source schema and mappings for the selected source.\nUsage: describe")
 
@@ -179,24 +262,41 @@ class MyPrompt(Cmd):
         print(
             "Select a domain of the selected source on which the following commands will be executed.\nUsage: focus {ID_COLUMN | URI}")
 
+    def help_joinable(self):
+        print("List the sources that can be joined with the selected source on its mapped domains, ranked by "
+              "estimated containment.\nUsage: joinable [THRESHOLD]")
+
     def help_mount(self):
-        print("Mount a new source in the Data Lake.\nUsage: mount FILEPATH")
+        print("Mount a new source in the Data Lake, or all the files matching a glob pattern (e.g. DIR/*.csv), which "
+              "are processed in parallel by the worker processes. Sources can be CSV, Parquet (.parquet) or Arrow IPC "
+              "(.arrow, .feather, .ipc) files.\nUsage: mount {FILEPATH | PATTERN}")
 
     def help_profile(self):
         print(
-            "Shows the profile of the selected domain from the selected source. With 'up' shows the aggregated "
-            "profile.\nUsage: profile [up]")
+            "Shows the profile of the selected domain from the selected source. With 'up' shows the profile "
+            "aggregated at the upper level, or N levels up.\nUsage: profile [all | up [N]]")
 
     def help_quit(self):
         print("Exits the console.\nUsage: quit")
 
+    def help_similar(self):
+        print("List the domains mapped to the same level of the selected domain, ranked by the similarity of their "
+              "profiles (cosine or Jensen-Shannon), optionally only the first N.\nUsage: similar [cosine | js] [N]")
+
     def help_sources(self):
         print("List the sources loaded in the Data Lake.\nUsage: sources ")
 
+    def help_stats(self):
+        print("Show the timings of each operation (count, total, median, 95th percentile and maximum, in ms) and of "
+              "each query, turn their collection on or off, reset them or export them as JSON.\n"
+              "Usage: stats [on | off | reset | json FILEPATH]")
+
     def help_sync(self):
-        print("Synchronize the metadata for the selected source by performing unumount and mount.\nUsage: sync")
+        print("Synchronize the metadata for the selected source. Unchanged files are skipped, rows appended to a file "
+              "are read alone, otherwise the source is unmounted and mounted again.\nUsage: sync")
     def help_unmount(self):
-        print("Unmount the selected source.\nUsage: unmount")
+        print("Unmount the selected source, or the sources matching the given ids, names or glob patterns.\n"
+              "Usage: unmount [PATTERN [PATTERN ...]]")
 
     def help_use(self):
         print("Select a source on which the following commands will be executed.\nUsage: use {ID_SOURCE | URI}")
@@ -204,6 +304,162 @@ class MyPrompt(Cmd):
     do_EOF = do_quit
     help_EOF = help_quit
 
+    def _add_source(self, file_path, real_path, num_rows, columns, results, dimensions, combined, size, sketches,
+                    file_fingerprint):
+        # Add a scanned source to the Metadata Graph and to the joinability index, without persisting them
+        all_sources = mg.get_sources()
+        filename = file_path[: file_path.rfind('.')]
+        uri_to_save = filename
+        counter = 1
+        while URIRef(ns_project + uri_to_save) in all_sources:
+            uri_to_save = filename + "_" + str(counter)
+            counter = counter + 1
+        # Add the source in the Metadata Graph: the first column of a CSV source is the row number
+        domains = columns[1:] if mapper_auto.get_format(real_path) == "csv" else columns
+        mg.add_source(uri_to_save, num_rows, domains, real_path)
+        # Merge the results of each column
+        for col, level, pyramid, other in results:
+            if level is not None:
+                mg.map(uri_to_save, col, level)
+                # Store the profiles of the domain
+                mg.add_profile_pyramid(uri_to_save, col, pyramid, other)
+        # Index the combined signature of the dimensional schema
+        if combined is not None:
+            joinindex.add(URIRef(ns_project + uri_to_save), [level for level, _ in dimensions], combined, size)
+        # Keep what is needed to synchronize the source incrementally
+        mg.set_fingerprint(URIRef(ns_project + uri_to_save), file_fingerprint)
+        mg.sketches.put(URIRef(ns_project + uri_to_save), columns, sketches, dimensions)
+
+    def _mount_one(self, file_path, remount=False):
+        # Mount a single file, persisting the changes at the end
+        real_path = DATASET_FOLDER + file_path
+        if real_path not in [str(path) for path in mg.get_all_paths()]:
+            if exists(real_path):
+
+                # The fingerprint is taken first, and only the bytes it covers are read: rows appended during the scan
+                # are left to the next sync
+                with timing.span("fingerprint"):
+                    file_fingerprint = fingerprint.fingerprint(real_path)
+                # Scan the source in chunks, spreading it over the worker processes, then map and profile the columns
+                columns = mapper_auto.read_columns(real_path)
+                num_rows, sketches = mapper_auto.scan_parallel(real_path, columns, WORKERS, max_distinct, CHUNK_SIZE,
+                                                               file_fingerprint["size"])
+                results = mapper_auto.map_sketches(sketches, columns, lshensemble, kg)
+                # Combined signature of the dimensional schema, with columns ordered by level
+                dimensions = mapper_auto.get_dimensional_schema(results)
+                combined, size = None, 0
+                if len(dimensions) > 0:
+                    combined, size = mapper_auto.scan_combined(real_path, [col for _, col in dimensions],
+                                                               join_index.NUM_PERM, CHUNK_SIZE,
+                                                               file_fingerprint["size"])
+                with timing.span("mg_write"):
+                    self._add_source(file_path, real_path, num_rows, columns, results, dimensions, combined, size,
+                                     sketches, file_fingerprint)
+                # Store the updated Metadata Graph
+                with timing.span("joinindex_save"):
+                    joinindex.save()
+                mg.serialize()
+                if not remount:
+                    print("The source has been mounted.")
+                else:
+                    print("The source has been synchronized.")
+            else:
+                print("The specified file does not exist.")
+        else:
+            print("The source is already mounted.")
+
+    def _sync_appended(self, source, info, previous, state):
+        # Read only the rows appended since the last mount or sync, merging them into the stored sketches, profiles
+        # and combined signature. Returns False when the mappings change, since a full mount is needed then.
+        real_path = str(info["location"])
+        file_fingerprint = fingerprint.extend(real_path, previous)
+        columns, sketches, dimensions = state["columns"], state["sketches"], state["dimensions"]
+        combined = None
+        signature = joinindex.get_signature(source)
+        if signature is not None:
+            combined = MinHash(join_index.NUM_PERM, hashfunc=hashing._identity)
+            combined.merge(signature[1])
+        # Only the bytes covered by the new fingerprint are read, as in a mount
+        num_rows, combined = mapper_auto.scan_tail(real_path, previous["size"], columns, sketches,
+                                                   [col for _, col in dimensions], combined, join_index.NUM_PERM,
+                                                   CHUNK_SIZE, file_fingerprint["size"])
+        results = mapper_auto.map_sketches(sketches, columns, lshensemble, kg)
+        if mapper_auto.get_dimensional_schema(results) != dimensions:
+            return False
+        name = str(source)[len(ns_project):]
+        mg.set_items(source, int(info["items"]) + num_rows)
+        for col, level, pyramid, other in results:
+            if level is not None:
+                # Profiles are recomputed from the merged value counts
+                mg.add_profile_pyramid(name, col, pyramid, other)
+        if combined is not None:
+            joinindex.add(source, [level for level, _ in dimensions], combined, int(round(combined.count())))
+        mg.set_fingerprint(source, file_fingerprint)
+        mg.sketches.put(source, columns, sketches, dimensions)
+        joinindex.save()
+        mg.serialize()
+        print("%d new rows have been read." % num_rows)
+        return True
+
+    def _mount_many(self, pattern):
+        # Mount all the files matching the pattern, one per worker process, and persist the changes once at the end
+        mounted = [str(path) for path in mg.get_all_paths()]
+        paths = []
+        for path in sorted(glob.glob(DATASET_FOLDER + pattern)):
+            if path in mounted:
+                print("\t- %s is already mounted." % path[len(DATASET_FOLDER):])
+            else:
+                paths.append(path)
+        if len(paths) == 0:
+            print("No file to mount.")
+            return
+        start_time = time.time()
+        outputs = pool.imap(mapper_auto.mount_file, paths, WORKERS,
+                            {"max_distinct": max_distinct, "chunk_size": CHUNK_SIZE, "lshensemble": lshensemble,
+                             "kg": kg, "join_num_perm": join_index.NUM_PERM})
+        for count, (_, output) in enumerate(outputs, 1):
+            file_path = output["path"][len(DATASET_FOLDER):]
+            with timing.span("mg_write"):
+                self._add_source(file_path, output["path"], output["num_rows"], output["columns"], output["results"],
+                                 output["dimensions"], output["combined"], output["size"], output["sketches"],
+                                 output["fingerprint"])
+            print("\t[%d/%d] %s: %d rows, %d mapped domains, %.2f s" % (
+                count, len(paths), file_path, output["num_rows"], len(output["dimensions"]), output["time"]))
+        with timing.span("joinindex_save"):
+            joinindex.save()
+        mg.serialize()
+        print("%d source(s) have been mounted in %.2f s." % (len(paths), time.time() - start_time))
+
+    def _unmount_sources(self, sources):
+        # All the sources are removed in a single transaction, persisted with one write
+        with timing.span("unmount"):
+            removed = mg.remove_sources(sources)
+        if removed:
+            for s in sources:
+                joinindex.remove(s)
+                print("\t- Source %s unmounted..." % s)
+            mg.serialize()
+            joinindex.save()
+            print("%d source(s) have been unmounted." % len(sources))
+        else:
+            print("Some error occurred while unmounting the sources.")
+
+    def _show_stats(self):
+        if not timing.is_enabled():
+            print("Timings are not being collected: use 'stats on' or start the console with --stats.")
+        spans = timing.get_stats()
+        if len(spans) > 0:
+            print("%-40s %8s %12s %10s %10s %10s" % ("operation", "count", "total", "p50", "p95", "max"))
+            for name, s in spans.items():
+                print("%-40s %8d %12.1f %10.2f %10.2f %10.2f" % (name, s["count"], s["total"] * 1000, s["p50"] * 1000,
+                                                              s["p95"] * 1000, s["max"] * 1000))
+        query_stats = dlGraph.get_query_stats()
+        if len(query_stats) > 0:
+            print("\n%-40s %8s %12s" % ("query", "count", "total"))
+            for name, s in query_stats.items():
+                label = name if len(name) <= 40 else name[:37] + "..."
+                print("%-40s %8d %12.1f" % (label, s["count"], s["time"] * 1000))
+
     def _show_profile(self, d, profile):
         print("Domain: " + str(d))
         for k, v in profile.items():
@@ -211,10 +467,16 @@ class MyPrompt(Cmd):
 
 
 def main():
+    global kg, mg, dlGraph, joinindex, lshensemble, max_distinct, WORKERS
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=WORKERS, help="number of worker processes")
+    parser.add_argument("--stats", action="store_true", help="collect the timings of each operation from the boot")
+    args = parser.parse_args()
+    WORKERS = args.workers
+    timing.enable(args.stats)
     print("############################################")
     print("Semantic Data Lake management console v. 0.1")
     print("############################################")
-    global kg, mg, dlGraph
     print("\nBooting...")
     print("Importing the Knowledge Graph...")
     kg_file = GRAPH_FOLDER + GRAPH
@@ -223,6 +485,11 @@ def main():
     dlGraph = DL_Graph(kg=kg_file, mg=mg_file)
     mg = dlGraph.mg
     kg = dlGraph.kg
+    joinindex = JoinIndex(METAGRAPH_FOLDER + JOIN_INDEX)
+    # Initialize LSHEnsemble once, reusing the cached index when the KG has not changed
+    with timing.span("lsh_load"):
+        lshensemble, signatures = mapper_auto.load_lsh(kg, CACHE_FOLDER)
+    max_distinct = mapper_auto.get_max_distinct(signatures)
     # Run the prompt
     MyPrompt().cmdloop()
 
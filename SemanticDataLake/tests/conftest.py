@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Modules are imported as in the scripts, which are run from the SemanticDataLake folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,52 @@
+import argparse
+import filecmp
+import json
+from models.KG import KG
+import benchmarks.benchmark as benchmark
+
+
+def test_fixtures_are_deterministic(tmp_path):
+    files = []
+    for folder in ("a", "b"):
+        kg_file = benchmark.get_kg_fixture(2, 2, 3, str(tmp_path / folder))
+        ds_file = benchmark.get_ds_fixture(KG(kg_file), 200, 5, 10, 7, str(tmp_path / folder))
+        files.append((kg_file, ds_file))
+    for first, second in zip(*files):
+        assert filecmp.cmp(first, second, shallow=False)
+
+
+def test_measure_runs():
+    calls = []
+    result = benchmark.measure(lambda: calls.append(1), repeat=3, warmup=2)
+    assert len(calls) == 5 and len(result["runs"]) == 3
+    assert result["min"] <= result["median"] <= max(result["runs"])
+
+
+def results(**medians):
+    return {"environment": {}, "benchmarks": {name: {"median": m} for name, m in medians.items()}}
+
+
+def test_compare_counts_regressions():
+    baseline = results(a=1.0, b=1.0, c=0.0001, d=1.0)
+    current = results(a=1.05, b=1.5, c=0.0005, e=1.0)
+    # a is within the tolerance, c is slower by less than MIN_DIFFERENCE, d is missing and e is new
+    assert benchmark.compare(baseline, current, tolerance=0.1) == 1
+    assert benchmark.compare(baseline, current, tolerance=0.6) == 0
+    assert benchmark.compare(current, baseline, tolerance=0.1) == 0
+
+
+def test_run_writes_comparable_results(tmp_path, monkeypatch):
+    # Fixtures are kept in ../cache, relative to the working directory
+    (tmp_path / "run").mkdir()
+    monkeypatch.chdir(tmp_path / "run")
+    out = str(tmp_path / "results.json")
+    args = argparse.Namespace(dimensions=2, levels=2, population=3, rows=[200], cols=[5], noise=[0], seed=1,
+                              repeat=2, warmup=0, candidates=10, only=["lsh_query", "profiling"], out=out,
+                              compare=None, tolerance=0.1)
+    assert benchmark.run(args) == 0
+    with open(out) as f:
+        output = json.load(f)
+    assert output["version"] == benchmark.RESULTS_VERSION
+    assert set(name.split("[")[0] for name in output["benchmarks"]) <= {"lsh_query", "profiling"}
+    assert all(len(result["runs"]) == 2 for result in output["benchmarks"].values())
+    assert benchmark.compare(output, output) == 0
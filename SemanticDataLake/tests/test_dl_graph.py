@@ -0,0 +1,43 @@
+import numpy as np
+from rdflib import URIRef
+import generators.KG_generator as KG_generator
+from models.DL_Graph import DL_Graph
+from models.MG import MG, ns_project
+
+
+def dl_graph(tmp_path):
+    kg_file = str(tmp_path / "kg.ttl")
+    KG_generator.streamKG(kg_file, 2, 3, 2, 1)
+    mg_file = str(tmp_path / "metadata.ttl")
+    open(mg_file, 'w').close()
+    return DL_Graph(mg_file, kg_file)
+
+
+def test_union_view_follows_the_mg(tmp_path):
+    dl = dl_graph(tmp_path)
+    dl.mg.add_source("ds0", 10, ["a", "b"], "../datasets/ds0.csv")
+    dl.mg.map("ds0", "a", "L1_D0")
+    text = "SELECT ?d ?dim WHERE {?d dl:mapTo ?l. ?l kpi:inDimension ?dim}"
+    assert [tuple(r) for r in dl.query(text)] == [(MG._domain_uri("ds0", "a"), URIRef(ns_project + "D0"))]
+    view = dl.graph
+    # No triple is copied: changes to the MG are visible through the same view
+    dl.mg.map("ds0", "b", "L2_D1")
+    assert dl.graph is view
+    assert sorted(str(r[1]) for r in dl.query(text)) == [ns_project + "D0", ns_project + "D1"]
+    assert len(view) == len(dl.kg.graph) + len(dl.mg.graph)
+
+
+def test_similar_domains_are_ranked(tmp_path):
+    dl = dl_graph(tmp_path)
+    level = "L2_D0"
+    num_members = len(dl.kg.get_members_from_level(level))
+    profiles = {"a": [5, 5, 0, 0], "b": [5, 4, 0, 0], "c": [0, 0, 3, 3], "d": [1, 1, 1, 1]}
+    for col, frequencies in profiles.items():
+        dl.mg.add_source("ds_" + col, 10, [col], "../datasets/%s.csv" % col)
+        dl.mg.map("ds_" + col, col, level)
+        ids = np.flatnonzero(frequencies)
+        dl.mg.add_profile_pyramid("ds_" + col, col, {str(ns_project + level): (ids, np.array(frequencies)[ids])}, 0)
+    assert num_members >= 4
+    ranking = dl.get_similar_domains(MG._domain_uri("ds_a", "a"))
+    assert [d for d, _ in ranking] == [MG._domain_uri("ds_" + c, c) for c in ("b", "d", "c")]
+    assert ranking[-1][1] == 0.0
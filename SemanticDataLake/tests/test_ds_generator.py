@@ -0,0 +1,71 @@
+import filecmp
+import numpy as np
+import pandas as pd
+import pytest
+import executors.pool as pool
+import generators.DS_generator as DS_generator
+import generators.KG_generator as KG_generator
+from models.KG import KG
+
+
+@pytest.fixture(scope="module")
+def kg(tmp_path_factory):
+    kg_file = str(tmp_path_factory.mktemp("kg") / "kg.ttl")
+    KG_generator.streamKG(kg_file, 3, 2, 10, 2)
+    return KG(kg_file)
+
+
+def plan(kg, rows, noise, seed=0, zipf=None):
+    return DS_generator.plan_ds(rows, 10, 0.3, noise, kg, np.random.default_rng(seed), zipf)
+
+
+def generate(plan, chunk_size, seed=1):
+    return pd.concat(DS_generator.generate_chunks(plan, np.random.default_rng(seed), chunk_size))
+
+
+@pytest.mark.parametrize("chunk_size", [7, 100, 1000])
+def test_noise_is_exact(kg, chunk_size):
+    ds_plan = plan(kg, 1000, 0.25)
+    df = generate(ds_plan, chunk_size)
+    assert len(df) == 1000 and list(df.index) == list(range(1000))
+    assert list(df.columns) == ds_plan["columns"]
+    for level in ds_plan["dimensions"]:
+        assert (df[level] == DS_generator.NOISE_VALUE).sum() == 250
+        assert set(df[level].astype(str)) <= set(ds_plan["dimensions"][level]["members"]) | {DS_generator.NOISE_VALUE}
+
+
+def test_zipf_skews_the_members(kg):
+    ds_plan = plan(kg, 5000, 0, zipf=2.0)
+    df = generate(ds_plan, 1000)
+    for level, dimension in ds_plan["dimensions"].items():
+        counts = df[level].value_counts().sort_values(ascending=False)
+        # With exponent 2, the most frequent member is drawn with probability 1 / zeta(2) at least
+        assert counts.iloc[0] / len(df) > 0.5
+        assert counts.iloc[0] > 2 * counts.iloc[1]
+
+
+def test_parquet_keeps_dictionary_columns(kg, tmp_path):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    ds_plan = plan(kg, 100, 0.1)
+    filename = str(tmp_path / "ds.parquet")
+    DS_generator.write_ds(filename, ds_plan, np.random.default_rng(1), 30, "parquet")
+    table = pq.read_table(filename)
+    assert table.column_names == ds_plan["columns"]
+    for level in ds_plan["dimensions"]:
+        assert pa.types.is_dictionary(table.schema.field(level).type)
+    expected = generate(ds_plan, 30).reset_index(drop=True)
+    pd.testing.assert_frame_equal(table.to_pandas(), expected, check_categorical=False)
+
+
+def test_configurations_do_not_depend_on_workers(kg, tmp_path):
+    tasks = dict()
+    for workers in (1, 2):
+        (tmp_path / str(workers)).mkdir()
+        tasks[workers] = [(str(tmp_path / str(workers) / ("ds_n" + str(noise) + ".csv")), plan(kg, 200, noise / 100.0),
+                           np.random.SeedSequence([42, noise]), 64, "csv") for noise in (0, 10, 50)]
+        results = [filename for _, (filename, _) in pool.imap(DS_generator.write_configuration, tasks[workers],
+                                                               workers)]
+        assert sorted(results) == sorted(task[0] for task in tasks[workers])
+    for serial, parallel in zip(tasks[1], tasks[2]):
+        assert filecmp.cmp(serial[0], parallel[0], shallow=False)
@@ -0,0 +1,116 @@
+import os
+import stat
+import tempfile
+import pytest
+import utils.files as files
+
+
+@pytest.fixture
+def umask(monkeypatch):
+    # The umask is read once, at import
+    monkeypatch.setattr(files, "UMASK", 0o022)
+    previous = os.umask(0o022)
+    yield 0o022
+    os.umask(previous)
+
+
+def mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+def test_replace_uses_the_default_mode(tmp_path, umask):
+    fd, tmp_file = tempfile.mkstemp(dir=str(tmp_path))
+    os.close(fd)
+    destination = str(tmp_path / "out.bin")
+    files.replace(tmp_file, destination)
+    assert mode(destination) == 0o644
+    folder = tempfile.mkdtemp(dir=str(tmp_path))
+    files.set_default_mode(folder)
+    assert mode(folder) == 0o755
+
+
+def test_umask_is_read_at_import(tmp_path, umask, monkeypatch):
+    monkeypatch.setattr(files, "UMASK", 0o027)
+    fd, tmp_file = tempfile.mkstemp(dir=str(tmp_path))
+    os.close(fd)
+    files.set_default_mode(tmp_file)
+    assert mode(tmp_file) == 0o640
+
+
+def test_lsh_cache_is_readable_by_others(tmp_path, umask):
+    import executors.mapper_auto as mapper_auto
+    import generators.KG_generator as KG_generator
+    from models.KG import KG
+    kg_file = str(tmp_path / "kg.ttl")
+    KG_generator.streamKG(kg_file, 2, 2, 2, 1)
+    cache_folder = str(tmp_path / "cache")
+    mapper_auto.load_lsh(KG(kg_file), cache_folder)
+    assert [mode(os.path.join(cache_folder, name)) for name in os.listdir(cache_folder)] == [0o644]
+
+
+def test_metadata_graph_files_are_readable_by_others(tmp_path, umask):
+    from models.MG import MG
+    graph_name = str(tmp_path / "metadata.ttl")
+    open(graph_name, 'w').close()
+    mg = MG(graph_name)
+    mg.add_source("ds0", 10, ["a"], "ds0.csv")
+    mg.serialize()
+    assert mode(mg.journal_name) == 0o644
+    mg.compact()
+    assert mode(graph_name) == 0o644
+    assert mode(mg.journal_name) == 0o644
+
+
+def test_join_index_is_readable_by_others(tmp_path, umask):
+    from models.JoinIndex import JoinIndex
+    index = JoinIndex(str(tmp_path / "joinability.pkl"))
+    index.save()
+    assert mode(index.index_name) == 0o644
+
+
+def test_profile_store_is_readable_by_others(tmp_path, umask):
+    import numpy as np
+    from models.ProfileStore import ProfileStore
+    folder = str(tmp_path / "profiles")
+    store = ProfileStore(folder)
+    store.put("http://x/d", {"http://x/L1": (np.array([0, 2]), np.array([5, 1]))}, 3)
+    store.commit()
+    assert set(mode(os.path.join(folder, name)) for name in os.listdir(folder)) == {0o644}
+
+
+def test_sketch_store_is_readable_by_others(tmp_path, umask):
+    from models.SketchStore import SketchStore
+    folder = str(tmp_path / "sketches")
+    store = SketchStore(folder)
+    store.put("http://x/s", ["a"], {"a": None}, [])
+    store.commit()
+    assert set(mode(os.path.join(folder, name)) for name in os.listdir(folder)) == {0o644}
+
+
+def test_kg_snapshot_is_readable_by_others(tmp_path, umask):
+    import generators.KG_generator as KG_generator
+    from models.KG import KG
+    kg_file = str(tmp_path / "kg.ttl")
+    KG_generator.streamKG(kg_file, 2, 2, 2, 1)
+    assert mode(kg_file) == 0o644
+    kg = KG(kg_file, snapshot=True)
+    assert mode(kg.snapshot_name) == 0o755
+    # The modification time changes, so that the metadata of the snapshot is rewritten
+    os.utime(kg_file, ns=(0, 0))
+    KG(kg_file, snapshot=True)
+    assert set(mode(os.path.join(kg.snapshot_name, name)) for name in os.listdir(kg.snapshot_name)) == {0o644}
+
+
+def test_datasets_are_readable_by_others(tmp_path, umask):
+    import numpy as np
+    import generators.DS_generator as DS_generator
+    import generators.KG_generator as KG_generator
+    from models.KG import KG
+    kg_file = str(tmp_path / "kg.ttl")
+    KG_generator.streamKG(kg_file, 2, 2, 2, 1)
+    rng = np.random.default_rng(0)
+    plan = DS_generator.plan_ds(10, 5, 0.4, 0.1, KG(kg_file), rng)
+    for format in ("csv", "parquet"):
+        filename = str(tmp_path / ("ds." + format))
+        DS_generator.write_ds(filename, plan, np.random.default_rng(1), 4, format)
+        assert mode(filename) == 0o644
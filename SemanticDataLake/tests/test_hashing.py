@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+from datasketch import MinHash
+import executors.hashing as hashing
+
+
+def minhash(values, num_perm=256):
+    m = MinHash(num_perm)
+    m.update_batch([v.encode('utf8') for v in values])
+    return m
+
+
+def test_containment_within_bounds():
+    s1 = ["v%d" % i for i in range(2000)]
+    m1 = minhash(s1)
+    for overlap in (0, 100, 500, 1000):
+        # S2 has 1000 distinct values, overlap of which are in S1
+        s2 = s1[:overlap] + ["w%d" % i for i in range(1000 - overlap)]
+        ji, lower, upper = hashing.estimate_containment(m1, len(s1), minhash(s2), len(s2))
+        assert 0.0 <= lower <= ji <= upper <= 1.0
+        assert lower <= overlap / len(s2) <= upper
+    assert hashing.estimate_containment(m1, len(s1), minhash([]), 0) == (0.0, 0.0, 0.0)
+
+
+def test_batch_ji_matches_estimate_containment():
+    query = ["v%d" % i for i in range(300)]
+    candidates = [["v%d" % i for i in range(start, start + size)] for start, size in ((0, 1000), (150, 300), (1000, 50))]
+    m = minhash(query)
+    ji, lower, upper = hashing.batch_ji(m, len(query), [minhash(c) for c in candidates], [len(c) for c in candidates])
+    for i, c in enumerate(candidates):
+        # The joinability index of the query against a candidate is the containment of the query in the candidate
+        expected = hashing.estimate_containment(minhash(c), len(c), m, len(query))
+        assert np.allclose((ji[i], lower[i], upper[i]), expected)
+        assert lower[i] <= len(set(query) & set(c)) / len(query) <= upper[i]
+    empty = hashing.batch_ji(m, 0, [minhash(c) for c in candidates], [len(c) for c in candidates])
+    assert all(np.array_equal(a, np.zeros(3)) for a in empty)
+
+
+def schema_frame(rows, offset=0):
+    return pd.DataFrame({"a": ["m%d" % ((i + offset) % 13) for i in range(rows)],
+                         "b": ["n%d" % ((i + offset) % 17) for i in range(rows)]})
+
+
+def test_row_hashes_do_not_depend_on_dtype_or_chunks():
+    df = schema_frame(1000)
+    hashes = hashing.row_hashes(df, ["a", "b"])
+    # Categorical columns hash as their values
+    assert np.array_equal(hashes, hashing.row_hashes(df.astype("category"), ["a", "b"]))
+    # Equal rows have equal hashes, and the order of the columns counts
+    assert len(np.unique(hashes)) == 13 * 17
+    assert not np.array_equal(hashes, hashing.row_hashes(df, ["b", "a"]))
+    m, distinct = hashing.combined_minhash(df, ["a", "b"], 128)
+    assert distinct == 13 * 17
+    chunked = None
+    for start in range(0, 1000, 300):
+        chunked, _ = hashing.minhash_from_hashes(hashing.row_hashes(df.iloc[start:start + 300], ["a", "b"]), 128,
+                                                 chunked)
+    assert np.array_equal(chunked.hashvalues, m.hashvalues)
+
+
+def test_combined_minhash_estimates_containment():
+    s1, size1 = hashing.combined_minhash(schema_frame(5000), ["a", "b"], 256)
+    # The same rows, shifted: a subset of the rows of S1
+    s2, size2 = hashing.combined_minhash(schema_frame(100, offset=7), ["a", "b"], 256)
+    ji, lower, upper = hashing.estimate_containment(s1, size1, s2, size2)
+    assert lower <= 1.0 <= upper and ji > 0.8
+    other, size3 = hashing.combined_minhash(schema_frame(100).rename(columns={"a": "b", "b": "a"}), ["a", "b"], 256)
+    assert hashing.estimate_containment(s1, size1, other, size3)[0] < 0.2
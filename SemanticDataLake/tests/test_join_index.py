@@ -0,0 +1,123 @@
+import numpy as np
+import pandas as pd
+import executors.hashing as hashing
+import models.JoinIndex as join_index
+from models.JoinIndex import JoinIndex
+
+SCHEMA = ("L1_D0", "L2_D1")
+
+
+def signature(start, stop):
+    df = pd.DataFrame({"a": ["m%d" % (i % 97) for i in range(start, stop)],
+                       "b": ["n%d" % (i // 97) for i in range(start, stop)]})
+    return hashing.combined_minhash(df, ["a", "b"], join_index.NUM_PERM)
+
+
+def fill(index, count):
+    for i in range(count):
+        m, size = signature(0, 1000 + 100 * i)
+        index.add("s%d" % i, SCHEMA, m, size)
+
+
+def rebuilt(index):
+    # The same signatures, with the ensembles built from scratch
+    fresh = JoinIndex(index.index_name + ".fresh")
+    for source, (schema, m, size) in index.signatures.items():
+        fresh.add(source, schema, m, size)
+    return fresh
+
+
+def test_incremental_updates_match_a_rebuild(tmp_path):
+    index = JoinIndex(str(tmp_path / "joinability.pkl"))
+    fill(index, 20)
+    index.query("s0")
+    # Changes after the ensemble was built are checked one by one
+    m, size = signature(0, 900)
+    index.add("new", SCHEMA, m, size)
+    index.remove("s3")
+    m, size = signature(5000, 6000)
+    index.add("s5", SCHEMA, m, size)
+    index.add("other", ("L1_D0",), m, size)
+    entry = index._ensembles[SCHEMA]
+    assert entry["added"] == {"new", "s5"} and entry["removed"] == {"s3", "s5"}
+    fresh = rebuilt(index)
+    for source in ["s0", "new", "s5", "s10"]:
+        assert index.query(source) == fresh.query(source)
+    assert "s3" not in [c for c, _, _, _ in index.query("s0")]
+    assert "other" not in [c for c, _, _, _ in index.query("s0")]
+
+
+def test_only_the_changed_group_is_rebuilt(tmp_path):
+    index = JoinIndex(str(tmp_path / "joinability.pkl"))
+    fill(index, 5)
+    m, size = signature(0, 500)
+    index.add("other", ("L1_D0",), m, size)
+    index.query("s0")
+    index.query("other")
+    other = index._ensembles[("L1_D0",)]
+    for i in range(join_index.REBUILD_MIN + 1):
+        m, size = signature(0, 2000 + i)
+        index.add("t%d" % i, SCHEMA, m, size)
+    index.query("s0")
+    assert index._ensembles[SCHEMA]["added"] == set()
+    assert index._ensembles[("L1_D0",)] is other
+
+
+def test_ensembles_are_stored(tmp_path):
+    index = JoinIndex(str(tmp_path / "joinability.pkl"))
+    fill(index, 10)
+    expected = index.query("s0")
+    index.save()
+    loaded = JoinIndex(index.index_name)
+    assert SCHEMA in loaded._ensembles
+    assert loaded.query("s0") == expected
+    assert np.array_equal(loaded.get_signature("s1")[1].hashvalues, index.get_signature("s1")[1].hashvalues)
+
+
+def test_built_ensembles_are_flagged(tmp_path):
+    index = JoinIndex(str(tmp_path / "joinability.pkl"))
+    fill(index, 3)
+    index.query("s0")
+    assert index.modified
+    index.save()
+    index.query("s1")
+    assert not index.modified
+
+
+def brute_force(index, source, threshold):
+    # Every source of the group, with its estimate
+    schema, m, size = index.get_signature(source)
+    others = sorted(s for s, (other, _, _) in index.signatures.items() if other == schema and s != source)
+    ji, _, _ = hashing.batch_ji(m, size, [index.get_signature(s)[1] for s in others],
+                                [index.get_signature(s)[2] for s in others])
+    return {s for s, j in zip(others, ji) if j >= threshold}
+
+
+def test_results_are_above_any_threshold(tmp_path):
+    index = JoinIndex(str(tmp_path / "joinability.pkl"))
+    fill(index, 20)
+    index.query("s10")
+    # Added after the ensemble was built
+    m, size = signature(0, 2500)
+    index.add("new", SCHEMA, m, size)
+    for threshold in (0.1, 0.3, join_index.THRESHOLD, 0.65, 0.9):
+        for source in ("s0", "s10", "new"):
+            ranking = index.query(source, threshold)
+            assert all(ji >= threshold for _, ji, _, _ in ranking)
+            if threshold < join_index.THRESHOLD:
+                assert {c for c, _, _, _ in ranking} == brute_force(index, source, threshold)
+            else:
+                assert {c for c, _, _, _ in ranking} <= brute_force(index, source, threshold)
+    # A single ensemble per group, whatever the thresholds of the queries
+    assert list(index._ensembles) == [SCHEMA] and index._ensembles[SCHEMA]["added"] == {"new"}
+
+
+def test_previous_index_versions_are_rebuilt(tmp_path):
+    import pickle
+    index = JoinIndex(str(tmp_path / "joinability.pkl"))
+    fill(index, 5)
+    expected = index.query("s0")
+    with open(index.index_name, 'wb') as f:
+        pickle.dump({"version": 2, "signatures": index.signatures, "ensembles": {SCHEMA: {0.5: None}}}, f)
+    loaded = JoinIndex(index.index_name)
+    assert loaded._ensembles == dict() and loaded.query("s0") == expected
@@ -0,0 +1,64 @@
+from rdflib import URIRef
+import generators.KG_generator as KG_generator
+from models.KG import KG, ns_project, ns_kpionto
+
+
+def kg_file(tmp_path):
+    path = str(tmp_path / "kg.ttl")
+    KG_generator.streamKG(path, 2, 3, 2, 1)
+    return path
+
+
+def test_lean_indexes_match_the_graph(tmp_path):
+    path = kg_file(tmp_path)
+    kg, lean = KG(path), KG(path, lean=True)
+    assert lean.graph is None
+    assert lean.get_dimensions() == kg.get_dimensions() == ["D0", "D1"]
+    for dim in kg.get_dimensions():
+        assert lean.get_levels(dim) == kg.get_levels(dim)
+    for level in kg.get_levels():
+        uri = URIRef(ns_project + level)
+        # The same answers as the triples of the parsed graph
+        members = set(kg.graph.subjects(ns_kpionto.inLevel, uri))
+        assert len(members) > 0
+        assert set(lean.get_members_from_level(level, fragmentLevel=True)) == members
+        assert set(kg.get_members_from_level(level, fragmentLevel=True)) == members
+        assert lean.get_upper_level(uri) == list(kg.graph.objects(uri, ns_kpionto.rollup))
+    member = URIRef(ns_project + "3_L2_D1")
+    assert lean.get_level_for_member(member) == [URIRef(ns_project + "L2_D1")]
+    assert lean.get_upper_members(member) == [URIRef(ns_project + "1_L1_D1")]
+
+
+def test_to_uri_resolves_fragments(tmp_path):
+    kg = KG(kg_file(tmp_path), lean=True)
+    level = URIRef(ns_project + "L1_D0")
+    # Flagged fragments, unflagged fragments and full URIs of the same level
+    assert kg._to_uri("L1_D0", True, kg._levels) == level
+    assert kg._to_uri("L1_D0", False, kg._levels) == level
+    assert kg._to_uri(str(level), False, kg._levels) == level
+    assert kg._to_uri(level, False, kg._levels) == level
+    # A name with a slash that is not indexed is taken as a URI
+    assert kg._to_uri("http://other/L1_D0", False, kg._levels) == URIRef("http://other/L1_D0")
+    assert kg.get_members_from_level("L1_D0") == kg.get_members_from_level(level)
+    assert kg.get_members_from_level(level, fragmentOutput=True) == ["0_L1_D0", "1_L1_D0", "2_L1_D0", "3_L1_D0"]
+
+
+def test_rollup_closure_and_tables(tmp_path):
+    import numpy as np
+    kg = KG(kg_file(tmp_path))
+    bottom, middle, top = (URIRef(ns_project + "L%d_D1" % i) for i in (2, 1, 0))
+    assert kg.get_level_closure(bottom) == [bottom, middle, top]
+    assert kg.get_ancestor_level(bottom, 2) == top and kg.get_ancestor_level(bottom, 3) is None
+    members = kg.get_members_from_level(bottom)
+    top_members = kg.get_members_from_level(top)
+    # The ancestor table gives the position of the ancestor of each member, as found walking up member by member
+    table = kg.get_ancestor_table(bottom, top)
+    for i, member in enumerate(members):
+        parent = kg.get_upper_members(kg.get_upper_members(member)[0])[0]
+        assert top_members[table[i]] == parent
+    frequencies = np.arange(1, len(members) + 1)
+    expected = np.zeros(len(top_members), dtype=np.int64)
+    for i, f in enumerate(frequencies):
+        expected[table[i]] += f
+    assert np.array_equal(kg.rollup_profile(bottom, np.arange(len(members)), frequencies, top), expected)
+    assert kg.rollup_profile(bottom, np.arange(len(members)), frequencies, bottom).sum() == frequencies.sum()
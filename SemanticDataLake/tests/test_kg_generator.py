@@ -0,0 +1,27 @@
+import filecmp
+from rdflib import Graph
+import generators.KG_generator as KG_generator
+
+
+def generate(dimensions, levels, population, growth):
+    KG_generator.graph = Graph()
+    try:
+        KG_generator.generateKG(dimensions, levels, population, growth)
+        return KG_generator.graph
+    finally:
+        KG_generator.graph = None
+
+
+def test_stream_matches_generate(tmp_path):
+    expected = set(generate(3, 3, 2, 2))
+    for name, format in (("kg.ttl", "turtle"), ("kg.nt", "nt")):
+        destination = str(tmp_path / name)
+        KG_generator.streamKG(destination, 3, 3, 2, 2)
+        assert set(Graph().parse(destination, format=format)) == expected
+
+
+def test_stream_does_not_depend_on_workers(tmp_path):
+    serial, parallel = str(tmp_path / "serial.nt"), str(tmp_path / "parallel.nt")
+    KG_generator.streamKG(serial, 3, 3, 2, 1)
+    KG_generator.streamKG(parallel, 3, 3, 2, 1, workers=2)
+    assert filecmp.cmp(serial, parallel, shallow=False)
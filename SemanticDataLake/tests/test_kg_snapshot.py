@@ -0,0 +1,72 @@
+import os
+import numpy as np
+import pytest
+from rdflib import URIRef
+import generators.KG_generator as KG_generator
+import executors.mapper_auto as mapper_auto
+from models.KG import KG
+
+
+@pytest.fixture
+def kg_file(tmp_path):
+    path = str(tmp_path / "kg.ttl")
+    KG_generator.streamKG(path, 3, 3, 2, 2)
+    return path
+
+
+def assert_same_indexes(kg, expected):
+    assert kg.get_dimensions() == expected.get_dimensions()
+    assert kg.get_levels() == expected.get_levels()
+    for dim in expected.get_dimensions():
+        assert kg.get_levels(dim) == expected.get_levels(dim)
+    for lev in expected.get_levels():
+        members = expected.get_members_from_level(lev, fragmentLevel=True)
+        assert kg.get_members_from_level(lev, fragmentLevel=True) == members
+        assert kg.get_members_from_level(lev, fragmentLevel=True, fragmentOutput=True) == \
+            expected.get_members_from_level(lev, fragmentLevel=True, fragmentOutput=True)
+        assert list(kg.get_member_index(lev, fragmentLevel=True)) == \
+            list(expected.get_member_index(lev, fragmentLevel=True))
+        uri = URIRef(KG_generator.ns_project + lev)
+        assert kg.get_upper_level(uri) == expected.get_upper_level(uri)
+        assert kg.get_level_closure(uri) == expected.get_level_closure(uri)
+        for ancestor in expected.get_level_closure(uri):
+            assert np.array_equal(kg.get_ancestor_table(uri, ancestor), expected.get_ancestor_table(uri, ancestor))
+        for m in members:
+            assert kg.get_level_for_member(m) == expected.get_level_for_member(m)
+            assert kg.get_upper_members(m) == expected.get_upper_members(m)
+
+
+def test_snapshot_round_trip(kg_file):
+    parsed = KG(kg_file)
+    written = KG(kg_file, snapshot=True)
+    assert os.path.exists(os.path.join(written.snapshot_name, "meta.json"))
+    loaded = KG(kg_file, snapshot=True)
+    assert loaded._snapshot is not None
+    assert_same_indexes(written, parsed)
+    assert_same_indexes(loaded, parsed)
+    assert set(loaded.graph) == set(parsed.graph)
+
+
+def test_snapshot_is_rebuilt_when_the_file_changes(kg_file):
+    KG(kg_file, snapshot=True)
+    KG_generator.streamKG(kg_file, 2, 2, 3, 1)
+    loaded = KG(kg_file, snapshot=True)
+    assert loaded._snapshot is None
+    assert_same_indexes(KG(kg_file, snapshot=True), KG(kg_file))
+
+
+def test_lsh_is_kept_in_the_snapshot(kg_file, tmp_path):
+    cache_folder = str(tmp_path / "cache")
+    kg = KG(kg_file, snapshot=True)
+    lshensemble, signatures = mapper_auto.load_lsh(kg, cache_folder)
+    assert not os.path.exists(cache_folder)
+    stored = [name for name in os.listdir(kg.snapshot_name) if name.startswith("lsh_")]
+    assert len(stored) == 1
+    _, loaded = mapper_auto.load_lsh(KG(kg_file, snapshot=True), cache_folder)
+    assert set(loaded) == set(signatures)
+    for lev, (m, size) in signatures.items():
+        assert np.array_equal(loaded[lev][0].hashvalues, m.hashvalues) and loaded[lev][1] == size
+    # The signatures are discarded together with the snapshot
+    KG_generator.streamKG(kg_file, 2, 2, 3, 1)
+    kg = KG(kg_file, snapshot=True)
+    assert not any(name.startswith("lsh_") for name in os.listdir(kg.snapshot_name))
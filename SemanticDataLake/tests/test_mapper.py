@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+import pytest
+import executors.hashing as hashing
+import executors.mapper as mapper
+import generators.DS_generator as DS_generator
+import generators.KG_generator as KG_generator
+from models.KG import KG
+
+
+@pytest.fixture(scope="module")
+def kg(tmp_path_factory):
+    kg_file = str(tmp_path_factory.mktemp("kg") / "kg.ttl")
+    KG_generator.streamKG(kg_file, 5, 2, 10, 2)
+    return KG(kg_file)
+
+
+def plan(kg, noise=0.2):
+    return DS_generator.plan_ds(500, 10, 0.3, noise, kg, np.random.default_rng(3))
+
+
+def stream(chunks):
+    s = mapper.ColumnStream()
+    for chunk in chunks:
+        s.update(chunk)
+    return s
+
+
+def distinct(s):
+    return sorted(v for batch in s.distinct(batch_size=3) for v in batch)
+
+
+def test_categorical_stream_counts_categories():
+    dtype = pd.CategoricalDtype(["a", "b", "c", "d"])
+    chunks = [pd.Series(["a", "b", "a"], dtype=dtype), pd.Series(["c", "a", None], dtype=dtype)]
+    s = stream(chunks)
+    assert list(s.counts) == [3, 1, 1, 0]
+    assert len(s) == 3 and distinct(s) == ["a", "b", "c"]
+
+
+def test_integer_stream_keeps_a_bitmap():
+    s = stream([pd.Series([3, 0, 3]), pd.Series([7, 1], dtype=np.int32), pd.Series([], dtype=np.int64)])
+    assert s.values is None and len(s) == 4
+    assert distinct(s) == ["0", "1", "3", "7"]
+
+
+def test_stream_falls_back_to_text():
+    # Values seen in the bitmap are kept when a chunk cannot be stored in it
+    s = stream([pd.Series([2, 5]), pd.Series([-1, 5]), pd.Series(["x", "2"])])
+    assert s.seen is None and len(s) == 4
+    assert distinct(s) == ["-1", "2", "5", "x"]
+
+
+def test_stream_matches_the_whole_column(kg):
+    ds_plan = plan(kg)
+    chunks = list(DS_generator.generate_chunks(ds_plan, np.random.default_rng(4), 64))
+    df = pd.concat(chunks)
+    for col in df.columns:
+        s = stream(chunk[col] for chunk in chunks)
+        assert distinct(s) == sorted(set(df[col].astype(str)))
+        assert len(s) == df[col].nunique()
+    for level in ds_plan["dimensions"]:
+        members = kg.get_members_from_level(level)
+        member_index = kg.get_member_index(level)
+        s = stream(chunk[level] for chunk in chunks)
+        expected = mapper.calculate_profile(df[level].astype(str), level, members, member_index)
+        assert mapper.calculate_profile_from_stream(s, members, member_index) == expected
+
+
+def test_combined_minhash_is_merged_chunk_by_chunk(kg):
+    ds_plan = plan(kg)
+    chunks = list(DS_generator.generate_chunks(ds_plan, np.random.default_rng(4), 64))
+    dimensions = [col for col in ds_plan["columns"] if col in ds_plan["dimensions"]]
+    combined = None
+    for chunk in chunks:
+        combined, _ = hashing.minhash_from_hashes(hashing.row_hashes(chunk, dimensions), mapper.NUM_PERM, combined)
+    expected, _ = hashing.combined_minhash(pd.concat(chunks), dimensions, mapper.NUM_PERM)
+    assert np.array_equal(combined.hashvalues, expected.hashvalues)
+
+
+def log_fields(directory):
+    # Name, rows, columns, dimensions, noise and effectiveness: the fields that do not depend on timings
+    with open(directory + "test.log") as f:
+        return [line.strip().split(";")[:5] + line.strip().split(";")[-1:] for line in f]
+
+
+def test_map_stream_matches_map_source(kg, tmp_path):
+    lshensemble = mapper.initialize_lsh(kg)
+    ds_plan = plan(kg)
+    (tmp_path / "stream").mkdir()
+    (tmp_path / "source").mkdir()
+    stream_folder, source_folder = str(tmp_path / "stream") + "/", str(tmp_path / "source") + "/"
+    chunks = DS_generator.generate_chunks(ds_plan, np.random.default_rng(4), 64)
+    mapper.map_stream(chunks, 500, 10, 20, "ds", stream_folder, lshensemble, kg)
+    df = pd.concat(DS_generator.generate_chunks(ds_plan, np.random.default_rng(4), 64))
+    mapper.map_source(df, 500, 10, 20, "ds", source_folder, lshensemble, kg)
+    # Read back from text, as a CSV source would be
+    mapper.map_source(df.astype(str), 500, 10, 20, "ds", source_folder, lshensemble, kg)
+    expected = log_fields(source_folder)
+    assert expected[0] == expected[1] and expected[0][3] == "3" and expected[0][5] != "0"
+    assert log_fields(stream_folder) == expected[:1]
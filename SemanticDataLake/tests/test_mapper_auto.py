@@ -0,0 +1,123 @@
+import numpy as np
+import pandas as pd
+from datasketch import MinHash
+import executors.mapper_auto as mapper_auto
+
+
+def frame(rows):
+    return pd.DataFrame({"L1": ["m%d" % (i % 7) for i in range(rows)], "attr0": [str(i % 50) for i in range(rows)],
+                         "note": ["" if i % 5 == 0 else "n,%d" % i for i in range(rows)]})
+
+
+def test_chunked_scan_matches_whole_read(tmp_path):
+    path = str(tmp_path / "ds.csv")
+    frame(1000).to_csv(path, index=False)
+    whole = pd.read_csv(path, dtype=str, keep_default_na=False)
+    for chunk_size in (3, 97, 1000, 5000):
+        num_rows, columns, sketches = mapper_auto.scan_source(path, chunk_size=chunk_size)
+        assert num_rows == 1000 and columns == ["L1", "attr0", "note"]
+        for col in columns:
+            # The counts and the MinHash of the distinct values, as if the whole column was read at once
+            assert sketches[col].counts == whole[col].value_counts().to_dict()
+            m = MinHash(mapper_auto.NUM_PERM)
+            m.update_batch([v.encode('utf8') for v in set(whole[col])])
+            assert np.array_equal(sketches[col].minhash.hashvalues, m.hashvalues)
+
+
+def test_counts_are_dropped_above_max_distinct(tmp_path):
+    path = str(tmp_path / "ds.csv")
+    frame(1000).to_csv(path, index=False)
+    _, _, sketches = mapper_auto.scan_source(path, max_distinct=10, chunk_size=100)
+    assert sketches["L1"].counts is not None and sketches["L1"].size() == 7
+    assert sketches["attr0"].counts is None
+    # The size is estimated from the signature
+    assert abs(sketches["attr0"].size() - 50) <= 10
+    assert mapper_auto.map_sketch(sketches["attr0"], None) == []
+
+
+def lake(tmp_path, count):
+    # A KG and some generated datasets, whose dimension columns hold the fragments of the members of a level
+    import generators.DS_generator as DS_generator
+    import generators.KG_generator as KG_generator
+    from models.KG import KG
+    kg_file = str(tmp_path / "kg.ttl")
+    KG_generator.streamKG(kg_file, 4, 3, 3, 1)
+    kg = KG(kg_file)
+    paths, plans = [], []
+    for i in range(count):
+        rng = np.random.default_rng(i)
+        plan = DS_generator.plan_ds(500, 6, 0.5, 0.1, kg, rng, fragments=True)
+        paths.append(str(tmp_path / ("ds%d.csv" % i)))
+        plans.append(plan)
+        DS_generator.write_ds(paths[-1], plan, rng, 128)
+    return kg, paths, plans
+
+
+def test_bulk_mount_does_not_depend_on_workers(tmp_path):
+    import executors.pool as pool
+    kg, paths, plans = lake(tmp_path, 3)
+    signatures = mapper_auto.get_level_signatures(kg)
+    state = {"max_distinct": mapper_auto.get_max_distinct(signatures), "chunk_size": 128,
+             "lshensemble": mapper_auto.initialize_lsh(kg, signatures), "kg": kg, "join_num_perm": 128}
+    outputs = dict()
+    for workers in (1, 2):
+        outputs[workers] = dict(pool.imap(mapper_auto.mount_file, paths, workers, state))
+    for i, plan in enumerate(plans):
+        serial, parallel = outputs[1][i], outputs[2][i]
+        assert serial["path"] == parallel["path"] == paths[i]
+        assert serial["num_rows"] == parallel["num_rows"] == 500
+        # Each dimension column is mapped to its level
+        assert serial["dimensions"] == parallel["dimensions"] == sorted((level, level) for level in plan["dimensions"])
+        assert np.array_equal(serial["combined"].hashvalues, parallel["combined"].hashvalues)
+        for col in serial["columns"]:
+            assert serial["sketches"][col].counts == parallel["sketches"][col].counts
+
+
+def columnar(tmp_path):
+    # The same source as CSV, Parquet, Arrow IPC file and Arrow IPC stream. The columnar files keep a pandas index,
+    # an integer column and missing values, written as empty strings in the CSV file.
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    df = frame(500)
+    df["attr0"] = df["attr0"].astype(int)
+    df.loc[df.index % 11 == 0, "L1"] = None
+    df.index = ["r%d" % i for i in range(len(df.index))]
+    paths = {fmt: str(tmp_path / ("ds." + fmt)) for fmt in ("csv", "parquet", "arrow", "ipc")}
+    df.to_csv(paths["csv"], index=False)
+    df.to_parquet(paths["parquet"])
+    table = pa.Table.from_pandas(df)
+    feather.write_feather(table, paths["arrow"], chunksize=64)
+    with pa.OSFile(paths["ipc"], 'wb') as sink:
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            for batch in table.to_batches(max_chunksize=64):
+                writer.write_batch(batch)
+    return paths
+
+
+def test_index_columns_are_not_read(tmp_path):
+    for path in columnar(tmp_path).values():
+        assert mapper_auto.read_columns(path) == ["L1", "attr0", "note"]
+
+
+def test_parquet_text_columns_are_categorical(tmp_path):
+    path = columnar(tmp_path)["parquet"]
+    chunks = list(mapper_auto.read_chunks(path, chunk_size=100, usecols=["note", "L1"]))
+    assert [len(chunk.index) for chunk in chunks] == [100] * 5
+    for chunk in chunks:
+        # Only the requested columns, in the requested order
+        assert list(chunk.columns) == ["note", "L1"]
+        assert isinstance(chunk["L1"].dtype, pd.CategoricalDtype)
+    assert "" in set(pd.concat(chunks)["L1"].astype(str))
+
+
+def test_columnar_scan_matches_csv(tmp_path):
+    paths = columnar(tmp_path)
+    expected = mapper_auto.scan_source(paths["csv"], chunk_size=100)
+    for fmt in ("parquet", "arrow", "ipc"):
+        for usecols in (None, ["attr0", "L1"]):
+            num_rows, columns, sketches = mapper_auto.scan_source(paths[fmt], chunk_size=100, usecols=usecols)
+            assert num_rows == expected[0]
+            assert columns == (usecols or expected[1])
+            for col in columns:
+                assert sketches[col].counts == expected[2][col].counts
+                assert np.array_equal(sketches[col].minhash.hashvalues, expected[2][col].minhash.hashvalues)
@@ -0,0 +1,41 @@
+from rdflib import URIRef
+from models.MG import MG, ns_project
+
+
+def mounted(tmp_path, names):
+    graph_name = str(tmp_path / "metadata.ttl")
+    open(graph_name, 'w').close()
+    mg = MG(graph_name)
+    for name in names:
+        mg.add_source(name, 10, ["a", "b"], "../datasets/%s.csv" % name)
+        mg.map(name, "a", "L1_D0")
+    mg.serialize()
+    return graph_name, mg
+
+
+def test_match_sources_by_id_name_uri_and_glob(tmp_path):
+    _, mg = mounted(tmp_path, ["sales_1", "sales_2", "stock", "other"])
+    sources = mg.get_sources()
+    uri = {name: URIRef(ns_project + name) for name in ["sales_1", "sales_2", "stock", "other"]}
+    assert mg.match_sources(["sales_*"]) == [s for s in sources if s in (uri["sales_1"], uri["sales_2"])]
+    assert mg.match_sources(["stock"]) == [uri["stock"]]
+    assert mg.match_sources([str(uri["other"])]) == [uri["other"]]
+    assert mg.match_sources(["*/test/st*"]) == [uri["stock"]]
+    assert mg.match_sources([str(sources.index(uri["stock"]))]) == [uri["stock"]]
+    # A source matching several patterns is returned once, in the order of get_sources
+    assert mg.match_sources(["other", "*", "0"]) == sources
+    assert mg.match_sources(["missing", "9"]) == []
+
+
+def test_unmount_several_sources(tmp_path):
+    graph_name, mg = mounted(tmp_path, ["sales_1", "sales_2", "stock"])
+    sources = mg.match_sources(["sales_*"])
+    assert mg.remove_sources(sources)
+    mg.serialize()
+    for reloaded in (mg, MG(graph_name)):
+        assert reloaded.get_sources() == [URIRef(ns_project + "stock")]
+        # The domains of the removed sources are gone too
+        for s in sources:
+            assert (s, None, None) not in reloaded.graph
+            assert (MG._domain_uri(s[len(ns_project):], "a"), None, None) not in reloaded.graph
+        assert (MG._domain_uri("stock", "a"), None, None) in reloaded.graph
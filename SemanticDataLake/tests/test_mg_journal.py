@@ -0,0 +1,123 @@
+import pytest
+from rdflib import URIRef, Literal
+from models.MG import MG, ns_project, ns_datalake
+
+
+def new_mg(tmp_path):
+    graph_name = str(tmp_path / "metadata.ttl")
+    open(graph_name, 'w').close()
+    return graph_name, MG(graph_name)
+
+
+def items(mg, source):
+    return sorted(int(o) for o in mg.graph.objects(URIRef(ns_project + source), ns_datalake.items))
+
+
+def test_replay_restores_committed_changes(tmp_path):
+    graph_name, mg = new_mg(tmp_path)
+    mg.add_source("ds0", 5000, ["a", "b"], "../datasets/ds0.csv")
+    mg.map("ds0", "a", "L1_D0")
+    mg.serialize()
+    mg.set_items(ns_project + "ds0", 6000)
+    mg.serialize()
+    reloaded = MG(graph_name)
+    assert set(reloaded.graph) == set(mg.graph)
+    assert items(reloaded, "ds0") == [6000]
+
+
+def test_uncommitted_changes_are_lost(tmp_path):
+    graph_name, mg = new_mg(tmp_path)
+    mg.add_source("ds0", 5000, ["a"], "../datasets/ds0.csv")
+    mg.serialize()
+    mg.set_items(ns_project + "ds0", 6000)
+    assert items(MG(graph_name), "ds0") == [5000]
+
+
+def test_torn_tail_is_truncated(tmp_path):
+    graph_name, mg = new_mg(tmp_path)
+    mg.add_source("ds0", 5000, ["a"], "../datasets/ds0.csv")
+    mg.serialize()
+    with open(mg.journal_name, 'a') as f:
+        f.write('+ <http://x/a> <http://x/p> "torn')
+    mg = MG(graph_name)
+    mg.set_items(ns_project + "ds0", 4242)
+    mg.serialize()
+    reloaded = MG(graph_name)
+    assert items(reloaded, "ds0") == [4242]
+    assert (URIRef("http://x/a"), None, None) not in reloaded.graph
+
+
+def test_literals_with_newlines(tmp_path):
+    graph_name, mg = new_mg(tmp_path)
+    path = 'dir\nwith "quotes"\r\\ and newlines.csv'
+    mg.add_source("ds0", 10, ["col\nname"], path)
+    mg.serialize()
+    reloaded = MG(graph_name)
+    assert set(reloaded.graph) == set(mg.graph)
+    assert Literal(path) in [Literal(str(o)) for o in reloaded.graph.objects(URIRef(ns_project + "ds0"),
+                                                                             ns_datalake.location)]
+
+
+def test_malformed_line_is_rejected(tmp_path):
+    graph_name, mg = new_mg(tmp_path)
+    mg.add_source("ds0", 10, ["a"], "ds0.csv")
+    mg.serialize()
+    with open(mg.journal_name, 'a') as f:
+        f.write('+ <http://x/a> <http://x/p> garbage .\n# commit\n')
+    with pytest.raises(ValueError):
+        MG(graph_name)
+
+
+def test_compaction(tmp_path):
+    graph_name, mg = new_mg(tmp_path)
+    mg.add_source("ds0", 5000, ["a"], "ds0.csv")
+    mg.serialize()
+    mg.compact()
+    with open(mg.journal_name) as f:
+        assert len(f.readlines()) == 1
+    mg.set_items(ns_project + "ds0", 7000)
+    mg.serialize()
+    reloaded = MG(graph_name)
+    assert set(reloaded.graph) == set(mg.graph)
+    assert items(reloaded, "ds0") == [7000]
+
+
+def mounted_mg(tmp_path):
+    import numpy as np
+    graph_name, mg = new_mg(tmp_path)
+    mg.add_source("ds0", 10, ["a"], "../datasets/ds0.csv")
+    mg.map("ds0", "a", "L1_D0")
+    mg.add_profile_pyramid("ds0", "a", {"L1_D0": (np.array([0, 3]), np.array([4, 6]))}, 0)
+    mg.sketches.put(ns_project + "ds0", ["a"], {"a": None}, [("L1_D0", "a")])
+    mg.serialize()
+    return graph_name, mg, MG._domain_uri("ds0", "a")
+
+
+def test_crash_before_journal_keeps_removed_profiles(tmp_path, monkeypatch):
+    graph_name, mg, domain = mounted_mg(tmp_path)
+    mg.remove_sources([ns_project + "ds0"])
+
+    def crash(term):
+        raise OSError("crash")
+    monkeypatch.setattr(MG, "_nt", staticmethod(crash))
+    with pytest.raises(OSError):
+        mg.serialize()
+    monkeypatch.undo()
+    # The removal was not committed: the source still refers to its profiles and sketches
+    reloaded = MG(graph_name)
+    assert (URIRef(ns_project + "ds0"), None, None) in reloaded.graph
+    pyramid, _ = reloaded.get_profile_pyramid(domain)
+    assert list(pyramid["L1_D0"][1]) == [4, 6]
+    assert reloaded.sketches.get(ns_project + "ds0")["columns"] == ["a"]
+
+
+def test_removed_profiles_are_deleted_after_the_journal(tmp_path):
+    import os
+    graph_name, mg, domain = mounted_mg(tmp_path)
+    mg.remove_sources([ns_project + "ds0"])
+    mg.serialize()
+    reloaded = MG(graph_name)
+    assert reloaded.get_profile_pyramid(domain) is None
+    assert reloaded.sketches.get(ns_project + "ds0") is None
+    assert [f for f in os.listdir(mg.profiles.folder) if f.endswith(".npy")] == []
+    assert os.listdir(mg.sketches.folder) == []
@@ -0,0 +1,85 @@
+import collections
+import numpy as np
+import pandas as pd
+import generators.KG_generator as KG_generator
+import executors.profiler as profiler
+from models.KG import KG
+
+
+def dict_profile(values, members):
+    # The profile as computed before the member indexes: member URI -> frequency, plus the "other" distinct values
+    frequency = dict()
+    count = pd.Index(values).value_counts()
+    for m in members:
+        m_fragment = m[m.rfind('/') + 1:]
+        if m_fragment in count:
+            frequency[m] = count[m_fragment]
+    delta = len(count) - len(frequency)
+    if delta > 0:
+        frequency["other"] = delta
+    return frequency
+
+
+def test_profile_matches_dict_profile(tmp_path):
+    kg_file = str(tmp_path / "kg.ttl")
+    KG_generator.streamKG(kg_file, 1, 2, 4, 1)
+    kg = KG(kg_file)
+    level = kg.get_levels()[-1]
+    members = [str(m) for m in kg.get_members_from_level(level, fragmentLevel=True)]
+    member_index = kg.get_member_index(level, fragmentLevel=True, fragmentKeys=True)
+    rng = np.random.default_rng(0)
+    fragments = [m[m.rfind('/') + 1:] for m in members]
+    # Only some members occur, with some values outside the level
+    values = list(rng.choice(fragments[:10], 300)) + ["x", "y", "y", ""]
+    expected = dict_profile(values, members)
+    frequency, other = profiler.profile_from_values(values, member_index)
+    assert profiler.to_dict(frequency, other, members) == expected
+    keys, counts = np.unique(values, return_counts=True)
+    frequency, other = profiler.profile_from_counts(keys, counts, member_index)
+    assert profiler.to_dict(frequency, other, members) == expected
+    assert other == 3 and len(frequency) == len(members)
+
+
+def test_pyramid_matches_naive_rollup(tmp_path):
+    kg_file = str(tmp_path / "kg.ttl")
+    KG_generator.streamKG(kg_file, 1, 3, 3, 1)
+    kg = KG(kg_file)
+    level = [l for l in kg.get_levels(kg.get_dimensions()[0]) if len(kg.get_level_closure(l)) == 3][0]
+    members = kg.get_members_from_level(level)
+    rng = np.random.default_rng(0)
+    values = [str(m) for m in rng.choice(members, 500)] + ["x"] * 20
+    frequency, other = profiler.profile_from_values(values, kg.get_member_index(level))
+    assert other == 1
+    pyramid = profiler.profile_pyramid(kg, level, frequency)
+    assert list(pyramid) == [str(l) for l in kg.get_level_closure(level)]
+
+    # Roll up each value member by member, one level at a time
+    counts = collections.Counter(v for v in values if v != "x")
+    for ancestor in kg.get_level_closure(level):
+        ancestor_members = [str(m) for m in kg.get_members_from_level(ancestor)]
+        ids, frequencies = pyramid[str(ancestor)]
+        assert dict(zip([ancestor_members[i] for i in ids], frequencies.tolist())) == dict(counts)
+        upper = collections.Counter()
+        for member, count in counts.items():
+            for parent in kg.get_upper_members(member):
+                upper[str(parent)] = upper[str(parent)] + count
+        counts = upper
+
+
+def test_similarity_matches_dense_measures():
+    from scipy import sparse
+    from scipy.spatial.distance import jensenshannon
+    rng = np.random.default_rng(1)
+    dense = rng.integers(0, 5, size=(6, 40)) * (rng.random((6, 40)) < 0.3)
+    dense[5] = 0
+    query = dense[0] + dense[1]
+    for measure in ("cosine", "js"):
+        similarities = profiler.similarity(sparse.csr_matrix(query), sparse.csr_matrix(dense), measure)
+        for i, row in enumerate(dense):
+            if row.sum() == 0:
+                expected = 0.0
+            elif measure == "cosine":
+                expected = row @ query / np.sqrt((row @ row) * (query @ query))
+            else:
+                expected = 1.0 - jensenshannon(row, query, base=2) ** 2
+            assert np.isclose(similarities[i], expected)
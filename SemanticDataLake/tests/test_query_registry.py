@@ -0,0 +1,57 @@
+import pytest
+from rdflib import Graph, Literal, Namespace, URIRef
+import models.QueryRegistry as query_registry
+from models.QueryRegistry import QueryRegistry
+
+EX = Namespace("http://x/")
+
+
+def graph():
+    g = Graph()
+    for i in range(5):
+        g.add((EX["s%d" % i], EX.value, Literal(i)))
+    return g
+
+
+def test_bindings_are_rdf_terms():
+    registry = QueryRegistry({"ex": EX})
+    registry.register("value", "SELECT ?v WHERE {?s ex:value ?v}")
+    g = graph()
+    assert [int(r[0]) for r in registry.run(g, "value", s=EX.s3)] == [3]
+    assert sorted(int(r[0]) for r in registry.run(g, "value")) == [0, 1, 2, 3, 4]
+    # A value that would break the query text is bound as a term
+    assert registry.run(g, "value", s=URIRef('http://x/s"} .')) == []
+
+
+def test_stats_count_runs():
+    registry = QueryRegistry({"ex": EX})
+    registry.register("value", "SELECT ?v WHERE {?s ex:value ?v}")
+    g = graph()
+    for _ in range(3):
+        registry.run(g, "value", s=EX.s1)
+    stats = registry.get_stats()
+    assert stats["value"]["count"] == 3 and stats["value"]["time"] > 0
+    registry.reset_stats()
+    assert registry.get_stats() == dict()
+
+
+def test_adhoc_queries_are_bounded(monkeypatch):
+    monkeypatch.setattr(query_registry, "ADHOC_CACHE_SIZE", 4)
+    registry = QueryRegistry({"ex": EX})
+    g = graph()
+    texts = ["SELECT ?s WHERE {?s ex:value %d}" % i for i in range(10)]
+    for i, text in enumerate(texts):
+        assert len(registry.run(g, text)) == (1 if i < 5 else 0)
+    # The most recently run texts stay prepared, and their runs are counted together
+    registry.run(g, texts[6])
+    registry.run(g, "SELECT ?s WHERE {?s ex:value 42}")
+    assert list(registry._adhoc) == [texts[8], texts[9], texts[6], "SELECT ?s WHERE {?s ex:value 42}"]
+    assert registry._texts == dict()
+    assert registry.get_stats()[query_registry.ADHOC]["count"] == 12
+
+
+def test_invalid_adhoc_query_is_not_kept():
+    registry = QueryRegistry({"ex": EX})
+    with pytest.raises(Exception):
+        registry.run(graph(), "SELECT WHERE {")
+    assert len(registry._adhoc) == 0 and registry.get_stats() == dict()
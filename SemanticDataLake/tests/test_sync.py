@@ -0,0 +1,129 @@
+import os
+import time
+import numpy as np
+import pandas as pd
+import executors.fingerprint as fingerprint
+import executors.mapper_auto as mapper_auto
+
+
+def write_rows(path, start, stop, mode='w'):
+    df = pd.DataFrame({"L1": ["m%d" % (i % 7) for i in range(start, stop)], "attr0": range(start, stop)},
+                      index=range(start, stop))
+    df.to_csv(path, mode=mode, header=(mode == 'w'))
+
+
+def test_detect_change(tmp_path):
+    path = str(tmp_path / "ds.csv")
+    write_rows(path, 0, 100)
+    previous = fingerprint.fingerprint(path, block_size=64)
+    assert fingerprint.detect_change(path, previous) == fingerprint.UNCHANGED
+    # Same content, touched
+    os.utime(path, ns=(time.time_ns(), previous["mtime"] + 10 ** 9))
+    assert fingerprint.detect_change(path, previous) == fingerprint.UNCHANGED
+    write_rows(path, 100, 150, mode='a')
+    assert fingerprint.detect_change(path, previous) == fingerprint.APPENDED
+    assert fingerprint.extend(path, previous) == fingerprint.fingerprint(path, block_size=64)
+    # A changed byte in the first rows
+    with open(path, 'r+b') as f:
+        f.seek(30)
+        byte = f.read(1)
+        f.seek(30)
+        f.write(b"9" if byte != b"9" else b"8")
+    assert fingerprint.detect_change(path, previous) == fingerprint.MODIFIED
+    # Truncated
+    write_rows(path, 0, 50)
+    assert fingerprint.detect_change(path, previous) == fingerprint.MODIFIED
+    os.remove(path)
+    assert fingerprint.detect_change(path, previous) == fingerprint.MISSING
+
+
+def test_append_to_partial_line_is_modified(tmp_path):
+    path = str(tmp_path / "ds.csv")
+    write_rows(path, 0, 10)
+    with open(path, 'a') as f:
+        f.write("10,m3")
+    previous = fingerprint.fingerprint(path)
+    with open(path, 'a') as f:
+        f.write(",10\n")
+    assert fingerprint.detect_change(path, previous) == fingerprint.MODIFIED
+
+
+def test_scan_stops_at_fingerprint(tmp_path):
+    path = str(tmp_path / "ds.csv")
+    write_rows(path, 0, 1000)
+    previous = fingerprint.fingerprint(path)
+    # Rows appended during the scan are not read by it
+    write_rows(path, 1000, 1200, mode='a')
+    num_rows, _, sketches = mapper_auto.scan_source(path, chunk_size=300, length=previous["size"])
+    assert num_rows == 1000
+    assert sum(sketches["L1"].counts.values()) == 1000
+
+
+def test_incremental_sync_matches_remount(tmp_path):
+    path = str(tmp_path / "ds.csv")
+    write_rows(path, 0, 1000)
+    previous = fingerprint.fingerprint(path)
+    write_rows(path, 1000, 1500, mode='a')
+    num_rows, columns, sketches = mapper_auto.scan_source(path, chunk_size=300, length=previous["size"])
+    combined, _ = mapper_auto.scan_combined(path, ["L1", "attr0"], 128, 300, previous["size"])
+    write_rows(path, 1500, 1800, mode='a')
+    assert fingerprint.detect_change(path, previous) == fingerprint.APPENDED
+    current = fingerprint.extend(path, previous)
+    tail_rows, combined = mapper_auto.scan_tail(path, previous["size"], columns, sketches, ["L1", "attr0"], combined,
+                                                128, 300, current["size"])
+
+    full_rows, _, full_sketches = mapper_auto.scan_source(path, chunk_size=300)
+    full_combined, _ = mapper_auto.scan_combined(path, ["L1", "attr0"], 128, 300)
+    assert num_rows + tail_rows == full_rows == 1800
+    for col in columns:
+        assert sketches[col].counts == full_sketches[col].counts
+        assert np.array_equal(sketches[col].minhash.hashvalues, full_sketches[col].minhash.hashvalues)
+    assert np.array_equal(combined.hashvalues, full_combined.hashvalues)
+
+
+def test_split_csv_starts_at_lines(tmp_path, monkeypatch):
+    path = str(tmp_path / "ds.csv")
+    write_rows(path, 0, 1000)
+    ranges = mapper_auto.split_csv(path, 4)
+    assert len(ranges) == 4
+    with open(path, 'rb') as f:
+        data = f.read()
+    assert ranges[0][0] == data.index(b"\n") + 1 and ranges[-1][1] == len(data)
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert end == start and data[start - 1:start] == b"\n"
+    # More parts than rows
+    write_rows(path, 0, 2)
+    assert len(mapper_auto.split_csv(path, 8)) <= 2
+
+    # Quoted values with line breaks, read in blocks smaller than the file so that quotes are counted across blocks
+    monkeypatch.setattr(mapper_auto, "SPLIT_BLOCK", 97)
+    df = pd.DataFrame({"L1": ["m%d" % (i % 7) for i in range(2000)],
+                       "note": ['line "%d"\nnext, line\n' % i if i % 3 == 0 else "n%d" % i for i in range(2000)]})
+    df.to_csv(path)
+    columns = mapper_auto.read_columns(path)
+    num_rows, _, sketches = mapper_auto.scan_source(path, 10, chunk_size=300)
+    for workers in range(1, 9):
+        ranges = mapper_auto.split_csv(path, workers)
+        assert len(ranges) == workers
+        parallel_rows, parallel_sketches = mapper_auto.scan_parallel(path, columns, workers, 10, 300)
+        assert parallel_rows == num_rows == 2000
+        for col in columns:
+            assert parallel_sketches[col].counts == sketches[col].counts
+            assert np.array_equal(parallel_sketches[col].minhash.hashvalues, sketches[col].minhash.hashvalues)
+
+
+def test_parallel_scan_matches_serial_scan(tmp_path):
+    path = str(tmp_path / "ds.csv")
+    write_rows(path, 0, 1000)
+    previous = fingerprint.fingerprint(path)
+    write_rows(path, 1000, 1200, mode='a')
+    columns = mapper_auto.read_columns(path)
+    num_rows, _, sketches = mapper_auto.scan_source(path, 10, chunk_size=300, length=previous["size"])
+    for workers in (1, 3):
+        parallel_rows, parallel_sketches = mapper_auto.scan_parallel(path, columns, workers, 10, 300, previous["size"])
+        assert parallel_rows == num_rows == 1000
+        for col in columns:
+            assert parallel_sketches[col].counts == sketches[col].counts
+            assert np.array_equal(parallel_sketches[col].minhash.hashvalues, sketches[col].minhash.hashvalues)
+    # The counts of L1 are kept, the ones of the other columns are dropped
+    assert parallel_sketches["L1"].counts is not None and parallel_sketches["attr0"].counts is None
@@ -0,0 +1,28 @@
+import random
+import utils.timing as timing
+
+
+def histogram(values):
+    h = timing._Histogram()
+    for v in values:
+        h.add(v)
+    return h
+
+
+def test_merge_keeps_all_samples_below_the_limit():
+    merged = histogram([1.0, 2.0])
+    merged.merge(histogram([3.0]))
+    assert sorted(merged.samples) == [1.0, 2.0, 3.0]
+    assert merged.count == 3 and merged.total == 6.0 and merged.max == 3.0
+
+
+def test_merge_weights_samples_by_count():
+    random.seed(0)
+    # A full reservoir standing for 100 times its samples, and a small histogram
+    large = histogram([1.0] * (100 * timing.MAX_SAMPLES))
+    small = histogram([2.0] * timing.MAX_SAMPLES)
+    large.merge(small)
+    assert len(large.samples) == timing.MAX_SAMPLES
+    # About 1% of the samples come from the small histogram, not half of them
+    assert large.samples.count(2.0) < 0.03 * timing.MAX_SAMPLES
+    assert large.percentile(0.95) == 1.0
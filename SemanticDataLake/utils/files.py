@@ -0,0 +1,37 @@
+import os
+
+
+def _get_umask():
+    # The umask can only be read by setting it: it is read once, at import, since other threads may create files
+    # while it is changed
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+# The umask of the process, masking the default permissions of the files written through ``replace``
+UMASK = _get_umask()
+
+
+def set_default_mode(path):
+    """Gives a file (or folder) made by ``tempfile`` the permissions of one made by ``open`` (or ``os.mkdir``), i.e.
+    the default ones masked by the umask: ``tempfile`` makes them accessible by the owner only, and ``os.replace``
+    keeps them
+
+    :param path: the path of the file or folder
+    :type path: str
+    """
+    mode = 0o777 if os.path.isdir(path) else 0o666
+    os.chmod(path, mode & ~UMASK)
+
+
+def replace(tmp_file, destination):
+    """Moves a temporary file to its destination, atomically, with the default permissions
+
+    :param tmp_file: the path of the temporary file
+    :type tmp_file: str
+    :param destination: the path of the destination
+    :type destination: str
+    """
+    set_default_mode(tmp_file)
+    os.replace(tmp_file, destination)
@@ -0,0 +1,223 @@
+import json
+import math
+import time
+import random
+
+# Number of durations kept per operation to estimate its percentiles: beyond it, durations are sampled uniformly
+MAX_SAMPLES = 1024
+
+_enabled = False
+# Names of the open spans, outermost first
+_stack = []
+# Full span name -> histogram
+_histograms = dict()
+
+
+class _Histogram:
+    """Count, total and maximum of the durations of an operation, with a uniform sample of them for the percentiles"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = []
+
+    def add(self, seconds):
+        self.count = self.count + 1
+        self.total = self.total + seconds
+        self.max = max(self.max, seconds)
+        if len(self.samples) < MAX_SAMPLES:
+            self.samples.append(seconds)
+        else:
+            # Reservoir sampling: every duration is kept with the same probability
+            i = random.randrange(self.count)
+            if i < MAX_SAMPLES:
+                self.samples[i] = seconds
+
+    def merge(self, other):
+        count = self.count + other.count
+        samples = self.samples + other.samples
+        if len(samples) > MAX_SAMPLES:
+            # Each sample stands for count / len(samples) durations of its histogram: the number of samples drawn
+            # from each one is the number of its durations among MAX_SAMPLES drawn from all of them
+            remaining, remaining_self, taken = count, self.count, 0
+            for _ in range(MAX_SAMPLES):
+                if random.randrange(remaining) < remaining_self:
+                    remaining_self = remaining_self - 1
+                    taken = taken + 1
+                remaining = remaining - 1
+            samples = random.sample(self.samples, taken) + random.sample(other.samples, MAX_SAMPLES - taken)
+        self.count = count
+        self.total = self.total + other.total
+        self.max = max(self.max, other.max)
+        self.samples = samples
+
+    def percentile(self, p):
+        if len(self.samples) == 0:
+            return 0.0
+        ordered = sorted(self.samples)
+        # Nearest-rank percentile
+        return ordered[max(int(math.ceil(p * len(ordered))) - 1, 0)]
+
+
+class _Span:
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        _stack.append(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        elapsed = time.perf_counter() - self.start
+        name = "/".join(_stack)
+        _stack.pop()
+        _add(name, elapsed)
+        return False
+
+
+class _NullSpan:
+    # Returned when timing is disabled: entering and leaving it does nothing
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def _add(name, seconds):
+    histogram = _histograms.get(name)
+    if histogram is None:
+        histogram = _histograms[name] = _Histogram()
+    histogram.add(seconds)
+
+
+def enable(enabled=True):
+    """Turns the collection of timings on or off. Collected timings are kept until ``reset``
+
+    :param enabled: a boolean expressing whether timings are collected (default is True)
+    :type enabled: bool
+    """
+    global _enabled
+    _enabled = enabled
+
+
+def is_enabled():
+    return _enabled
+
+
+def span(name):
+    """Returns a context manager that times the enclosed block as the operation ``name``. Spans can be nested: the
+    name of a span includes the names of the enclosing ones, separated by '/'. When timing is disabled, a shared
+    object that does nothing is returned.
+
+    :param name: the name of the operation
+    :type name: str
+    :returns: the context manager
+    """
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name)
+
+
+def timed_iter(name, iterable):
+    """Yields the items of an iterable, timing the production of each item as the operation ``name``, e.g. the
+    reading of each chunk of a file. The iterable is returned unchanged when timing is disabled.
+
+    :param name: the name of the operation
+    :type name: str
+    :param iterable: the iterable
+    :returns: an iterator over the same items
+    """
+    if not _enabled:
+        return iterable
+    return _timed_iter(name, iterable)
+
+
+def _timed_iter(name, iterable):
+    iterator = iter(iterable)
+    while True:
+        with span(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def drain():
+    """Returns the timings collected so far and forgets them, e.g. to hand the timings of a worker process over to
+    the parent one
+
+    :returns: the histograms, by span name
+    :rtype: dict
+    """
+    global _histograms
+    histograms = _histograms
+    _histograms = dict()
+    return histograms
+
+
+def merge(histograms):
+    """Adds timings returned by ``drain`` under the spans that are open, so that the operations run by a worker
+    process for a task appear inside the span of the parent that started the task
+
+    :param histograms: the histograms, by span name
+    :type histograms: dict
+    """
+    prefix = "/".join(_stack)
+    for name, histogram in histograms.items():
+        full_name = prefix + "/" + name if prefix else name
+        if full_name not in _histograms:
+            _histograms[full_name] = _Histogram()
+        _histograms[full_name].merge(histogram)
+
+
+def reset():
+    """Forgets the timings collected so far
+    """
+    _histograms.clear()
+
+
+def init_worker(enabled):
+    """Prepares the timings of a worker process: the spans and timings inherited from the parent process, when it is
+    forked, are forgotten
+
+    :param enabled: a boolean expressing whether timings are collected
+    :type enabled: bool
+    """
+    del _stack[:]
+    _histograms.clear()
+    enable(enabled)
+
+
+def get_stats():
+    """Returns the aggregated timings of each operation, in seconds
+
+    :returns: a dictionary including, for each span name in alphabetical order, its count, total, p50, p95 and max
+    :rtype: dict
+    """
+    return {name: {"count": h.count, "total": h.total, "p50": h.percentile(0.5), "p95": h.percentile(0.95),
+                   "max": h.max}
+            for name, h in sorted(_histograms.items())}
+
+
+def export(path, extra=None):
+    """Writes the aggregated timings as JSON
+
+    :param path: the path of the output file
+    :type path: str
+    :param extra: further sections to write next to the timings, e.g. the statistics of the queries
+    :type extra: dict
+    """
+    output = {"timestamp": time.time(), "spans": get_stats()}
+    if extra:
+        output.update(extra)
+    with open(path, 'w') as f:
+        json.dump(output, f, indent=2)